@@ -0,0 +1,103 @@
+"""
+进程内下载引擎吞吐测试
+
+在本地启动一个支持Range的文件服务, 用 AsyncNativeInterface 下载到临时目录, 输出 files/s 和 MB/s
+
+usage: python -m benchmarks.bench_native_download --files 200 --size-mb 4
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==== Customized Modules ====
+from utils import WebSession
+from downloader import native_downloader
+from downloader.native_downloader import AsyncNativeInterface
+
+
+def make_handler(payload: bytes):
+    class FileHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            start = 0
+            match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1))
+                if start >= len(payload):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(payload)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}"
+                )
+            else:
+                self.send_response(200)
+            body = payload[start:]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return FileHandler
+
+
+async def run(base_url: str, n_files: int) -> float:
+    interface = AsyncNativeInterface()
+    interface.tasks = [
+        {
+            "url": f"{base_url}/data/spot/daily/aggTrades/BENCH/BENCH-aggTrades-{n}.zip",
+            "save_dir": "data/spot/daily/aggTrades/BENCH",
+        }
+        for n in range(n_files)
+    ]
+    start = time.perf_counter()
+    async with WebSession():
+        await interface.download_all()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(payload))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        native_downloader.config["save_downloaded_data_dir"] = tmp_dir
+        try:
+            seconds = asyncio.run(run(base_url, args.files))
+        finally:
+            server.shutdown()
+        save_dir = os.path.join(tmp_dir, "data/spot/daily/aggTrades/BENCH")
+        assert all(
+            os.path.getsize(os.path.join(save_dir, f)) == len(payload)
+            for f in os.listdir(save_dir)
+        ), "size mismatch"
+
+    total_mb = args.files * len(payload) / 1024 / 1024
+    print(f"files     : {args.files}")
+    print(f"seconds   : {seconds:10.2f}")
+    print(f"files/s   : {args.files / seconds:10.1f}")
+    print(f"MB/s      : {total_mb / seconds:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
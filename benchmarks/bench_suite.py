@@ -0,0 +1,317 @@
+"""
+热点路径的离线基准测试
+
+在临时目录中生成合成数据(benchmarks.synthetic), 通过 BINANCE_DOWNLOADER_CONFIG 指向临时配置,
+不会读写真实的数据目录. 结果输出为json, 可以与之前的结果比较, 变慢超过阈值时返回非0
+
+usage:
+    python -m benchmarks.bench_suite --rows 1000000 --output bench.json
+    python -m benchmarks.bench_suite --baseline bench.json --tolerance 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import yaml
+
+# 不能导入utils.paths, 导入utils时各模块就会读取配置
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 数据目录相关的配置项, 全部改到临时目录
+PATH_KEYS = [
+    "save_downloaded_data_dir",
+    "save_released_data_dir",
+    "listing_cache_dir",
+    "checksum_cache_path",
+    "manifest_path",
+    "hive_view_dir",
+    "catalog_path",
+    "metrics_dir",
+    "trace_dir",
+]
+
+
+def write_config(tmp_dir: str) -> str:
+    """复制项目配置, 数据目录改到tmp_dir, 返回配置文件路径"""
+    with open(os.path.join(PROJECT_PATH, "config.yaml"), "r") as fin:
+        config = yaml.load(fin, Loader=yaml.FullLoader)
+    for key in PATH_KEYS:
+        config[key] = os.path.join(tmp_dir, os.path.basename(config[key]))
+    config_path = os.path.join(tmp_dir, "config.yaml")
+    with open(config_path, "w") as fout:
+        yaml.dump(config, fout)
+    return config_path
+
+
+def measure(fn: Callable, repeat: int, items: int, unit: str) -> dict:
+    """运行repeat次, 记录每次的秒数
+
+    Args:
+        fn (Callable): 被测函数
+        repeat (int): 次数
+        items (int): 每次处理的数量, 用于计算吞吐
+        unit (str): 数量的单位, eg: "rows", "MB"
+    """
+    runs: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    median = statistics.median(runs)
+    return {
+        "runs": runs,
+        "median_s": median,
+        "min_s": min(runs),
+        "items": items,
+        "unit": unit,
+        "rate": items / median if median else None,
+    }
+
+
+def run_suite(tmp_dir: str, rows: int, days: int, repeat: int, only: list) -> dict:
+    """生成数据并运行所有用例, 项目模块在配置写好之后才导入"""
+    import polars as pl
+    from benchmarks import synthetic
+    from utils import CheckSum, TimeTools
+    from utils.path_tools import Binance
+    from downloader import release
+    from downloader.release import Release
+    from data_reader.catalog import Catalog
+    from data_reader.reader import DataReader
+    from data_transformer.aggtrades_to_kline import Spot
+
+    download_dir = release.config["save_downloaded_data_dir"]
+    symbol_dir = os.path.join(download_dir, "data/spot/daily/aggTrades/BENCHUSDT")
+    start = datetime(2024, 1, 1)
+    dates = [(start + timedelta(days=n)).strftime("%Y-%m-%d") for n in range(days)]
+
+    print(f"Generating {days} daily aggTrades files of {rows} rows.")
+    zips: list[str] = []
+    for n, date in enumerate(dates):
+        zip_path = os.path.join(symbol_dir, f"BENCHUSDT-aggTrades-{date}.zip")
+        synthetic.write_zip(
+            synthetic.aggtrades_frame(rows, date, seed=n, first_id=n * rows), zip_path
+        )
+        zips.append(zip_path)
+    trades_zip = os.path.join(
+        download_dir, "data/spot/daily/trades/BENCHUSDT/BENCHUSDT-trades-2024-01-01.zip"
+    )
+    synthetic.write_zip(synthetic.trades_frame(rows), trades_zip)
+    zip_mb = os.path.getsize(zips[0]) / 1024 / 1024
+
+    # 读取类用例的数据: 全部发布并写入索引
+    for zip_path in zips:
+        Release.zip2parquet(zip_path, skip_existed=False)
+    Catalog.update([Catalog.record(Release.get_release_path(p)) for p in zips])
+    released = Release.get_release_path(zips[0])
+    at_df = pl.read_parquet(released)
+    # 索引查找用例: 500个标的 x 一年的日度记录, 不需要真实文件
+    year = [(start + timedelta(days=d)).strftime("%Y-%m-%d") for d in range(365)]
+    fake_records = [
+        {
+            "market": "spot",
+            "period": "daily",
+            "data_type": "trades",
+            "frequency": "trades",
+            "symbol": f"SYM{s:03d}USDT",
+            "date": date,
+            "path": f"data/spot/daily/trades/SYM{s:03d}USDT/"
+            f"SYM{s:03d}USDT-trades-{date}.parquet",
+            "size": 1,
+            "rows": 1,
+            "mtime": 0.0,
+        }
+        for s in range(500)
+        for date in year
+    ]
+    Catalog.update(fake_records)
+    zip_paths = [
+        f"data/spot/daily/aggTrades/{r['symbol']}/{r['symbol']}-aggTrades-{r['date']}.zip"
+        for r in fake_records[:100_000]
+    ]
+    listing_page = synthetic.listing_xml(
+        "data/spot/daily/aggTrades/BENCHUSDT/",
+        [
+            f"data/spot/daily/aggTrades/BENCHUSDT/BENCHUSDT-aggTrades-{d}.zip"
+            for d in range(1000)
+        ],
+        next_marker="m",
+    )
+    out_path = os.path.join(tmp_dir, "out.parquet")
+
+    def save_batched():
+        # 强制分块路径
+        limit = release.config["release_inmemory_max_bytes"]
+        release.config["release_inmemory_max_bytes"] = 0
+        try:
+            Release.save_parquet(zips[0], out_path)
+        finally:
+            release.config["release_inmemory_max_bytes"] = limit
+
+    cases: dict[str, tuple] = {
+        "release_save_parquet_aggtrades": (
+            lambda: Release.save_parquet(zips[0], out_path),
+            rows,
+            "rows",
+        ),
+        "release_save_parquet_aggtrades_batched": (save_batched, rows, "rows"),
+        "release_save_parquet_trades": (
+            lambda: Release.save_parquet(trades_zip, out_path),
+            rows,
+            "rows",
+        ),
+        "release_zip2parquet": (
+            lambda: Release.zip2parquet(zips[0], skip_existed=False),
+            rows,
+            "rows",
+        ),
+        "checksum_verify": (
+            lambda: CheckSum.verify_checksum(zips[0], use_cache=False),
+            zip_mb,
+            "MB",
+        ),
+        "checksum_verify_cached": (
+            lambda: CheckSum.verify_checksum(zips[0], use_cache=True),
+            1,
+            "files",
+        ),
+        "kline_1m": (lambda: Spot.bn_aggTrades_to_kline(at_df, "1m"), rows, "rows"),
+        "kline_1h": (lambda: Spot.bn_aggTrades_to_kline(at_df, "1h"), rows, "rows"),
+        "reader_read_parquet": (
+            lambda: DataReader.read_parquet(
+                "spot", "daily", "aggTrades", symbols="BENCHUSDT"
+            ),
+            rows * days,
+            "rows",
+        ),
+        "reader_read_parquet_one_day": (
+            lambda: DataReader.read_parquet(
+                "spot",
+                "daily",
+                "aggTrades",
+                symbols="BENCHUSDT",
+                start_date=dates[-1],
+                end_date=dates[-1],
+            ),
+            rows,
+            "rows",
+        ),
+        "reader_get_file_path": (
+            lambda: DataReader.get_file_path(
+                "spot",
+                "daily",
+                "trades",
+                start_date="2024-03-01",
+                end_date="2024-03-31",
+                symbols=[f"SYM{s:03d}USDT" for s in range(0, 500, 10)],
+            ),
+            50,
+            "symbols",
+        ),
+        "time_filter": (
+            lambda: TimeTools.time_filter("2024-03-01", "2024-06-30", zip_paths),
+            len(zip_paths),
+            "paths",
+        ),
+        "listing_parse": (lambda: Binance.parse_listing(listing_page), 1000, "keys"),
+    }
+    results: dict[str, dict] = {}
+    for name, (fn, items, unit) in cases.items():
+        if only and not any(kw in name for kw in only):
+            continue
+        # 先运行一次预热(导入, 缓存)
+        fn()
+        results[name] = measure(fn, repeat, items, unit)
+        print(
+            f"{name:45s} {results[name]['median_s'] * 1000:10.1f} ms  "
+            f"{results[name]['rate']:14.1f} {unit}/s"
+        )
+    return results
+
+
+def meta(args: argparse.Namespace) -> dict:
+    import polars as pl
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "polars": pl.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "rows": args.rows,
+        "days": args.days,
+        "repeat": args.repeat,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """与基准比较中位数, 返回变慢超过tolerance的用例"""
+    regressions: list[str] = []
+    print(f"\n{'case':45s} {'baseline ms':>12s} {'current ms':>12s} {'ratio':>8s}")
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]["median_s"]
+        ratio = result["median_s"] / base if base else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = "faster"
+        result["baseline_median_s"] = base
+        result["ratio"] = ratio
+        print(
+            f"{name:45s} {base * 1000:12.1f} {result['median_s'] * 1000:12.1f} "
+            f"{ratio:8.2f} {flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000, help="每个文件的行数")
+    parser.add_argument("--days", type=int, default=7, help="读取用例的日度文件数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", nargs="*", default=None, help="只运行名称包含这些词的用例"
+    )
+    parser.add_argument("--output", default=None, help="结果保存为json")
+    parser.add_argument("--baseline", default=None, help="与之前的json结果比较")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 必须在导入项目模块之前设置, 各模块导入时读取配置
+        os.environ["BINANCE_DOWNLOADER_CONFIG"] = write_config(tmp_dir)
+        results = run_suite(tmp_dir, args.rows, args.days, args.repeat, args.only)
+
+    regressions: list[str] = []
+    if args.baseline:
+        with open(args.baseline, "r") as fin:
+            regressions = compare(results, json.load(fin), args.tolerance)
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump({"meta": meta(args), "results": results}, fout, indent=2)
+    if regressions:
+        print(f"\n{len(regressions)} regressions: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
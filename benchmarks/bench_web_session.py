@@ -0,0 +1,95 @@
+"""
+WebGet 连接复用基准测试
+
+在本地启动一个返回S3 ListBucketResult的HTTP服务, 分别用
+    1. 每个请求新建 httpx.AsyncClient (不打开WebSession)
+    2. 共享连接池 (打开WebSession)
+请求同样数量的页面, 输出 requests/s
+
+usage: python -m benchmarks.bench_web_session --requests 2000
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==== Customized Modules ====
+from utils import WebGet, WebSession
+
+LISTING_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+    "<Name>data.binance.vision</Name><Prefix>data/spot/daily/aggTrades/</Prefix>"
+    "<IsTruncated>false</IsTruncated>"
+    + "".join(
+        f"<CommonPrefixes><Prefix>data/spot/daily/aggTrades/SYM{n}USDT/</Prefix></CommonPrefixes>"
+        for n in range(50)
+    )
+    + "</ListBucketResult>"
+).encode()
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才会保持连接
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(LISTING_XML)))
+        self.end_headers()
+        self.wfile.write(LISTING_XML)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ListingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def fetch_all(url: str, n_requests: int, pooled: bool) -> float:
+    """请求n_requests次, 返回requests/s"""
+    start = time.perf_counter()
+    if pooled:
+        async with WebSession():
+            await asyncio.gather(
+                *[WebGet.async_fetch_with_retry(url) for _ in range(n_requests)]
+            )
+    else:
+        await asyncio.gather(
+            *[WebGet.async_fetch_with_retry(url) for _ in range(n_requests)]
+        )
+    return n_requests / (time.perf_counter() - start)
+
+
+async def compare(url: str, n_requests: int) -> tuple[float, float]:
+    # 两种方式在同一个循环内先后运行, 共用同一个HostLimiter
+    before = await fetch_all(url, n_requests, pooled=False)
+    after = await fetch_all(url, n_requests, pooled=True)
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/?delimiter=/&prefix=data/"
+    try:
+        before, after = asyncio.run(compare(url, args.requests))
+    finally:
+        server.shutdown()
+    print(f"per-request client: {before:10.1f} requests/s")
+    print(f"pooled WebSession : {after:10.1f} requests/s")
+    print(f"speedup           : {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+下载和发布的离线端到端压测
+
+在子进程中启动 benchmarks.simulator (模拟 data.binance.vision 和 Gospeed),
+通过 BINANCE_DOWNLOADER_CONFIG 把列表/下载/Gospeed 地址和数据目录指向本地,
+依次运行 Downloader.create_copy 和 Release.release_binance_data, 输出各阶段的吞吐
+
+默认 100 个标的 x 500 天 = 5万个压缩包 + 5万个校验和, 生成的目录可以用 --tree 复用
+
+usage:
+    python -m benchmarks.load_test --tree /tmp/sim_tree --output load.json
+    python -m benchmarks.load_test --backend native --latency-ms 50 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import yaml
+
+from benchmarks.bench_suite import PROJECT_PATH, write_config
+from benchmarks.simulator import DATA_PREFIX, add_fault_args, generate_tree
+
+
+def start_simulator(tree: str, args: argparse.Namespace) -> tuple:
+    """启动模拟服务子进程, 返回 (进程, 地址信息)"""
+    cmd = [sys.executable, "-m", "benchmarks.simulator", "--root", tree]
+    for name in [
+        "latency_ms",
+        "bandwidth_kbps",
+        "error_rate",
+        "throttle_rate",
+        "retry_after",
+        "gospeed_error_rate",
+        "page_size",
+        "gospeed_workers",
+    ]:
+        cmd += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    proc = subprocess.Popen(cmd, cwd=PROJECT_PATH, stdout=subprocess.PIPE, text=True)
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("Simulator exited before ready.")
+        if line.startswith("{"):
+            return proc, json.loads(line)
+
+
+def sim_config(tmp_dir: str, info: dict, args: argparse.Namespace) -> str:
+    """在基准测试配置的基础上改为模拟服务的地址"""
+    config_path = write_config(tmp_dir)
+    with open(config_path, "r") as fin:
+        config = yaml.load(fin, Loader=yaml.FullLoader)
+    config.update(
+        {
+            "binance_listing_url": info["binance_url"] + "?delimiter=/&prefix=",
+            "binance_download_url": info["binance_url"],
+            "gospeed_api_url": info["gospeed_url"],
+            # 模拟的Gospeed与本进程在同一台机器上, 直接写入下载目录
+            "gospeed_download_dir": config["save_downloaded_data_dir"],
+            "download_backend": args.backend,
+            "max_download_tasks": args.max_download_tasks,
+            "gospeed_poll_interval": args.poll_interval,
+        }
+    )
+    with open(config_path, "w") as fout:
+        yaml.dump(config, fout)
+    return config_path
+
+
+def fetch_stats(url: str) -> dict:
+    with urllib.request.urlopen(url + "_stats") as response:
+        return json.loads(response.read())
+
+
+def run(info: dict, args: argparse.Namespace) -> dict:
+    """项目模块在配置写好之后才导入"""
+    from downloader.downloader import Downloader
+    from downloader.release import Release
+    from utils import Manifest
+
+    phases: dict[str, dict] = {}
+    start = time.perf_counter()
+    asyncio.run(
+        Downloader().create_copy(
+            "spot",
+            "daily",
+            "aggTrades",
+            data_type="aggTrades",
+            spot_filter=False,
+        )
+    )
+    seconds = time.perf_counter() - start
+    binance_stats = fetch_stats(info["binance_url"])
+    n_zips = len(Manifest.zip_keys(only_unreleased=False))
+    phases["download"] = {
+        "seconds": seconds,
+        "files": binance_stats.get("files", 0),
+        "zips": n_zips,
+        "listing_pages": binance_stats.get("listing_pages", 0),
+        "files_per_s": binance_stats.get("files", 0) / seconds,
+        "mb_per_s": binance_stats.get("bytes", 0) / 1024 / 1024 / seconds,
+    }
+    print(
+        f"download: {seconds:.1f} s, {phases['download']['files_per_s']:.1f} files/s, "
+        f"{phases['download']['mb_per_s']:.2f} MB/s"
+    )
+
+    if not args.skip_release:
+        start = time.perf_counter()
+        Release.release_binance_data()
+        seconds = time.perf_counter() - start
+        released = n_zips - len(Manifest.zip_keys(only_unreleased=True))
+        phases["release"] = {
+            "seconds": seconds,
+            "files": released,
+            "files_per_s": released / seconds,
+            "rows_per_s": released * args.rows / seconds,
+        }
+        print(
+            f"release: {seconds:.1f} s, {phases['release']['files_per_s']:.1f} files/s, "
+            f"{phases['release']['rows_per_s']:.0f} rows/s"
+        )
+    return {
+        "phases": phases,
+        "binance": fetch_stats(info["binance_url"]),
+        "gospeed": fetch_stats(info["gospeed_url"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", default=None, help="模拟目录, 不存在时生成")
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--days", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=100, help="每个文件的行数")
+    parser.add_argument("--backend", choices=["gospeed", "native"], default="gospeed")
+    parser.add_argument("--max-download-tasks", type=int, default=128)
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--skip-release", action="store_true")
+    parser.add_argument("--output", default=None, help="结果保存为json")
+    add_fault_args(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tree = args.tree or os.path.join(tmp_dir, "tree")
+        start = time.perf_counter()
+        n_files = generate_tree(tree, args.symbols, args.days, args.rows)
+        print(
+            f"Tree {tree}: {n_files} files under {DATA_PREFIX} "
+            f"({time.perf_counter() - start:.1f} s)."
+        )
+        proc, info = start_simulator(tree, args)
+        try:
+            # 必须在导入项目模块之前设置, 各模块导入时读取配置
+            os.environ["BINANCE_DOWNLOADER_CONFIG"] = sim_config(tmp_dir, info, args)
+            result = run(info, args)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    result["args"] = vars(args)
+    print(json.dumps(result["binance"]), json.dumps(result["gospeed"]))
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(result, fout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,559 @@
+"""
+data.binance.vision 和 Gospeed 的本地模拟服务, 用于离线的端到端压测
+
+1. S3 列表: GET /?delimiter=/&prefix=...&marker=... 返回 ListBucketResult, 按 page_size 分页(NextMarker)
+2. 文件: GET /data/... 返回本地目录中的 zip 和 .CHECKSUM, 支持 Range
+3. Gospeed REST API: resolve / 创建任务 / 任务列表 / 任务详情 / 删除任务,
+   任务由 gospeed_workers 个线程从文件服务下载到 opt.path
+4. 故障注入: 每个请求的延迟, 每个连接的带宽, 随机500, 随机503(带Retry-After)
+5. GET /_stats 返回请求计数
+
+目录由 generate_tree 生成, 结构与 data.binance.vision 相同(data/spot/daily/aggTrades/{symbol}/...)
+
+usage:
+    python -m benchmarks.simulator --root /tmp/sim_tree --generate --symbols 100 --days 500
+    python -m benchmarks.simulator --root /tmp/sim_tree --latency-ms 20 --error-rate 0.01
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from joblib import Parallel, delayed
+
+from benchmarks import synthetic
+
+DATA_PREFIX = "data/spot/daily/aggTrades/"
+CHUNK_SIZE = 64 * 1024
+
+
+def symbol_name(n: int) -> str:
+    return f"SIM{n:04d}USDT"
+
+
+def _generate_symbol(root: str, n: int, days: int, rows: int) -> int:
+    symbol = symbol_name(n)
+    start = datetime(2021, 1, 1)
+    for d in range(days):
+        date = (start + timedelta(days=d)).strftime("%Y-%m-%d")
+        zip_path = os.path.join(
+            root, DATA_PREFIX, symbol, f"{symbol}-aggTrades-{date}.zip"
+        )
+        if os.path.exists(zip_path + ".CHECKSUM"):
+            continue
+        synthetic.write_zip(
+            synthetic.aggtrades_frame(rows, date, seed=n * days + d, first_id=d * rows),
+            zip_path,
+        )
+    return days * 2
+
+
+def generate_tree(root: str, symbols: int, days: int, rows: int) -> int:
+    """生成 symbols x days 个日度aggTrades压缩包和校验和, 已存在的跳过
+
+    Returns:
+        int: 文件数(zip + CHECKSUM)
+    """
+    counts = Parallel(n_jobs=-1)(
+        delayed(_generate_symbol)(root, n, days, rows) for n in range(symbols)
+    )
+    return sum(counts)
+
+
+class Faults:
+    """故障注入参数, 所有请求共用"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        bandwidth_kbps: float = 0,
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        retry_after: float = 1,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency_ms / 1000
+        self.bandwidth = bandwidth_kbps * 1024
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self) -> str:
+        """本次请求的结果: "ok", "error"(500) 或 "throttle"(503)"""
+        with self.lock:
+            x = self.rng.random()
+        if x < self.error_rate:
+            return "error"
+        if x < self.error_rate + self.throttle_rate:
+            return "throttle"
+        return "ok"
+
+
+class ObjectStore:
+    """root目录下所有文件的key, 按字典序排序, 用二分查找分页"""
+
+    def __init__(self, root: str, page_size: int = 1000) -> None:
+        self.root = root
+        self.page_size = page_size
+        keys: list[str] = []
+        for dir_path, _, files in os.walk(os.path.join(root, "data")):
+            rel = os.path.relpath(dir_path, root).replace(os.sep, "/")
+            keys.extend(f"{rel}/{f}" for f in files if not f.endswith(".part"))
+        self.keys = sorted(keys)
+
+    def list_page(self, prefix: str, marker: str = "") -> tuple:
+        """与S3 delimiter=/ 的语义一致: 子目录合并为 CommonPrefixes
+
+        Returns:
+            tuple: (keys, prefixes, next_marker), 最后一页next_marker为空
+        """
+        i = bisect_right(self.keys, marker) if marker > prefix else 0
+        i = max(i, bisect_left(self.keys, prefix))
+        keys: list[str] = []
+        prefixes: list[str] = []
+        last = ""
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            if len(keys) + len(prefixes) == self.page_size:
+                return keys, prefixes, last
+            rest = self.keys[i][len(prefix) :]
+            if "/" in rest:
+                last = prefix + rest[: rest.index("/") + 1]
+                # marker为子目录时跳过该子目录下所有key
+                if last > marker:
+                    prefixes.append(last)
+                i = bisect_left(self.keys, last + "\uffff")
+                continue
+            last = self.keys[i]
+            keys.append(last)
+            i += 1
+        return keys, prefixes, ""
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.counter: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counter[name] += n
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return dict(self.counter)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "BinanceSimulator"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_json(self, data, status: int = 200):
+        self.send_body(status, json.dumps(data).encode(), "application/json")
+
+    def inject(self) -> bool:
+        """延迟和随机错误, 返回False时已经回复了错误"""
+        faults: Faults = self.server.faults
+        if faults.latency:
+            time.sleep(faults.latency)
+        outcome = faults.draw()
+        if outcome == "ok":
+            return True
+        self.server.stats.add(outcome)
+        if outcome == "throttle":
+            self.send_body(
+                503,
+                b"SlowDown",
+                "text/plain",
+                {"Retry-After": f"{faults.retry_after:g}"},
+            )
+        else:
+            self.send_body(500, b"InternalError", "text/plain")
+        return False
+
+
+class BinanceHandler(_Handler):
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/_stats":
+            return self.send_json(self.server.stats.to_dict())
+        if not self.inject():
+            return
+        if url.path == "/":
+            return self.listing(parse_qs(url.query))
+        return self.file(unquote(url.path.lstrip("/")))
+
+    def listing(self, query: dict):
+        store: ObjectStore = self.server.store
+        prefix = query.get("prefix", [""])[0]
+        keys, prefixes, next_marker = store.list_page(
+            prefix, query.get("marker", [""])[0]
+        )
+        self.server.stats.add("listing_pages")
+        self.send_body(
+            200,
+            synthetic.listing_xml(
+                prefix,
+                keys,
+                prefixes,
+                next_marker,
+                [os.path.getsize(store.path(key)) for key in keys],
+            ).encode(),
+            "application/xml",
+        )
+
+    def file(self, key: str):
+        path = self.server.store.path(key)
+        if ".." in key.split("/") or not os.path.isfile(path):
+            self.server.stats.add("not_found")
+            return self.send_body(404, b"NoSuchKey", "text/plain")
+        size = os.path.getsize(path)
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        bandwidth = self.server.faults.bandwidth
+        with open(path, "rb") as fin:
+            fin.seek(start)
+            while chunk := fin.read(CHUNK_SIZE):
+                self.wfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        self.server.stats.add("files")
+        self.server.stats.add("bytes", size - start)
+
+
+class GospeedHandler(_Handler):
+    """只实现 my_gospeed_api 用到的接口, 返回结构与 gospeed_api.models 一致"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/_stats":
+            return self.send_json(self.server.stats.to_dict())
+        if url.path == "/api/v1/info":
+            return self.ok(
+                {
+                    "version": "simulator",
+                    "runtime": "python",
+                    "os": "linux",
+                    "arch": "amd64",
+                    "inDocker": False,
+                }
+            )
+        if url.path == "/api/v1/tasks":
+            status = set(parse_qs(url.query).get("status", []))
+            return self.ok(self.server.gospeed.list(status))
+        task = self.server.gospeed.get(url.path.rsplit("/", 1)[-1])
+        if task is None:
+            return self.fail("task not found")
+        return self.ok(task)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        path = urlsplit(self.path).path
+        self.server.stats.add(f"POST {path}")
+        if not self.inject():
+            return
+        if path == "/api/v1/resolve":
+            return self.ok(self.server.gospeed.resolve(body["url"]))
+        if path == "/api/v1/tasks":
+            rid = self.server.gospeed.create(body["rid"], body["opt"])
+            if rid is None:
+                return self.fail("resource not found")
+            return self.ok(rid)
+        self.fail("not implemented")
+
+    def do_DELETE(self):
+        url = urlsplit(self.path)
+        if url.path == "/api/v1/tasks":
+            status = set(parse_qs(url.query).get("status", []))
+            self.server.gospeed.delete_all(status)
+        else:
+            self.server.gospeed.delete(url.path.rsplit("/", 1)[-1])
+        self.ok(None)
+
+    def ok(self, data):
+        self.send_json({"code": 0, "msg": "", "data": data})
+
+    def fail(self, msg: str):
+        self.send_json({"code": 1, "msg": msg, "data": None})
+
+
+class GospeedState:
+    """任务表和下载线程, 任务状态: ready -> running -> done | error"""
+
+    def __init__(self, workers: int, stats: Stats) -> None:
+        self.resolved: dict[str, dict] = {}
+        self.tasks: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.queue: queue.Queue = queue.Queue()
+        self.stats = stats
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+    def resolve(self, url: str) -> dict:
+        rid = uuid.uuid4().hex
+        name = os.path.basename(urlsplit(url).path)
+        res = {
+            "name": "",
+            "size": 0,
+            "range": True,
+            "files": [{"name": name, "path": "", "size": 0, "ctime": None}],
+            "hash": "",
+        }
+        with self.lock:
+            self.resolved[rid] = {"url": url, "res": res}
+        return {"id": rid, "res": res}
+
+    def create(self, rid: str, opt: dict) -> Union[str, None]:
+        with self.lock:
+            resolved = self.resolved.pop(rid, None)
+            if resolved is None:
+                return None
+            now = self._now()
+            self.tasks[rid] = {
+                "id": rid,
+                "meta": {
+                    "opts": opt,
+                    "res": resolved["res"],
+                    "req": {"url": resolved["url"]},
+                },
+                "status": "ready",
+                "protocol": "http",
+                "progress": {"used": 0, "speed": 0, "downloaded": 0},
+                "createdAt": now,
+                "updatedAt": now,
+            }
+        self.queue.put(rid)
+        return rid
+
+    def get(self, rid: str) -> Union[dict, None]:
+        with self.lock:
+            return self.tasks.get(rid)
+
+    def list(self, status: set) -> list[dict]:
+        with self.lock:
+            return [
+                t for t in self.tasks.values() if not status or t["status"] in status
+            ]
+
+    def delete(self, rid: str) -> None:
+        with self.lock:
+            self.tasks.pop(rid, None)
+
+    def delete_all(self, status: set) -> None:
+        with self.lock:
+            for rid in [
+                r for r, t in self.tasks.items() if not status or t["status"] in status
+            ]:
+                del self.tasks[rid]
+
+    def _set(self, rid: str, **fields) -> Union[dict, None]:
+        with self.lock:
+            task = self.tasks.get(rid)
+            if task is not None:
+                task.update(fields, updatedAt=self._now())
+            return task
+
+    def _worker(self) -> None:
+        while True:
+            rid = self.queue.get()
+            task = self._set(rid, status="running")
+            if task is None:
+                continue
+            start = time.perf_counter()
+            opts = task["meta"]["opts"]
+            save_path = os.path.join(opts["path"], opts["name"])
+            try:
+                os.makedirs(opts["path"], exist_ok=True)
+                with urllib.request.urlopen(task["meta"]["req"]["url"]) as response:
+                    body = response.read()
+                with open(save_path + ".part", "wb") as fout:
+                    fout.write(body)
+                os.replace(save_path + ".part", save_path)
+            except Exception:
+                self.stats.add("tasks_error")
+                self._set(rid, status="error")
+                continue
+            used = int((time.perf_counter() - start) * 1e9)
+            self.stats.add("tasks_done")
+            self._set(
+                rid,
+                status="done",
+                progress={
+                    "used": used,
+                    "speed": int(len(body) / max(used / 1e9, 1e-9)),
+                    "downloaded": len(body),
+                },
+            )
+
+
+def _serve(handler, port: int, stats: Stats, faults: Faults, **attrs):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    # 默认5, 高并发时连接会被拒绝
+    server.request_queue_size = 1024
+    server.stats = stats
+    server.faults = faults
+    for k, v in attrs.items():
+        setattr(server, k, v)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start(
+    root: str,
+    port: int = 0,
+    gospeed_port: int = 0,
+    page_size: int = 1000,
+    gospeed_workers: int = 16,
+    faults: Union[Faults, None] = None,
+    gospeed_faults: Union[Faults, None] = None,
+) -> dict:
+    """在后台线程启动文件服务和Gospeed服务
+
+    Returns:
+        dict: {"binance_url", "gospeed_url", "keys"}
+    """
+    stats = Stats()
+    binance = _serve(
+        BinanceHandler,
+        port,
+        stats,
+        faults or Faults(),
+        store=ObjectStore(root, page_size),
+    )
+    gospeed_stats = Stats()
+    gospeed = _serve(
+        GospeedHandler,
+        gospeed_port,
+        gospeed_stats,
+        gospeed_faults or Faults(),
+        gospeed=GospeedState(gospeed_workers, gospeed_stats),
+    )
+    return {
+        "binance_url": f"http://127.0.0.1:{binance.server_address[1]}/",
+        "gospeed_url": f"http://127.0.0.1:{gospeed.server_address[1]}/",
+        "keys": len(binance.store.keys),
+    }
+
+
+def add_fault_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=0, help="每个请求的延迟")
+    parser.add_argument(
+        "--bandwidth-kbps", type=float, default=0, help="每个连接的带宽, 0为不限"
+    )
+    parser.add_argument("--error-rate", type=float, default=0, help="返回500的比例")
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0, help="返回503和Retry-After的比例"
+    )
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument(
+        "--gospeed-error-rate", type=float, default=0, help="Gospeed接口返回500的比例"
+    )
+    parser.add_argument("--page-size", type=int, default=1000, help="列表每页key数")
+    parser.add_argument("--gospeed-workers", type=int, default=16)
+
+
+def faults_from_args(args: argparse.Namespace) -> tuple[Faults, Faults]:
+    return (
+        Faults(
+            args.latency_ms,
+            args.bandwidth_kbps,
+            args.error_rate,
+            args.throttle_rate,
+            args.retry_after,
+        ),
+        Faults(args.latency_ms, 0, args.gospeed_error_rate, 0, args.retry_after, 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", required=True, help="模拟的data.binance.vision目录")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--gospeed-port", type=int, default=0)
+    parser.add_argument("--generate", action="store_true", help="先生成目录")
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--days", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=100, help="每个文件的行数")
+    add_fault_args(parser)
+    args = parser.parse_args()
+
+    if args.generate:
+        print(
+            f"Generated {generate_tree(args.root, args.symbols, args.days, args.rows)} files."
+        )
+    faults, gospeed_faults = faults_from_args(args)
+    info = start(
+        args.root,
+        args.port,
+        args.gospeed_port,
+        args.page_size,
+        args.gospeed_workers,
+        faults,
+        gospeed_faults,
+    )
+    # 第一行json供启动方读取地址
+    print(json.dumps(info), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
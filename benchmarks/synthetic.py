@@ -0,0 +1,136 @@
+"""
+币安格式的合成数据, 用于基准测试
+
+1. aggTrades / trades: 成交到达为泊松过程, 价格为对数随机游走, 数量为对数正态分布,
+   编号连续递增, 写成与 data.binance.vision 相同的 zip + .CHECKSUM
+2. S3 ListBucketResult 列表页
+"""
+
+import hashlib
+import os
+import zipfile
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+import numpy as np
+import polars as pl
+
+DAY_MS = 86_400_000
+
+
+def _trade_flow(
+    n_rows: int, date: str, seed: int, price: float = 60000.0
+) -> dict[str, np.ndarray]:
+    """一天内n_rows笔成交的时间, 价格和数量"""
+    rng = np.random.default_rng(seed)
+    day_start = int(
+        datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+        * 1000
+    )
+    # 泊松到达: 指数分布的间隔, 缩放到一天之内
+    gaps = rng.exponential(1.0, n_rows)
+    timestamp = day_start + (np.cumsum(gaps) / gaps.sum() * (DAY_MS - 1)).astype(
+        np.int64
+    )
+    log_price = np.log(price) + np.cumsum(rng.normal(0, 1e-4, n_rows))
+    return {
+        "timestamp": timestamp,
+        "price": np.round(np.exp(log_price), 2),
+        "quantity": np.round(rng.lognormal(-4, 1.5, n_rows), 5),
+        "buyer_maker": rng.random(n_rows) < 0.5,
+    }
+
+
+def aggtrades_frame(
+    n_rows: int, date: str = "2024-01-01", seed: int = 0, first_id: int = 0
+) -> pl.DataFrame:
+    """aggTrades, 列顺序与 BINANCE_SPOT_HEADERS.aggTrades 一致"""
+    flow = _trade_flow(n_rows, date, seed)
+    rng = np.random.default_rng(seed + 1)
+    # 每笔聚合成交包含的成交数, 成交编号也从first_id开始
+    trades_per_agg = rng.geometric(0.6, n_rows)
+    last_trade_id = first_id + np.cumsum(trades_per_agg) - 1
+    return pl.DataFrame(
+        {
+            "aggregate_trade_id": np.arange(first_id, first_id + n_rows),
+            "price": flow["price"],
+            "quantity": flow["quantity"],
+            "first_trade_id": last_trade_id - trades_per_agg + 1,
+            "last_trade_id": last_trade_id,
+            "timestamp": flow["timestamp"],
+            "was_the_buyer_the_maker": flow["buyer_maker"],
+            "was_the_trade_the_best_price_match": np.ones(n_rows, dtype=bool),
+        }
+    )
+
+
+def trades_frame(
+    n_rows: int, date: str = "2024-01-01", seed: int = 0, first_id: int = 0
+) -> pl.DataFrame:
+    """trades, 列顺序与 BINANCE_SPOT_HEADERS.trades 一致"""
+    flow = _trade_flow(n_rows, date, seed)
+    return pl.DataFrame(
+        {
+            "trade Id": np.arange(first_id, first_id + n_rows),
+            "price": flow["price"],
+            "qty": flow["quantity"],
+            "quoteQty": np.round(flow["price"] * flow["quantity"], 8),
+            "timestamp": flow["timestamp"],
+            "isBuyerMaker": flow["buyer_maker"],
+            "isBestMatch": np.ones(n_rows, dtype=bool),
+        }
+    )
+
+
+def write_zip(df: pl.DataFrame, zip_path: str) -> str:
+    """写成币安的zip(无表头csv) 和 .CHECKSUM
+
+    Returns:
+        str: zip的sha256
+    """
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    # 币安的布尔值为 True/False
+    csv = df.with_columns(
+        pl.col(pl.Boolean).replace_strict({True: "True", False: "False"})
+    ).write_csv(include_header=False)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zout:
+        zout.writestr(os.path.basename(zip_path).replace(".zip", ".csv"), csv)
+    with open(zip_path, "rb") as fin:
+        checksum = hashlib.sha256(fin.read()).hexdigest()
+    with open(zip_path + ".CHECKSUM", "w") as fout:
+        fout.write(f"{checksum}  {os.path.basename(zip_path)}\n")
+    return checksum
+
+
+def listing_xml(
+    prefix: str,
+    keys: list[str],
+    prefixes: tuple = (),
+    next_marker: str = "",
+    sizes: tuple = (),
+) -> str:
+    """S3 ListBucketResult 的一页, next_marker不为空时 IsTruncated 为 true
+
+    sizes为空时文件大小取 1000 + 序号
+    """
+    contents = "".join(
+        f"<Contents><Key>{escape(key)}</Key>"
+        f"<LastModified>2024-01-02T00:00:00.000Z</LastModified>"
+        f'<ETag>"{hashlib.md5(key.encode()).hexdigest()}"</ETag>'
+        f"<Size>{sizes[i] if sizes else 1000 + i}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+        for i, key in enumerate(keys)
+    )
+    common = "".join(
+        f"<CommonPrefixes><Prefix>{escape(p)}</Prefix></CommonPrefixes>"
+        for p in prefixes
+    )
+    truncated = "true" if next_marker else "false"
+    marker = f"<NextMarker>{escape(next_marker)}</NextMarker>" if next_marker else ""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"<Name>data.binance.vision</Name><Prefix>{escape(prefix)}</Prefix>"
+        f"<Marker></Marker>{marker}<MaxKeys>1000</MaxKeys><Delimiter>/</Delimiter>"
+        f"<IsTruncated>{truncated}</IsTruncated>{contents}{common}"
+        "</ListBucketResult>"
+    )
@@ -0,0 +1,290 @@
+import os
+import re
+import argparse
+from bisect import bisect_left, bisect_right
+from typing import Union
+import polars as pl
+from joblib import Parallel, delayed
+from loguru import logger
+from tqdm import tqdm
+
+# ==== Customized Modules ====
+from utils import ConfigLoader
+
+config = ConfigLoader.load_config()
+
+# 持久化的列, path为相对于 save_released_data_dir 的路径
+CATALOG_SCHEMA: dict = {
+    "market": pl.String,
+    "period": pl.String,
+    "data_type": pl.String,
+    "frequency": pl.String,
+    "symbol": pl.String,
+    "date": pl.String,
+    "path": pl.String,
+    "size": pl.Int64,
+    "rows": pl.Int64,
+    "mtime": pl.Float64,
+}
+
+
+class Catalog:
+    """
+    发布目录的文件索引, 替代 os.walk + 路径字符串过滤
+
+    每个文件解析为一条记录:
+        market: "spot", "futures/um", ...
+        period: "daily" | "monthly"
+        data_type: "aggTrades", "klines", ...
+        frequency: 数据类型下的子目录, 没有子目录时与data_type相同. eg: "aggTrades", "1m", "customized-1m"
+        symbol, date("2024-01" 或 "2024-01-01"), path, size, rows, mtime
+
+    日度数据按月合并后(Release.compact_daily), daily 下的记录日期为月份, 查找时按整月处理
+
+    同一 (market, period, data_type, frequency) 的记录按 (symbol, date) 排序,
+    按标的和日期查找时用二分查找. 索引保存在 catalog_path, 不存在时从磁盘重建,
+    Release 和k线转换写入文件后增量更新
+    """
+
+    # {(market, period, data_type, frequency): [record, ...]}
+    _datasets: Union[dict, None] = None
+    # 与 _datasets 对应的 (symbol, date) 列表, 用于二分查找
+    _keys: dict = {}
+    # 加载时索引文件的修改时间, 其他进程更新后重新加载
+    _loaded_mtime: Union[float, None] = None
+
+    @staticmethod
+    def parse_path(path: str) -> Union[dict, None]:
+        """解析发布文件路径
+
+        Args:
+            path (str): 发布文件的绝对路径或相对于 save_released_data_dir 的路径
+                eg: data/spot/monthly/klines/BTCUSDT/customized-1m/BTCUSDT-1m-2024-01.parquet
+
+        Returns:
+            Union[dict, None]: 不是发布数据文件时返回None
+        """
+        if os.path.isabs(path):
+            path = os.path.relpath(path, config["save_released_data_dir"])
+        parts = path.replace(os.sep, "/").split("/")
+        if parts[0] != "data" or not parts[-1].endswith(".parquet"):
+            return None
+        periods = [i for i, p in enumerate(parts) if p in ["daily", "monthly"]]
+        if not periods or len(parts) - periods[0] not in [4, 5]:
+            return None
+        i = periods[0]
+        symbol = parts[i + 2]
+        # 文件名: {symbol}-{frequency}-{date}.parquet, date为 YYYY-MM 或 YYYY-MM-DD
+        dates = re.findall(r"-(\d{4}-\d{2}(?:-\d{2})?)\.parquet$", parts[-1])
+        if not parts[-1].startswith(symbol + "-") or not dates:
+            return None
+        date = dates[0]
+        return {
+            "market": "/".join(parts[1:i]),
+            "period": parts[i],
+            "data_type": parts[i + 1],
+            "frequency": parts[i + 3] if len(parts) - i == 5 else parts[i + 1],
+            "symbol": symbol,
+            "date": date,
+            "path": "/".join(parts),
+        }
+
+    @staticmethod
+    def record(path: str, rows: Union[int, None] = None) -> Union[dict, None]:
+        """生成文件的索引记录
+
+        Args:
+            path (str): 发布文件路径
+            rows (Union[int, None], optional): 行数, None时从parquet元数据读取. Defaults to None.
+
+        Returns:
+            Union[dict, None]:
+        """
+        rec = Catalog.parse_path(path)
+        if rec is None:
+            return None
+        abs_path = os.path.join(config["save_released_data_dir"], rec["path"])
+        stat = os.stat(abs_path)
+        if rows is None:
+            rows = pl.scan_parquet(abs_path).select(pl.len()).collect().item()
+        rec.update({"size": stat.st_size, "rows": rows, "mtime": stat.st_mtime})
+        return rec
+
+    @staticmethod
+    def _dataset_key(rec: dict) -> tuple:
+        return (rec["market"], rec["period"], rec["data_type"], rec["frequency"])
+
+    @staticmethod
+    def _index(records: list[dict]) -> None:
+        datasets: dict = {}
+        for rec in records:
+            datasets.setdefault(Catalog._dataset_key(rec), []).append(rec)
+        for recs in datasets.values():
+            recs.sort(key=lambda r: (r["symbol"], r["date"]))
+        Catalog._datasets = datasets
+        Catalog._keys = {
+            k: [(r["symbol"], r["date"]) for r in recs] for k, recs in datasets.items()
+        }
+
+    @staticmethod
+    def load() -> dict:
+        """加载索引, 索引文件不存在时从磁盘重建"""
+        path = config["catalog_path"]
+        if not os.path.exists(path):
+            logger.info("Catalog not found, rebuild it from disk.")
+            Catalog.rebuild_from_disk()
+            return Catalog._datasets
+        mtime = os.path.getmtime(path)
+        if Catalog._datasets is None or mtime != Catalog._loaded_mtime:
+            Catalog._index(pl.read_parquet(path).to_dicts())
+            Catalog._loaded_mtime = mtime
+        return Catalog._datasets
+
+    @staticmethod
+    def save() -> None:
+        """先写临时文件再替换, 避免中断时损坏索引"""
+        path = config["catalog_path"]
+        records = [r for recs in Catalog._datasets.values() for r in recs]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pl.DataFrame(records, schema=CATALOG_SCHEMA).write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        Catalog._loaded_mtime = os.path.getmtime(path)
+
+    @staticmethod
+    def rebuild_from_disk() -> None:
+        """遍历发布目录重建索引"""
+        released_dir = config["save_released_data_dir"]
+        paths: list[str] = []
+        for root, _, files in os.walk(os.path.join(released_dir, "data")):
+            for file in files:
+                if file.endswith(".parquet"):
+                    paths.append(os.path.join(root, file))
+        # 行数需要读取每个文件的元数据
+        records = Parallel(n_jobs=config["parallel_n_jobs"], prefer="threads")(
+            delayed(Catalog.record)(p) for p in tqdm(paths, desc="Building catalog")
+        )
+        Catalog._index([r for r in records if r is not None])
+        Catalog.save()
+        logger.info(f"Catalog rebuilt: {len(paths)} files.")
+
+    @staticmethod
+    def update(records: list[dict]) -> None:
+        """增量更新索引, 同一路径的记录被替换
+
+        Args:
+            records (list[dict]): Catalog.record 生成的记录
+        """
+        records = [r for r in records if r is not None]
+        if not records:
+            return
+        Catalog.load()
+        new_paths = {r["path"] for r in records}
+        touched = {Catalog._dataset_key(r) for r in records}
+        all_records = [
+            r
+            for k, recs in Catalog._datasets.items()
+            for r in recs
+            if k not in touched or r["path"] not in new_paths
+        ]
+        Catalog._index(all_records + records)
+        Catalog.save()
+
+    @staticmethod
+    def remove(paths: list[str]) -> None:
+        """从索引中删除文件"""
+        rel_paths = {(Catalog.parse_path(p) or {}).get("path") for p in paths} - {None}
+        if not rel_paths:
+            return
+        Catalog.load()
+        Catalog._index(
+            [
+                r
+                for recs in Catalog._datasets.values()
+                for r in recs
+                if r["path"] not in rel_paths
+            ]
+        )
+        Catalog.save()
+
+    @staticmethod
+    def _date_bounds(
+        period: str, start_date: Union[str, None], end_date: Union[str, None]
+    ) -> tuple[str, str]:
+        """日期区间转为该数据集日期格式下的闭区间, 与区间有交集的文件都在区间内
+
+        日期字符串可以直接按字典序比较, 日度数据的结束月份用 "-32" 包含整月
+        """
+        lo, hi = "", "9999-99-99"
+        if period == "monthly":
+            if start_date:
+                lo = start_date[:7]
+            if end_date:
+                hi = end_date[:7]
+        else:
+            if start_date:
+                lo = start_date if len(start_date) == 10 else start_date + "-01"
+            if end_date:
+                hi = end_date if len(end_date) == 10 else end_date + "-32"
+        return lo, hi
+
+    @staticmethod
+    def lookup(
+        market: str,
+        period: str,
+        data_type: str,
+        frequency: Union[str, None] = None,
+        symbols: Union[list, None] = None,
+        start_date: Union[str, None] = None,
+        end_date: Union[str, None] = None,
+    ) -> list[dict]:
+        """按标的和日期区间查找文件
+
+        Args:
+            market (str): "spot", "futures/um", ...
+            period (str): "daily" | "monthly"
+            data_type (str): "aggTrades", "klines", ...
+            frequency (Union[str, None], optional): 默认与data_type相同. Defaults to None.
+            symbols (Union[list, None], optional): None表示全部标的. Defaults to None.
+            start_date (Union[str, None], optional): 与区间有交集的文件都会返回. Defaults to None.
+            end_date (Union[str, None], optional): 包含end_date当天(或当月). Defaults to None.
+
+        Returns:
+            list[dict]: 按 (symbol, date) 排序的记录
+        """
+        key = (market, period, data_type, frequency or data_type)
+        datasets = Catalog.load()
+        if key not in datasets:
+            return []
+        records, keys = datasets[key], Catalog._keys[key]
+        lo, hi = Catalog._date_bounds(period, start_date, end_date)
+        if symbols is None:
+            return [r for r in records if Catalog._in_bounds(r["date"], lo, hi)]
+        result: list[dict] = []
+        for symbol in sorted(set(symbols)):
+            # 合并后的月份排在该月的日期之前, 从月份开始查找
+            left = bisect_left(keys, (symbol, lo[:7]))
+            right = bisect_right(keys, (symbol, hi))
+            result.extend(
+                r for r in records[left:right] if Catalog._in_bounds(r["date"], lo, hi)
+            )
+        return result
+
+    @staticmethod
+    def _in_bounds(date: str, lo: str, hi: str) -> bool:
+        """日度数据中合并为月份的记录, 与区间有交集即可"""
+        if len(date) == 7 and len(lo) != 7:
+            return lo[:7] <= date <= hi[:7]
+        return lo <= date <= hi
+
+    @staticmethod
+    def abs_path(rec: dict) -> str:
+        return os.path.join(config["save_released_data_dir"], rec["path"])
+
+
+if __name__ == "__main__":
+    # python -m data_reader.catalog rebuild-from-disk
+    parser = argparse.ArgumentParser(description="Released data catalog")
+    parser.add_argument("command", choices=["rebuild-from-disk"])
+    args = parser.parse_args()
+    if args.command == "rebuild-from-disk":
+        Catalog.rebuild_from_disk()
@@ -1,20 +1,19 @@
 from typing import Union
 import os
+from datetime import datetime, timedelta
 import polars as pl
-from itertools import chain
-from joblib import Parallel, delayed
-from tqdm import tqdm
+from loguru import logger
 
 # ==== Customized Modules ====
-from utils import PathBinance, PathLocal, ConfigLoader, TimeTools
-from downloader.enums import BINANCE_SPOT_HEADERS, BINANCE_SPOT_TIME_COLUMNS  # noqa
+from utils import PathBinance, ConfigLoader, TimeTools, Tracer
+from data_reader.catalog import Catalog
 
 config = ConfigLoader.load_config()
 
 
 class DataReader:
     @staticmethod
-    def get_file_path(
+    def get_records(
         symbol_type: str,
         agg_period: str,
         data_type: str,
@@ -24,8 +23,8 @@ class DataReader:
         symbols: Union[str, list, None] = None,
         need_skip_symbols: Union[str, list, None] = None,
         read_custom_file: bool = True,
-    ) -> list[str]:
-        """获取文件路径
+    ) -> list[dict]:
+        """从索引中获取文件记录
 
         Args:
             symbol_type (str): 'spot',...
@@ -42,7 +41,7 @@ class DataReader:
             ValueError: data_frequency is required for klines
 
         Returns:
-            list[str]:
+            list[dict]: Catalog 记录, 按 (symbol, date) 排序
         """
         if data_type == "klines" and data_frequency is None:
             raise ValueError("data_frequency is required for klines")
@@ -51,48 +50,90 @@ class DataReader:
         if isinstance(need_skip_symbols, str):
             need_skip_symbols = [need_skip_symbols]
 
-        # 只有一个元素
+        # 只有一个元素, eg: data/spot/monthly/aggTrades/
         path: str = PathBinance.get_data_frequency(symbol_type, agg_period, data_type)[
             0
         ]
+        parts = path.strip("/").split("/")
+        frequency = data_type
+        if data_frequency:
+            frequency = data_frequency
+            if read_custom_file:
+                frequency = "customized-" + data_frequency
 
-        dir_path: str = os.path.join(config["save_released_data_dir"], path)
-
-        # 只取需要的标的
-        if symbols:
-            symbol_paths: list[str] = [
-                os.path.join(dir_path, symbol) for symbol in symbols
-            ]
-            parquet_paths: list[list[str]] = [
-                PathLocal.get_file_path_from_dir(p) for p in symbol_paths
-            ]
-            parquet_paths: list[str] = list(chain.from_iterable(parquet_paths))
-        else:
-            parquet_paths: list[str] = PathLocal.get_file_path_from_dir(dir_path)
-
-        # 时间过滤
-        if start_date is not None or end_date is not None:
-            parquet_paths = TimeTools.time_filter(start_date, end_date, parquet_paths)
+        # 按标的和日期二分查找, 与区间有交集的文件都会返回, 文件内再按时间戳过滤
+        records: list[dict] = Catalog.lookup(
+            market="/".join(parts[1:-2]),
+            period=parts[-2],
+            data_type=parts[-1],
+            frequency=frequency,
+            symbols=symbols,
+            start_date=start_date,
+            end_date=end_date,
+        )
 
         # 标的过滤
         if need_skip_symbols:
-            parquet_paths: list[str] = [
-                p
-                for p in parquet_paths
-                if not any(p.split("/")[-2] == s for s in need_skip_symbols)
-            ]
+            records = [r for r in records if r["symbol"] not in need_skip_symbols]
 
-        # 时间频率过滤
-        if data_frequency:
-            kw = data_frequency
-            if read_custom_file:
-                kw = "customized-" + data_frequency
-            parquet_paths: list[str] = [p for p in parquet_paths if kw in p]
+        return records
 
-        return parquet_paths
+    @staticmethod
+    def get_file_path(
+        symbol_type: str,
+        agg_period: str,
+        data_type: str,
+        data_frequency: Union[str, None] = None,
+        start_date: Union[str, None] = None,
+        end_date: Union[str, None] = None,
+        symbols: Union[str, list, None] = None,
+        need_skip_symbols: Union[str, list, None] = None,
+        read_custom_file: bool = True,
+    ) -> list[str]:
+        """获取文件路径, 参数见 DataReader.get_records
+
+        Returns:
+            list[str]:
+        """
+        records = DataReader.get_records(
+            symbol_type=symbol_type,
+            agg_period=agg_period,
+            data_type=data_type,
+            data_frequency=data_frequency,
+            start_date=start_date,
+            end_date=end_date,
+            symbols=symbols,
+            need_skip_symbols=need_skip_symbols,
+            read_custom_file=read_custom_file,
+        )
+        return [Catalog.abs_path(r) for r in records]
 
     @staticmethod
-    def read_parquet(
+    def sort_records(records: list[dict]) -> list[dict]:
+        """按 symbol 降序, 文件时间段的起点升序排列索引记录
+
+        文件内已按时间排序, 时间段互不重叠时按此顺序扫描得到的数据不需要再整体排序.
+        按文件名排序时 "2024-01-31" 会排在月文件 "2024-01" 之前, 所以按日期解析出的时间段排序
+        """
+        records = sorted(records, key=lambda r: TimeTools.parse_period(r["date"])[0])
+        return sorted(records, key=lambda r: r["symbol"], reverse=True)
+
+    @staticmethod
+    def is_disjoint(records: list[dict]) -> bool:
+        """已排序的记录中, 同一标的的文件时间段是否互不重叠
+
+        合并失败或关闭 release_compact_daily 时, 同一个月的日度文件和月文件可能同时存在
+        """
+        last: dict[str, datetime] = {}
+        for rec in records:
+            start, end = TimeTools.parse_period(rec["date"])
+            if rec["symbol"] in last and start < last[rec["symbol"]]:
+                return False
+            last[rec["symbol"]] = end
+        return True
+
+    @staticmethod
+    def scan(
         symbol_type: str,
         agg_period: str,
         data_type: str,
@@ -101,10 +142,20 @@ class DataReader:
         end_date: Union[str, None] = None,
         symbols: Union[str, list, None] = None,
         need_skip_symbols: Union[str, list, None] = None,
-        use_parallel: bool = True,
         read_custom_file: bool = True,
-    ) -> Union[pl.DataFrame, None]:
-        """_summary_
+        columns: Union[list, None] = None,
+        filters: Union[tuple, None] = None,
+        downcast: Union[bool, dict] = False,
+    ) -> Union[pl.LazyFrame, None]:
+        """构建数据的LazyFrame, 调用方可以继续组合计算, 由polars统一优化
+
+        所有文件构建为一个 pl.scan_parquet:
+        1. symbol 和日期在索引中, 由 get_records 裁剪文件(与hive分区裁剪相同)
+        2. 时间戳过滤下推到行组, 根据行组统计信息跳过区间外的数据
+        3. 只读取 columns 中的列
+
+        symbol 列为 Categorical, 多个文件各有自己的字符串字典, 调用方需要在 pl.StringCache() 中 collect,
+        否则polars会发出 CategoricalRemappingWarning 并重新编码该列(read_parquet 已经这样做)
 
         Args:
             symbol_type (str): "spot",...
@@ -112,16 +163,113 @@ class DataReader:
             data_type (str): "klines", ...
             data_frequency (str): "1m", ...
             start_date (Union[str, None], optional): Defaults to None.
-            end_date (Union[str, None], optional): Defaults to None.
+            end_date (Union[str, None], optional): 包含end_date当天(或当月). Defaults to None.
             symbols (Union[str, list, None], optional): Defaults to None.
             need_skip_symbols (Union[str, list, None], optional): Defaults to None.
-            use_parallel (bool, optional): Defaults to True.
             read_custom_file (bool, optional): 只在data_frequency不为None时生效. Defaults to True.
+            columns (Union[list, None], optional): 只读取这些列, None表示全部. Defaults to None.
+            filters (Union[tuple, None], optional): 时间戳区间 (start, end), 左闭右开,
+                元素为datetime或iso格式字符串, None表示不限. Defaults to None.
+            downcast (Union[bool, dict], optional): True 时 Float64 列转为 Float32;
+                dict 时按 {列名: 类型} 转换. Defaults to False.
+
+        Returns:
+            Union[pl.LazyFrame, None]: 按 symbol 降序, timestamp 升序排列, 没有数据时返回None
+        """
+        ts_start, ts_end = (
+            [None if t is None else DataReader._to_datetime(t) for t in filters]
+            if filters
+            else (None, None)
+        )
+        # 没有指定日期时用时间戳区间裁剪文件
+        if start_date is None and ts_start is not None:
+            start_date = ts_start.strftime("%Y-%m-%d")
+        if end_date is None and ts_end is not None:
+            end_date = (ts_end - timedelta(milliseconds=1)).strftime("%Y-%m-%d")
+
+        records = DataReader.get_records(
+            symbol_type=symbol_type,
+            agg_period=agg_period,
+            data_type=data_type,
+            data_frequency=data_frequency,
+            start_date=start_date,
+            end_date=end_date,
+            symbols=symbols,
+            need_skip_symbols=need_skip_symbols,
+            read_custom_file=read_custom_file,
+        )
+        if not records:
+            return None
+
+        records = DataReader.sort_records(records)
+        lf = pl.scan_parquet(
+            [Catalog.abs_path(r) for r in records], hive_partitioning=False
+        )
+        if not DataReader.is_disjoint(records):
+            logger.warning(
+                f"Overlapping files for {symbols or 'all symbols'}, sort by timestamp."
+            )
+            lf = lf.sort(
+                [pl.col("symbol").cast(pl.String), "timestamp"],
+                descending=[True, False],
+                maintain_order=True,
+            )
+        elif len({r["symbol"] for r in records}) == 1:
+            # 只有一个标的且文件不重叠时整体按时间有序, 后续按时间聚合时不需要再排序
+            lf = lf.set_sorted("timestamp")
+
+        predicates = []
+        if start_date is not None or end_date is not None:
+            start, end = TimeTools.date_range(start_date, end_date)
+            predicates += [pl.col("timestamp") >= start, pl.col("timestamp") < end]
+        if ts_start is not None:
+            predicates.append(pl.col("timestamp") >= ts_start)
+        if ts_end is not None:
+            predicates.append(pl.col("timestamp") < ts_end)
+        if predicates:
+            lf = lf.filter(pl.all_horizontal(predicates))
+
+        if columns:
+            lf = lf.select(columns)
+
+        if downcast is True:
+            lf = lf.with_columns(pl.col(pl.Float64).cast(pl.Float32))
+        elif downcast:
+            lf = lf.with_columns(
+                [pl.col(col).cast(dtype) for col, dtype in downcast.items()]
+            )
+        return lf
+
+    @staticmethod
+    def _to_datetime(t: Union[datetime, str]) -> datetime:
+        return t if isinstance(t, datetime) else datetime.fromisoformat(t)
+
+    @staticmethod
+    @Tracer.traced()
+    def read_parquet(
+        symbol_type: str,
+        agg_period: str,
+        data_type: str,
+        data_frequency: Union[str, None] = None,
+        start_date: Union[str, None] = None,
+        end_date: Union[str, None] = None,
+        symbols: Union[str, list, None] = None,
+        need_skip_symbols: Union[str, list, None] = None,
+        use_parallel: bool = True,
+        read_custom_file: bool = True,
+        columns: Union[list, None] = None,
+        filters: Union[tuple, None] = None,
+        downcast: Union[bool, dict] = False,
+    ) -> Union[pl.DataFrame, None]:
+        """读取数据, 参数见 DataReader.scan
+
+        Args:
+            use_parallel (bool, optional): scan_parquet 自身并行读取, 保留该参数以兼容旧代码. Defaults to True.
 
         Returns:
-            Union[pl.DataFrame, None]:
+            Union[pl.DataFrame, None]: 按 symbol 降序, timestamp 升序排列
         """
-        parquet_paths = DataReader.get_file_path(
+        lf = DataReader.scan(
             symbol_type=symbol_type,
             agg_period=agg_period,
             data_type=data_type,
@@ -131,24 +279,64 @@ class DataReader:
             symbols=symbols,
             need_skip_symbols=need_skip_symbols,
             read_custom_file=read_custom_file,
+            columns=columns,
+            filters=filters,
+            downcast=downcast,
         )
-        if not parquet_paths:
+        if lf is None:
             print("Data not found")
             return
+        # symbol列为Categorical, 多个文件共用字符串缓存, 合并时不需要重新编码
+        with pl.StringCache():
+            return lf.collect()
 
-        if use_parallel:
-            df = pl.concat(
-                Parallel(n_jobs=config["parallel_n_jobs"], prefer="threads")(
-                    delayed(pl.read_parquet)(p)
-                    for p in tqdm(parquet_paths, desc="Reading parquet files")
-                )
-            )
-        else:
-            df = pl.concat([pl.read_parquet(p) for p in parquet_paths])
+    @staticmethod
+    def build_hive_view(
+        symbol_type: str,
+        agg_period: str,
+        data_type: str,
+    ) -> str:
+        """以hive分区的形式暴露发布目录, 供其他引擎(duckdb, pl.scan_parquet目录)按分区裁剪
 
-        time_col = eval(f"BINANCE_{symbol_type}_TIME_COLUMNS.{data_frequency}")
+        在 hive_view_dir 下创建指向发布文件的软链接, 不复制数据:
+            <数据路径>/[customized-1m/]symbol=BTCUSDT/date=2024-01/BTCUSDT-aggTrades-2024-01.parquet
+        读取: pl.scan_parquet(f"{view_dir}/**/*.parquet", hive_partitioning=True)
 
-        return df.sort(by=["symbol", "timestamp"], descending=[True, False])
+        Args:
+            symbol_type (str): "spot",...
+            agg_period (str): "daily",...
+            data_type (str): "aggTrades", ...
+
+        Returns:
+            str: 视图目录
+        """
+        path: str = PathBinance.get_data_frequency(symbol_type, agg_period, data_type)[
+            0
+        ]
+        parts = path.strip("/").split("/")
+        dataset = ("/".join(parts[1:-2]), parts[-2], parts[-1])
+        view_dir: str = os.path.join(config["hive_view_dir"], path)
+        n = 0
+        for key, records in Catalog.load().items():
+            if key[:3] != dataset:
+                continue
+            # k线转换结果多一层频率目录
+            sub_dir = key[3] if key[3] != data_type else ""
+            for rec in records:
+                link = os.path.join(
+                    view_dir,
+                    sub_dir,
+                    f"symbol={rec['symbol']}",
+                    f"date={rec['date']}",
+                    os.path.basename(rec["path"]),
+                )
+                if os.path.lexists(link):
+                    continue
+                os.makedirs(os.path.dirname(link), exist_ok=True)
+                os.symlink(Catalog.abs_path(rec), link)
+                n += 1
+        logger.info(f"Hive view {view_dir}: {n} new links.")
+        return view_dir
 
     @staticmethod
     def get_file_size(
@@ -159,8 +347,18 @@ class DataReader:
         start_date: Union[str, None] = None,
         end_date: Union[str, None] = None,
         read_custom_file: bool = True,
-    ):
-        pass
+    ) -> int:
+        """文件总大小(字节), 从索引中读取, 不访问文件"""
+        records = DataReader.get_records(
+            symbol_type=symbol_type,
+            agg_period=agg_period,
+            data_type=data_type,
+            data_frequency=data_frequency,
+            start_date=start_date,
+            end_date=end_date,
+            read_custom_file=read_custom_file,
+        )
+        return sum(r["size"] for r in records)
 
 
 if __name__ == "__main__":
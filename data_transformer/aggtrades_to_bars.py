@@ -0,0 +1,434 @@
+import polars as pl
+from typing import Union
+import os
+import time
+from loguru import logger
+from tqdm import tqdm
+
+# ==== Customized Modules ====
+from utils import (
+    PathBinance,
+    ConfigLoader,
+    TimeTools,
+    ParquetProfile,
+    MemoryBudgetPool,
+    Metrics,
+    Tracer,
+)
+from data_reader.reader import DataReader
+from data_reader.catalog import Catalog
+from data_transformer.aggtrades_to_kline import Spot as Kline
+
+config = ConfigLoader.load_config()
+
+# bar文件的输入状态和文件末尾未完成的bar, 与bar文件放在同一目录
+BAR_STATE_FILE = "_bar_state.json"
+# 每根bar累计的量, 累计到阈值时bar结束
+BAR_MEASURES: dict = {
+    "tick": pl.lit(1.0),
+    "volume": pl.col("quantity"),
+    "dollar": pl.col("quote_asset_volume"),
+}
+
+
+class Spot:
+    """
+    tick/volume/dollar bar, 每根bar包含累计成交笔数/成交量/成交额达到阈值的连续成交
+
+    bar规格写作 "{类型}-{阈值}", eg: "tick-1000", "volume-50", "dollar-1000000",
+    输出到 klines/{symbol}/customized-{bar规格}/{symbol}-{bar规格}-{date}.parquet,
+    可以用 DataReader.scan(data_type="klines", data_frequency="tick-1000") 读取
+
+    1. 成交前的累计量除以阈值向下取整即为bar编号, 全部为列运算, 没有python循环
+    2. 文件(以及文件内的分块)末尾未完成的bar与剩余累计量传递给下一块, 结果与不分块一致
+    3. timestamp为bar最后一笔成交的时间, bar写入结束时间所在周期的文件,
+       最后一个文件末尾未完成的bar只保存在状态中, 不输出
+    """
+
+    @staticmethod
+    def all_aggtrades_to_bars(bar_spec: str, agg_period: str, skip_existed=True):
+        """全部aggTrades数据转换为bar, 标的分配到进程池并行转换
+
+        Args:
+            bar_spec (str): eg: "tick-1000"
+            agg_period (str): "daily","monthly"
+            skip_existed (bool, optional): 跳过已是最新的文件. Defaults to True.
+        """
+        Metrics.start_run()
+        Tracer.start_run()
+        records: list[dict] = Catalog.load().get(
+            ("spot", agg_period, "aggTrades", "aggTrades"), []
+        )
+        # 同k线转换, 内存与最大的文件有关, 大文件分块转换
+        chunk_bytes = 2 * config["kline_chunk_memory_mb"] * 1024 * 1024
+        max_size: dict[str, int] = {}
+        for rec in records:
+            max_size[rec["symbol"]] = max(max_size.get(rec["symbol"], 0), rec["size"])
+        jobs = [
+            (symbol, min(int(size * config["kline_memory_factor"]), chunk_bytes))
+            for symbol, size in max_size.items()
+        ]
+        print(f"Convert {len(jobs)} symbols to {bar_spec} bars.")
+        logger.info(f"Convert {len(jobs)} symbols to {bar_spec} bars.")
+
+        pool = MemoryBudgetPool(
+            config["kline_n_workers"], config["kline_memory_budget_mb"] * 1024 * 1024
+        )
+        catalog_records: list[dict] = []
+        failed: list[str] = []
+        total_bytes, start = 0, time.perf_counter()
+        with Metrics.stage("convert_bars") as st:
+            try:
+                with tqdm(total=len(jobs), desc="Convert bars", unit="symbol") as pbar:
+                    for symbol, result in pool.imap_unordered(
+                        Spot.convert_symbol, jobs, bar_spec, agg_period, skip_existed
+                    ):
+                        pbar.update(1)
+                        if isinstance(result, Exception):
+                            logger.error(f"Convert {symbol} failed: {result!r}")
+                            failed.append(symbol)
+                            Metrics.inc("binance_bar_symbols_total", status="failed")
+                            continue
+                        if result["failed"]:
+                            failed.append(symbol)
+                        Metrics.inc(
+                            "binance_bar_symbols_total",
+                            status="partial" if result["failed"] else "done",
+                        )
+                        catalog_records.extend(result["records"])
+                        total_bytes += result["bytes"]
+                        st.add("files", len(result["records"]))
+                        st.add("rows", sum(r["rows"] for r in result["records"]))
+                        st.add("bytes", result["bytes"])
+                        st.add_cpu(result["cpu_seconds"])
+                        elapsed = time.perf_counter() - start
+                        pbar.set_postfix(
+                            files=len(catalog_records),
+                            MB_s=f"{total_bytes / 1024 / 1024 / elapsed:.1f}",
+                        )
+            finally:
+                Catalog.update(catalog_records)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Converted {len(jobs)} symbols, {len(catalog_records)} files, "
+            f"{total_bytes / 1024 / 1024:.1f} MB aggTrades in {elapsed:.1f}s."
+        )
+        if failed:
+            logger.error(f"{len(failed)} symbols failed or partially failed: {failed}")
+        Metrics.export("bars")
+        Tracer.export("bars")
+
+    @staticmethod
+    def convert_symbol(
+        symbol: str, bar_spec: str, agg_period: str, skip_existed: bool = True
+    ) -> dict:
+        """进程池中转换一个标的, 索引记录返回给主进程更新
+
+        Returns:
+            dict: {"records": 新文件的索引记录, "bytes": 读取的aggTrades字节数, "failed": 失败的日期, "cpu_seconds"}
+        """
+        cpu_start = time.process_time()
+        result = Spot.from_file(
+            symbol=symbol,
+            bar_spec=bar_spec,
+            agg_period=agg_period,
+            skip_existed=skip_existed,
+            update_catalog=False,
+            progress=False,
+        )
+        result["cpu_seconds"] = time.process_time() - cpu_start
+        return result
+
+    @staticmethod
+    def parse_bar_spec(bar_spec: str) -> tuple[str, float]:
+        """解析bar规格
+
+        Args:
+            bar_spec (str): eg: "tick-1000"
+
+        Raises:
+            ValueError: 类型不支持或阈值不是正数
+
+        Returns:
+            tuple[str, float]: (类型, 阈值)
+        """
+        kind, _, threshold = bar_spec.partition("-")
+        if kind not in BAR_MEASURES:
+            raise ValueError(f"Unsupported bar type: {bar_spec}")
+        try:
+            value = float(threshold)
+        except ValueError:
+            raise ValueError(f"Invalid bar threshold: {bar_spec}") from None
+        if value <= 0:
+            raise ValueError(f"Invalid bar threshold: {bar_spec}")
+        return kind, value
+
+    @staticmethod
+    @Tracer.traced()
+    def from_file(
+        symbol: str,
+        bar_spec: str,
+        agg_period: str,
+        skip_existed=True,
+        update_catalog: bool = True,
+        progress: bool = True,
+    ) -> dict:
+        """按日期顺序转换一个标的的全部aggTrades文件
+
+        每个bar依赖之前所有的成交, customized-{bar_spec}/_bar_state.json 记录每个已转换文件的输入
+        和文件末尾未完成的bar, 从第一个缺失或输入有变化的文件开始, 之后的文件全部重新转换
+
+        Args:
+            symbol (str): 标的
+            bar_spec (str): eg: "tick-1000"
+            agg_period (str): "daily","monthly"
+            skip_existed (bool, optional): 跳过已是最新的文件, False时全部重新转换. Defaults to True.
+            update_catalog (bool, optional): 更新索引, 在进程池中运行时由主进程更新. Defaults to True.
+            progress (bool, optional): 显示进度条. Defaults to True.
+
+        Returns:
+            dict: {"records": 新文件的索引记录, "bytes": 读取的aggTrades字节数, "failed": 失败的日期}
+        """
+        logger.info(
+            f"Convert aggTrades to bars. symbol: {symbol} bar_spec: {bar_spec} agg_period: {agg_period} skip_existed: {skip_existed}"
+        )
+        kind, threshold = Spot.parse_bar_spec(bar_spec)
+        inputs = DataReader.get_records(
+            symbol_type="spot",
+            agg_period=agg_period,
+            data_type="aggTrades",
+            symbols=symbol,
+        )
+        if not inputs:
+            logger.warning(f"No aggTrades data found for {symbol}.")
+            return {"records": [], "bytes": 0, "failed": []}
+        path = PathBinance.get_data_frequency(
+            type_="spot", agg_period=agg_period, data_type="klines"
+        )[0]
+        save_dir = os.path.join(
+            config["save_released_data_dir"], path, symbol, f"customized-{bar_spec}"
+        )
+        state_path = os.path.join(save_dir, BAR_STATE_FILE)
+        state = Kline.load_state(state_path)
+
+        def save_path(rec: dict) -> str:
+            return os.path.join(save_dir, f"{symbol}-{bar_spec}-{rec['date']}.parquet")
+
+        def signature(rec: dict) -> list:
+            return [rec["path"], rec["mtime"], rec["size"]]
+
+        # 从第一个缺失或输入有变化的文件开始, 接着它前一个文件末尾未完成的bar
+        resume = 0
+        if skip_existed:
+            while (
+                resume < len(inputs)
+                and state.get("dates", {}).get(inputs[resume]["date"])
+                == signature(inputs[resume])
+                and os.path.exists(save_path(inputs[resume]))
+            ):
+                resume += 1
+        if resume == 0:
+            state = {"dates": {}, "carries": {}}
+        carry, offset = None, 0.0
+        if resume > 0:
+            row, offset = state["carries"][inputs[resume - 1]["date"]]
+            carry = pl.DataFrame([row]) if row else None
+
+        catalog_records: list[dict] = []
+        failed: list[str] = []
+        read_bytes = 0
+        try:
+            for rec in tqdm(inputs[resume:], desc="Convert bars", disable=not progress):
+                start, end = TimeTools.parse_period(rec["date"])
+                try:
+                    bars: list[pl.DataFrame] = []
+                    # symbol列为Categorical, 各块共用字符串缓存, 拼接时不需要重新编码
+                    with pl.StringCache():
+                        for chunk in Kline.chunk_ranges(
+                            (start, end), "1s", Kline.trade_rate(rec)
+                        ):
+                            lf = DataReader.scan(
+                                symbol_type="spot",
+                                agg_period=agg_period,
+                                data_type="aggTrades",
+                                symbols=symbol,
+                                filters=chunk,
+                            )
+                            # 块内没有成交文件时跳过, 未完成的bar和累计量留给下一块
+                            if lf is None:
+                                continue
+                            done, carry, offset = Spot.bn_aggTrades_to_bars(
+                                lf, kind, threshold, carry, offset
+                            )
+                            bars.append(done)
+                        if not bars:
+                            # 所有块都没有成交文件, 输出列与正常结果相同的空bar
+                            lf = DataReader.scan(
+                                symbol_type="spot",
+                                agg_period=agg_period,
+                                data_type="aggTrades",
+                                symbols=symbol,
+                            )
+                            if lf is None:
+                                raise ValueError(
+                                    f"No aggTrades data found for {symbol}."
+                                )
+                            done, _, _ = Spot.bn_aggTrades_to_bars(
+                                lf.clear(), kind, threshold
+                            )
+                            bars.append(done)
+                        bdf = Spot.finish_bars(pl.concat(bars))
+                        # 字符串缓存只在一个文件内有效, 传给下一个文件的bar与从状态恢复时一样用String
+                        if carry is not None:
+                            carry = carry.with_columns(pl.col("symbol").cast(pl.String))
+                    os.makedirs(save_dir, exist_ok=True)
+                    bdf.write_parquet(
+                        save_path(rec) + ".part", **ParquetProfile.options()
+                    )
+                    os.replace(save_path(rec) + ".part", save_path(rec))
+                except Exception as e:
+                    # 之后的文件依赖这个文件末尾的状态, 停止转换, 下次运行时从这里继续
+                    logger.error(f"Convert {symbol} {rec['date']} failed: {e!r}")
+                    failed.append(rec["date"])
+                    break
+                state["dates"][rec["date"]] = signature(rec)
+                state["carries"][rec["date"]] = [
+                    (
+                        carry.with_columns(
+                            pl.col(pl.Datetime).cast(pl.Int64)
+                        ).to_dicts()[0]
+                        if carry is not None
+                        else None
+                    ),
+                    offset,
+                ]
+                Kline.save_state(state_path, state)
+                read_bytes += rec["size"]
+                catalog_records.append(Catalog.record(save_path(rec), rows=bdf.height))
+        finally:
+            if update_catalog:
+                Catalog.update(catalog_records)
+        logger.info(f"{symbol} {bar_spec}: {len(catalog_records)} files converted.")
+        return {"records": catalog_records, "bytes": read_bytes, "failed": failed}
+
+    @staticmethod
+    @Tracer.traced()
+    def bn_aggTrades_to_bars(
+        at_df: Union[pl.DataFrame, pl.LazyFrame],
+        kind: str,
+        threshold: float,
+        carry: Union[pl.DataFrame, None] = None,
+        carry_offset: float = 0,
+    ) -> tuple[pl.DataFrame, Union[pl.DataFrame, None], float]:
+        """币安aggTrades数据转换为bar, 输入需按时间排序
+
+        Args:
+            at_df (Union[pl.DataFrame, pl.LazyFrame]):
+            kind (str): "tick", "volume", "dollar"
+            threshold (float): 每根bar的累计量
+            carry (Union[pl.DataFrame, None], optional): 上一块末尾未完成的bar. Defaults to None.
+            carry_offset (float, optional): 上一块末尾未完成的bar已累计的量. Defaults to 0.
+
+        Returns:
+            tuple[pl.DataFrame, Union[pl.DataFrame, None], float]:
+                (已完成的bar, 末尾未完成的bar, 未完成的bar已累计的量), bar需经过 finish_bars 输出
+        """
+        at_df = at_df.lazy().with_columns(
+            (pl.col("price") * pl.col("quantity")).alias("quote_asset_volume")
+        )
+        at_df = at_df.with_columns(
+            BAR_MEASURES[kind].cast(pl.Float64).alias("measure"),
+            pl.when(pl.col("was_the_buyer_the_maker"))
+            .then(pl.col("quote_asset_volume"))
+            .otherwise(0)
+            .alias("volume_the_maker_buy"),
+            pl.when(pl.col("was_the_trade_the_best_price_match"))
+            .then(pl.col("quote_asset_volume"))
+            .otherwise(0)
+            .alias("volume_best_price_match"),
+        )
+        # 成交前的累计量决定所属的bar, 使累计量达到阈值的成交属于当前bar
+        at_df = at_df.with_columns(
+            (
+                (pl.col("measure").cum_sum() - pl.col("measure") + carry_offset)
+                / threshold
+            )
+            .floor()
+            .cast(pl.Int64)
+            .alias("bar_id")
+        )
+        bdf = (
+            at_df.group_by("bar_id", maintain_order=True)
+            .agg(
+                pl.col("timestamp").first().alias("open_timestamp"),
+                pl.col("timestamp").last(),
+                pl.col("symbol").last(),
+                pl.col("first_trade_id").first(),
+                pl.col("last_trade_id").last(),
+                pl.col("quote_asset_volume").sum(),
+                pl.col("quantity").sum(),
+                pl.col("volume_the_maker_buy").sum(),
+                pl.col("volume_best_price_match").sum(),
+                pl.col("measure").sum(),
+                pl.col("price").first().alias("open"),
+                pl.col("price").max().alias("high"),
+                pl.col("price").min().alias("low"),
+                pl.col("price").last().alias("close"),
+            )
+            .collect()
+        )
+        total = carry_offset + bdf["measure"].sum()
+        if carry is not None:
+            # 未完成的bar编号为0, 与本块编号为0的bar合并
+            bdf = (
+                pl.concat([carry.cast(bdf.schema), bdf])
+                .group_by("bar_id", maintain_order=True)
+                .agg(
+                    pl.col("open_timestamp").first(),
+                    pl.col("timestamp").last(),
+                    pl.col("symbol").last(),
+                    pl.col("first_trade_id").first(),
+                    pl.col("last_trade_id").last(),
+                    pl.col("quote_asset_volume").sum(),
+                    pl.col("quantity").sum(),
+                    pl.col("volume_the_maker_buy").sum(),
+                    pl.col("volume_best_price_match").sum(),
+                    pl.col("measure").sum(),
+                    pl.col("open").first(),
+                    pl.col("high").max(),
+                    pl.col("low").min(),
+                    pl.col("close").last(),
+                )
+            )
+        if bdf.is_empty():
+            return bdf, None, carry_offset
+        # 最后一根bar的累计量未达到阈值时传递给下一块
+        last_id = bdf["bar_id"][-1]
+        offset = total - (total // threshold) * threshold
+        if total < (last_id + 1) * threshold:
+            return bdf[:-1], bdf[-1:].with_columns(pl.lit(0).alias("bar_id")), offset
+        return bdf, None, offset
+
+    @staticmethod
+    def finish_bars(bdf: pl.DataFrame) -> pl.DataFrame:
+        """已完成的bar整理为与k线相同的列, 另加bar开始时间 open_timestamp"""
+        return bdf.select(
+            pl.col("timestamp"),
+            pl.col("open_timestamp"),
+            pl.col("symbol"),
+            pl.col("quote_asset_volume"),
+            pl.col("quantity"),
+            pl.col("volume_the_maker_buy"),
+            pl.col("volume_best_price_match"),
+            pl.col("open"),
+            pl.col("high"),
+            pl.col("low"),
+            pl.col("close"),
+            (pl.col("last_trade_id") - pl.col("first_trade_id") + 1)
+            .cast(pl.Int32)
+            .alias("total_trades"),
+        )
+
+
+if __name__ == "__main__":
+    Spot.all_aggtrades_to_bars("tick-1000", "monthly")
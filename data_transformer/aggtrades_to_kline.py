@@ -2,67 +2,265 @@ import polars as pl
 import numpy as np
 from typing import Union
 import os
+import re
+import json
+import time
+from datetime import datetime, timedelta
 from loguru import logger
 from tqdm import tqdm
 
 # ==== Customized Modules ====
-from utils import PathBinance, PathLocal, ConfigLoader, TimeTools
+from utils import (
+    PathBinance,
+    ConfigLoader,
+    TimeTools,
+    ParquetProfile,
+    MemoryBudgetPool,
+    Metrics,
+    Tracer,
+)
 from data_reader.reader import DataReader
+from data_reader.catalog import Catalog
 
 config = ConfigLoader.load_config()
 
+# k线文件的输入状态, 与k线文件放在同一目录
+KLINE_STATE_FILE = "_state.json"
+# 转换时每条成交的内存估计(字节), 包括读取的列和计算的中间列
+TRADE_ROW_BYTES = 100
+
 
 class Spot:
     @staticmethod
-    def all_aggtrades_to_kline(time_period: str, agg_period: str, skip_existed=True):
+    def all_aggtrades_to_kline(
+        time_period: Union[str, list], agg_period: str, skip_existed=True
+    ):
         """全部aggTrades数据转换为k线数据
 
+        标的分配到进程池并行转换, 按估计内存准入, 大标的先开始, 小标的填满剩余预算.
+        单个标的失败不影响其他标的, 索引在主进程中统一更新
+
         Args:
-            time_period (str): 转换k线的时间周期
+            time_period (Union[str, list]): 转换k线的时间周期, 多个周期时一次读取同时输出
             agg_period (str): "daily","monthly"
             skip_existed (bool, optional): 跳过已存在的文件. Defaults to True.
         """
-        p: str = PathBinance.get_data_frequency(
-            type_="spot", agg_period=agg_period, data_type="aggTrades"
-        )[0]
-        dir_path = os.path.join(config["save_downloaded_data_dir"], p)
-        file_paths: list = PathLocal.get_dir_path_from_dir(dir_path)
-        symbols: list = [p.split("/")[-1] for p in file_paths]
-        for n, symbol in enumerate(symbols):
-            print(f"Symbol: {symbol} {n+1}/{len(symbols)}")
-            Spot.from_file(
-                symbol=symbol,
-                time_period=time_period,
-                agg_period=agg_period,
-                skip_existed=skip_existed,
+        Metrics.start_run()
+        Tracer.start_run()
+        datasets = Catalog.load()
+        records: list[dict] = datasets.get(
+            ("spot", agg_period, "aggTrades", "aggTrades"), []
+        )
+        # 每次转换一个周期的文件(跨边界时加上相邻文件的一部分), 内存与最大的文件有关,
+        # 大文件分块转换, 内存不超过分块上限加上聚合的中间结果
+        chunk_bytes = 2 * config["kline_chunk_memory_mb"] * 1024 * 1024
+        max_size: dict[str, int] = {}
+        for rec in records:
+            max_size[rec["symbol"]] = max(max_size.get(rec["symbol"], 0), rec["size"])
+        jobs = [
+            (symbol, min(int(size * config["kline_memory_factor"]), chunk_bytes))
+            for symbol, size in max_size.items()
+        ]
+        print(f"Convert {len(jobs)} symbols to kline {time_period}.")
+        logger.info(f"Convert {len(jobs)} symbols to kline {time_period}.")
+
+        pool = MemoryBudgetPool(
+            config["kline_n_workers"], config["kline_memory_budget_mb"] * 1024 * 1024
+        )
+        catalog_records: list[dict] = []
+        failed: list[str] = []
+        total_bytes, start = 0, time.perf_counter()
+        with Metrics.stage("convert") as st:
+            try:
+                with tqdm(total=len(jobs), desc="Convert kline", unit="symbol") as pbar:
+                    for symbol, result in pool.imap_unordered(
+                        Spot.convert_symbol, jobs, time_period, agg_period, skip_existed
+                    ):
+                        pbar.update(1)
+                        if isinstance(result, Exception):
+                            logger.error(f"Convert {symbol} failed: {result!r}")
+                            failed.append(symbol)
+                            Metrics.inc("binance_kline_symbols_total", status="failed")
+                            continue
+                        if result["failed"]:
+                            failed.append(symbol)
+                        Metrics.inc(
+                            "binance_kline_symbols_total",
+                            status="partial" if result["failed"] else "done",
+                        )
+                        catalog_records.extend(result["records"])
+                        total_bytes += result["bytes"]
+                        st.add("files", len(result["records"]))
+                        st.add("rows", sum(r["rows"] for r in result["records"]))
+                        st.add("bytes", result["bytes"])
+                        st.add_cpu(result["cpu_seconds"])
+                        elapsed = time.perf_counter() - start
+                        pbar.set_postfix(
+                            files=len(catalog_records),
+                            MB_s=f"{total_bytes / 1024 / 1024 / elapsed:.1f}",
+                        )
+            finally:
+                Catalog.update(catalog_records)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Converted {len(jobs)} symbols, {len(catalog_records)} files, "
+            f"{total_bytes / 1024 / 1024:.1f} MB aggTrades in {elapsed:.1f}s "
+            f"({total_bytes / 1024 / 1024 / elapsed:.1f} MB/s)."
+        )
+        if failed:
+            logger.error(f"{len(failed)} symbols failed or partially failed: {failed}")
+        Metrics.export("kline")
+        Tracer.export("kline")
+
+    @staticmethod
+    def convert_symbol(
+        symbol: str,
+        time_period: Union[str, list],
+        agg_period: str,
+        skip_existed: bool = True,
+    ) -> dict:
+        """进程池中转换一个标的, 索引记录返回给主进程更新
+
+        Returns:
+            dict: {"records": 新文件的索引记录, "bytes": 读取的aggTrades字节数, "failed": 失败的日期, "cpu_seconds"}
+        """
+        cpu_start = time.process_time()
+        result = Spot.from_file(
+            symbol=symbol,
+            time_period=time_period,
+            agg_period=agg_period,
+            skip_existed=skip_existed,
+            update_catalog=False,
+            progress=False,
+        )
+        result["cpu_seconds"] = time.process_time() - cpu_start
+        return result
+
+    @staticmethod
+    def bar_range(
+        start: datetime, end: datetime, time_period: str
+    ) -> tuple[datetime, datetime]:
+        """开始时间在 [start, end) 内的k线所覆盖的成交时间区间
+
+        周期不能整除一天(或一月)时, 首尾的k线会跨越文件边界:
+        开始时间早于start的k线属于上一个文件, 最后一根k线需要下一个文件的成交
+        """
+        bounds = pl.Series([start, end - timedelta(milliseconds=1)]).dt.truncate(
+            time_period
+        )
+        first, last = bounds[0], bounds[1]
+        if first < start:
+            first = pl.Series([first]).dt.offset_by(time_period)[0]
+        return first, pl.Series([last]).dt.offset_by(time_period)[0]
+
+    @staticmethod
+    def load_state(state_path: str) -> dict:
+        """k线文件的输入状态 {date: [[aggTrades路径, mtime, size], ...]}"""
+        if not os.path.exists(state_path):
+            return {}
+        try:
+            with open(state_path, "r") as fin:
+                return json.load(fin)
+        except Exception as e:
+            logger.warning(f"Broken kline state {state_path}: {e}")
+            return {}
+
+    @staticmethod
+    def save_state(state_path: str, state: dict) -> None:
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with open(state_path + ".tmp", "w") as fout:
+            json.dump(state, fout)
+        os.replace(state_path + ".tmp", state_path)
+
+    @staticmethod
+    def duration_ms(time_period: str) -> Union[int, None]:
+        """固定长度周期的毫秒数, 周/月/季/年等日历周期返回None
+
+        polars按周截断时对齐到周一, 其他固定周期对齐到1970-01-01, 所以周按日历周期处理
+        """
+        units = {
+            "ms": 1,
+            "s": 1000,
+            "m": 60_000,
+            "h": 3_600_000,
+            "d": 86_400_000,
+        }
+        parts = re.findall(r"(\d+)([a-z]+)", time_period)
+        if not parts or any(unit not in units for _, unit in parts):
+            return None
+        return sum(int(n) * units[unit] for n, unit in parts)
+
+    @staticmethod
+    def sort_time_periods(time_periods: list[str]) -> list[str]:
+        """按周期从小到大排序, 并检查每个周期都能由最小周期的k线合成
+
+        Raises:
+            ValueError: 周期不是最小周期的整数倍
+
+        Returns:
+            list[str]: 第一个为最小周期
+        """
+        fixed = sorted(
+            [tp for tp in time_periods if Spot.duration_ms(tp) is not None],
+            key=Spot.duration_ms,
+        )
+        calendar = [tp for tp in time_periods if Spot.duration_ms(tp) is None]
+        if not fixed and len(calendar) == 1:
+            return calendar
+        if not fixed:
+            raise ValueError(
+                f"At least one fixed time period is required: {time_periods}"
             )
+        finest = Spot.duration_ms(fixed[0])
+        for tp in fixed[1:]:
+            if Spot.duration_ms(tp) % finest != 0:
+                raise ValueError(f"{tp} is not a multiple of {fixed[0]}")
+        # 日历周期的边界在整天上
+        if calendar and Spot.duration_ms("1d") % finest != 0:
+            raise ValueError(f"{calendar} can not be rolled up from {fixed[0]}")
+        return list(dict.fromkeys(fixed + calendar))
 
     @staticmethod
     def from_file(
         symbol: str,
-        time_period: str,
+        time_period: Union[str, list],
         agg_period: str,
         start_date: Union[str, None] = None,
         end_date: Union[str, None] = None,
         skip_existed=True,
-    ) -> pl.DataFrame:
-        """读取文件转换后输出文件
+        update_catalog: bool = True,
+        progress: bool = True,
+    ) -> dict:
+        """读取文件转换后输出文件, 只转换缺失或输入有变化的周期
+
+        每个aggTrades文件(月或天)对应一个k线文件, 包含开始时间在该周期内的k线.
+        customized-{time_period}/_state.json 记录每个k线文件读取的aggTrades文件及其mtime和大小,
+        aggTrades重新发布或跨边界k线需要的相邻文件新增时, 重新转换该周期. 各周期的状态分别比较,
+        只转换输入有变化的周期
+
+        多个k线周期时, 需要转换的周期一起读取aggTrades文件, 先转换最小周期的k线, 其他周期由它合成
+        日度文件的日历周期(周, 月)只在周期第一天的文件中输出, 其他日期不输出文件
 
         Args:
             symbol (str): 标的
-            time_period (str): 转换k线的时间周期
+            time_period (Union[str, list]): 转换k线的时间周期
             agg_period (str): "daily","monthly"
             start_date (Union[str, None], optional): 开始日期. Defaults to None.
             end_date (Union[str, None], optional): 结束日期. Defaults to None.
-            skip_existed: (bool, optional) 跳过已存在的文件 Defaults to True.
+            skip_existed: (bool, optional) 跳过已是最新的文件, False时全部重新转换 Defaults to True.
+            update_catalog (bool, optional): 更新索引, 在进程池中运行时由主进程更新. Defaults to True.
+            progress (bool, optional): 显示进度条. Defaults to True.
 
         Returns:
+            dict: {"records": 新文件的索引记录, "bytes": 读取的aggTrades字节数, "failed": 失败的日期}
         """
         logger.info(
             f"Convert aggTrades to kline. symbol: {symbol} time_period : {time_period}  agg_period: {agg_period} start_date: {start_date} end_date: {end_date} skip_existed: {skip_existed}"
         )
-        # 只能拿一个symbol
-        df = DataReader.read_parquet(
+        time_periods = Spot.sort_time_periods(
+            [time_period] if isinstance(time_period, str) else time_period
+        )
+        inputs = DataReader.get_records(
             symbol_type="spot",
             agg_period=agg_period,
             data_type="aggTrades",
@@ -70,40 +268,234 @@ class Spot:
             end_date=end_date,
             symbols=symbol,
         )
-        df = Spot.bn_aggTrades_to_kline(df, time_period)
+        if not inputs:
+            logger.warning(f"No aggTrades data found for {symbol}.")
+            return {"records": [], "bytes": 0, "failed": []}
         path = PathBinance.get_data_frequency(
             type_="spot", agg_period=agg_period, data_type="klines"
         )[0]
-        if "monthly" in path:
-            # 月度数据根据月份分块
-            df = df.with_columns(
-                [
-                    pl.datetime(
-                        year=pl.col("timestamp").dt.year(),
-                        month=pl.col("timestamp").dt.month(),
-                        day=1,
-                    ).alias("date")
-                ]
+        save_dirs = {
+            tp: os.path.join(
+                config["save_released_data_dir"], path, symbol, f"customized-{tp}"
             )
-            for t, f in tqdm(
-                df.group_by("date"),
-                desc="Save kline",
-                total=len(df.group_by("date").n_unique()),
-            ):
-                date = t[0].strftime("%Y-%m")
-                save_path = os.path.join(
-                    config["save_released_data_dir"],
-                    path,
-                    symbol,
-                    f"customized-{time_period}",
-                    f"{symbol}-{time_period}-{date}.parquet",
+            for tp in time_periods
+        }
+        states = {
+            tp: Spot.load_state(os.path.join(d, KLINE_STATE_FILE))
+            for tp, d in save_dirs.items()
+        }
+        catalog_records: list[dict] = []
+        failed: list[str] = []
+        read_bytes = 0
+        try:
+            for rec in tqdm(inputs, desc="Convert kline", disable=not progress):
+                start, end = TimeTools.parse_period(rec["date"])
+                ranges = {tp: Spot.bar_range(start, end, tp) for tp in time_periods}
+                # 日度文件的日历周期(周, 月)只有周期第一天有k线, 其他日期的区间为空, 不输出文件
+                for tp in [tp for tp, r in ranges.items() if r[0] >= r[1]]:
+                    states[tp][rec["date"]] = []
+                    del ranges[tp]
+                if not ranges:
+                    continue
+                # 每个周期只依赖它自己的k线覆盖的aggTrades文件, 粗周期的依赖变化不会让细周期重新转换
+                deps: dict[str, list[dict]] = {}
+                found: dict[tuple, list[dict]] = {}
+                for tp, (first, last) in ranges.items():
+                    if (first, last) not in found:
+                        found[(first, last)] = DataReader.get_records(
+                            symbol_type="spot",
+                            agg_period=agg_period,
+                            data_type="aggTrades",
+                            start_date=first.strftime("%Y-%m-%d"),
+                            end_date=(last - timedelta(milliseconds=1)).strftime(
+                                "%Y-%m-%d"
+                            ),
+                            symbols=symbol,
+                        )
+                    deps[tp] = found[(first, last)]
+                signatures = {
+                    tp: [[d["path"], d["mtime"], d["size"]] for d in deps[tp]]
+                    for tp in ranges
+                }
+                save_paths = {
+                    tp: os.path.join(
+                        save_dirs[tp], f"{symbol}-{tp}-{rec['date']}.parquet"
+                    )
+                    for tp in ranges
+                }
+                stale = [
+                    tp
+                    for tp in ranges
+                    if not skip_existed
+                    or not os.path.exists(save_paths[tp])
+                    or states[tp].get(rec["date"]) != signatures[tp]
+                ]
+                if not stale:
+                    continue
+                # 需要转换的周期的k线覆盖的成交区间, 边界都在最小周期的整数倍上
+                first = min(ranges[tp][0] for tp in stale)
+                last = max(ranges[tp][1] for tp in stale)
+                used = list({d["path"]: d for tp in stale for d in deps[tp]}.values())
+
+                try:
+                    rows = Spot.convert_period(
+                        symbol,
+                        agg_period,
+                        stale,
+                        (first, last),
+                        (start, end),
+                        {tp: save_paths[tp] for tp in stale},
+                        trade_rate=max(Spot.trade_rate(d) for d in used),
+                    )
+                except Exception as e:
+                    # 单个周期失败不影响其他周期, 状态未更新, 下次运行时重新转换
+                    logger.error(f"Convert {symbol} {rec['date']} failed: {e!r}")
+                    failed.append(rec["date"])
+                    continue
+                read_bytes += sum(d["size"] for d in used)
+                for tp, n in rows.items():
+                    states[tp][rec["date"]] = signatures[tp]
+                    catalog_records.append(Catalog.record(save_paths[tp], rows=n))
+        finally:
+            for tp, d in save_dirs.items():
+                Spot.save_state(os.path.join(d, KLINE_STATE_FILE), states[tp])
+            if update_catalog:
+                Catalog.update(catalog_records)
+        logger.info(f"{symbol} {time_periods}: {len(catalog_records)} files converted.")
+        return {"records": catalog_records, "bytes": read_bytes, "failed": failed}
+
+    @staticmethod
+    def convert_period(
+        symbol: str,
+        agg_period: str,
+        time_periods: list[str],
+        trade_range: tuple[datetime, datetime],
+        bar_range: tuple[datetime, datetime],
+        save_paths: dict[str, str],
+        trade_rate: float = 0,
+    ) -> dict[str, int]:
+        """转换一个周期, 最小周期由成交数据转换, 其他周期由它合成
+
+        成交数据按 chunk_ranges 分块读取, 内存占用由 kline_chunk_memory_mb 决定, 与文件大小无关.
+        块的边界对齐到基础周期(最小的固定周期, 只有日历周期时为1d), 基础周期的k线不会跨块,
+        各块的基础k线拼接后再合成其他周期
+
+        Args:
+            symbol (str):
+            agg_period (str): "daily","monthly"
+            time_periods (list[str]): 第一个为最小周期
+            trade_range (tuple[datetime, datetime]): 读取的成交时间区间
+            bar_range (tuple[datetime, datetime]): 输出开始时间在该区间内的k线
+            save_paths (dict[str, str]): {周期: 保存路径}
+            trade_rate (float, optional): 每毫秒成交条数, 用于确定分块大小, 0表示不分块. Defaults to 0.
+
+        Returns:
+            dict[str, int]: {周期: k线数量}
+        """
+        base = time_periods[0]
+        if Spot.duration_ms(base) is None:
+            base = "1d"
+        bars: list[pl.DataFrame] = []
+        # symbol列为Categorical, 各块共用字符串缓存, 拼接时不需要重新编码
+        with pl.StringCache():
+            for chunk in Spot.chunk_ranges(trade_range, base, trade_rate):
+                # 在LazyFrame上组合聚合, 只读取块内的数据
+                lf = DataReader.scan(
+                    symbol_type="spot",
+                    agg_period=agg_period,
+                    data_type="aggTrades",
+                    symbols=symbol,
+                    filters=chunk,
+                )
+                # 跨边界的块可能超出已有的文件
+                if lf is not None:
+                    bars.append(Spot.bn_aggTrades_to_kline(lf, base))
+            if not bars:
+                # 所有块都没有成交文件, 输出列与正常结果相同的空k线
+                lf = DataReader.scan(
+                    symbol_type="spot",
+                    agg_period=agg_period,
+                    data_type="aggTrades",
+                    symbols=symbol,
                 )
-                f = f.drop(["date"])
-                if not os.path.exists(save_path):
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                    f.write_parquet(save_path)
-                elif not skip_existed:
-                    f.write_parquet(save_path)
+                if lf is None:
+                    raise ValueError(f"No aggTrades data found for {symbol}.")
+                bars.append(Spot.bn_aggTrades_to_kline(lf.clear(), base))
+            base_bars = pl.concat(bars)
+        rows: dict[str, int] = {}
+        for tp in time_periods:
+            kdf = base_bars if tp == base else Spot.resample_kline(base_bars, tp)
+            kdf = kdf.filter(
+                (pl.col("timestamp") >= bar_range[0])
+                & (pl.col("timestamp") < bar_range[1])
+            )
+            save_path = save_paths[tp]
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            kdf.write_parquet(save_path + ".part", **ParquetProfile.options())
+            os.replace(save_path + ".part", save_path)
+            rows[tp] = kdf.height
+        return rows
+
+    @staticmethod
+    def trade_rate(rec: dict) -> float:
+        """aggTrades文件的平均成交密度(条/毫秒)"""
+        start, end = TimeTools.parse_period(rec["date"])
+        return rec["rows"] / ((end - start).total_seconds() * 1000)
+
+    @staticmethod
+    def chunk_ranges(
+        trade_range: tuple[datetime, datetime], base_period: str, trade_rate: float
+    ) -> list[tuple[datetime, datetime]]:
+        """把成交区间切分为若干块, 按平均成交密度估计每块的内存不超过 kline_chunk_memory_mb
+
+        Args:
+            trade_range (tuple[datetime, datetime]): 起点在base_period的整数倍上
+            base_period (str): 固定长度周期, 块的长度是它的整数倍
+            trade_rate (float): 每毫秒成交条数, 0表示不分块
+
+        Returns:
+            list[tuple[datetime, datetime]]:
+        """
+        if trade_rate <= 0:
+            return [trade_range]
+        step = Spot.duration_ms(base_period)
+        max_rows = config["kline_chunk_memory_mb"] * 1024 * 1024 // TRADE_ROW_BYTES
+        chunk_ms = max(step, int(max_rows / trade_rate) // step * step)
+        lo, hi = trade_range
+        ranges: list[tuple[datetime, datetime]] = []
+        while lo < hi:
+            ranges.append((lo, min(lo + timedelta(milliseconds=chunk_ms), hi)))
+            lo = ranges[-1][1]
+        return ranges
+
+    @staticmethod
+    def resample_kline(kdf: pl.DataFrame, time_period: str) -> pl.DataFrame:
+        """由小周期k线合成大周期k线, 输出与 bn_aggTrades_to_kline 的列一致
+
+        Args:
+            kdf (pl.DataFrame): bn_aggTrades_to_kline 的输出
+            time_period (str): 大周期, 必须是kdf周期的整数倍
+
+        Returns:
+            pl.DataFrame:
+        """
+        return (
+            kdf.lazy()
+            .group_by_dynamic("timestamp", every=time_period)
+            .agg(
+                pl.col("symbol").last(),
+                pl.col("quote_asset_volume").sum(),
+                pl.col("quantity").sum(),
+                pl.col("volume_the_maker_buy").sum(),
+                pl.col("volume_best_price_match").sum(),
+                pl.col("open").first(),
+                pl.col("high").max(),
+                pl.col("low").min(),
+                pl.col("close").last(),
+                pl.col("total_trades").sum().cast(pl.Int32),
+            )
+            .collect()
+        )
 
     @staticmethod
     def from_df(
@@ -122,11 +514,14 @@ class Spot:
         return Spot.bn_aggTrades_to_kline(df, time_period)
 
     @staticmethod
-    def bn_aggTrades_to_kline(at_df: pl.DataFrame, time_period: str) -> pl.DataFrame:
+    @Tracer.traced()
+    def bn_aggTrades_to_kline(
+        at_df: Union[pl.DataFrame, pl.LazyFrame], time_period: str
+    ) -> pl.DataFrame:
         """币安aggTrades数据转换为k线数据
 
         Args:
-            at_df (pl.DataFrame):
+            at_df (Union[pl.DataFrame, pl.LazyFrame]):
             time_period (str):
 
         Returns:
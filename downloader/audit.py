@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import argparse
+from typing import Union
+import polars as pl
+from joblib import Parallel, delayed
+from loguru import logger
+from tqdm import tqdm
+
+# ==== Customized Modules ====
+from utils import ConfigLoader, Manifest, TimeTools
+from .release import Release
+from .enums import BINANCE_SPOT_ID_COLUMNS  # noqa
+
+config = ConfigLoader.load_config()
+
+# 与 Manifest stats 表的列顺序一致
+STATS_SCHEMA: dict = {
+    "key": pl.String,
+    "min_ts": pl.Int64,
+    "max_ts": pl.Int64,
+    "rows": pl.Int64,
+    "first_id": pl.Int64,
+    "last_id": pl.Int64,
+    "gap_count": pl.Int64,
+    "gaps": pl.String,
+}
+# 同一数据集同一标的的文件按日期排序后比较相邻文件
+GROUP_COLUMNS = ["dataset", "symbol"]
+
+
+class Audit:
+    """
+    只根据发布时记录的摘要(Manifest stats 表)检查本地副本, 不读取数据文件
+
+    1. 日期缺失: 同一数据集同一标的相邻文件之间缺少的日期(或月份)
+    2. 编号不连续: 后一文件的第一个编号不等于前一文件的最后一个编号+1
+    3. 时间重叠: 后一文件的最早时间早于前一文件的最晚时间
+    4. 文件内编号不连续: 发布时记录的 gap_count 和前几个不连续的位置
+    """
+
+    @staticmethod
+    def load_stats(key_words: Union[list, None] = None) -> pl.DataFrame:
+        """读取摘要并解析数据集, 标的和日期
+
+        key: data/spot/daily/aggTrades/BTCUSDT/BTCUSDT-aggTrades-2024-01-01.zip
+        dataset: data/spot/daily/aggTrades
+        """
+        df = pl.DataFrame(Manifest.stats_rows(), schema=STATS_SCHEMA, orient="row")
+        if key_words:
+            df = df.filter(
+                pl.any_horizontal(
+                    [pl.col("key").str.contains(kw, literal=True) for kw in key_words]
+                )
+            )
+        df = df.with_columns(
+            pl.col("key").str.extract(r"^(.*)/[^/]+/[^/]+$").alias("dataset"),
+            pl.col("key").str.extract(r"/([^/]+)/[^/]+$").alias("symbol"),
+            pl.col("key").str.extract(r"-(\d{4}-\d{2}(?:-\d{2})?)\.zip$").alias("date"),
+        )
+        # 日度文件用距1970-01-01的天数, 月度文件用月份序号, 相邻文件的序号差1
+        return df.with_columns(
+            pl.when(pl.col("date").str.len_chars() == 10)
+            .then(pl.col("date").str.to_date("%Y-%m-%d", strict=False).cast(pl.Int64))
+            .otherwise(
+                pl.col("date").str.slice(0, 4).cast(pl.Int64) * 12
+                + pl.col("date").str.slice(5, 2).cast(pl.Int64)
+            )
+            .alias("index")
+        ).sort(GROUP_COLUMNS + ["date"])
+
+    @staticmethod
+    def check(df: pl.DataFrame) -> dict[str, pl.DataFrame]:
+        """相邻文件比较, 全部为列运算
+
+        Args:
+            df (pl.DataFrame): load_stats 的返回值
+
+        Returns:
+            dict[str, pl.DataFrame]: {"missing_dates", "id_breaks", "overlaps", "file_gaps"}
+        """
+        df = df.with_columns(
+            [
+                pl.col(col).shift(1).over(GROUP_COLUMNS).alias(f"prev_{col}")
+                for col in ["index", "date", "last_id", "max_ts"]
+            ]
+        )
+        missing_dates = df.filter(pl.col("index") - pl.col("prev_index") > 1).select(
+            *GROUP_COLUMNS,
+            pl.col("prev_date").alias("after"),
+            pl.col("date").alias("before"),
+            (pl.col("index") - pl.col("prev_index") - 1).alias("missing"),
+        )
+        id_breaks = df.filter(pl.col("first_id") != pl.col("prev_last_id") + 1).select(
+            *GROUP_COLUMNS,
+            pl.col("prev_date").alias("after"),
+            pl.col("date").alias("before"),
+            pl.col("prev_last_id").alias("last_id"),
+            pl.col("first_id"),
+        )
+        overlaps = df.filter(pl.col("min_ts") < pl.col("prev_max_ts")).select(
+            *GROUP_COLUMNS,
+            pl.col("prev_date").alias("after"),
+            pl.col("date").alias("before"),
+            pl.from_epoch("prev_max_ts", time_unit="ms").alias("prev_max_ts"),
+            pl.from_epoch("min_ts", time_unit="ms").alias("min_ts"),
+        )
+        file_gaps = df.filter(pl.col("gap_count") > 0).select(
+            *GROUP_COLUMNS, "date", "gap_count", "gaps"
+        )
+        return {
+            "missing_dates": missing_dates,
+            "id_breaks": id_breaks,
+            "overlaps": overlaps,
+            "file_gaps": file_gaps,
+        }
+
+    @staticmethod
+    def report(
+        key_words: Union[str, list, None] = None, output: Union[str, None] = None
+    ) -> dict[str, pl.DataFrame]:
+        """检查并输出结果
+
+        Args:
+            key_words (Union[str, list, None], optional): 只检查路径包含key_words的文件. Defaults to None.
+            output (Union[str, None], optional): 结果保存为json. Defaults to None.
+
+        Returns:
+            dict[str, pl.DataFrame]: check 的返回值
+        """
+        if isinstance(key_words, str):
+            key_words = [key_words]
+        df = Audit.load_stats(key_words)
+        result = Audit.check(df)
+        print(
+            f"Audited {df.height} files, "
+            f"{df.select(GROUP_COLUMNS).n_unique() if df.height else 0} symbols."
+        )
+        for name, issues in result.items():
+            print(f"{name}: {issues.height}")
+            if issues.height:
+                print(issues.head(10))
+        logger.info(
+            f"Audited {df.height} files: "
+            + ", ".join(f"{name} {issues.height}" for name, issues in result.items())
+        )
+        if output:
+            with open(output, "w") as fout:
+                json.dump(
+                    {name: issues.to_dicts() for name, issues in result.items()},
+                    fout,
+                    default=str,
+                    indent=2,
+                )
+        return result
+
+    @staticmethod
+    def backfill(key_words: Union[str, list, None] = None) -> None:
+        """为记录摘要之前发布的文件读取parquet计算摘要
+
+        发布后的数据按时间排序, 编号在时间相同时可能与csv的顺序不同
+        """
+        if isinstance(key_words, str):
+            key_words = [key_words]
+        existed = {row[0] for row in Manifest.stats_rows()}
+        keys = [
+            k
+            for k in Manifest.zip_keys(only_unreleased=False)
+            if k not in existed and (not key_words or any(kw in k for kw in key_words))
+        ]
+        results = Parallel(n_jobs=config["parallel_n_jobs"], prefer="threads")(
+            delayed(Audit.released_stats)(k) for k in tqdm(keys, desc="Backfill stats")
+        )
+        stats = {k: s for k, s in zip(keys, results) if s is not None}
+        Manifest.set_stats(stats)
+        logger.info(f"Backfilled stats of {len(stats)} files.")
+
+    @staticmethod
+    def released_stats(key: str) -> Union[dict, None]:
+        """读取一个压缩包对应的发布文件计算摘要, 日度文件已按月合并时读取合并文件中的那一天"""
+        try:
+            symbol_type, data_frequency = Release.get_file_type(key)
+            id_col: str = eval(
+                f"BINANCE_{symbol_type}_ID_COLUMNS.{data_frequency}.value"
+            )
+        except (ValueError, AttributeError):
+            return None
+        path = Release.get_release_path(Manifest.local_path_from_key(key))
+        lf = None
+        if os.path.exists(path):
+            lf = pl.scan_parquet(path)
+        else:
+            date = re.findall(r"-(\d{4}-\d{2}-\d{2})\.parquet$", path)
+            month_path = path[: -len("-01.parquet")] + ".parquet" if date else ""
+            if date and os.path.exists(month_path):
+                start, end = TimeTools.parse_period(date[0])
+                lf = pl.scan_parquet(month_path).filter(
+                    pl.col("timestamp").is_between(start, end, closed="left")
+                )
+        if lf is None:
+            return None
+        return Release.file_stats(lf.select(id_col, "timestamp").collect(), id_col)
+
+
+if __name__ == "__main__":
+    # python -m downloader.audit [--backfill] [--key-words spot/daily] [--output audit.json]
+    parser = argparse.ArgumentParser(description="Audit the local mirror")
+    parser.add_argument("--key-words", nargs="*", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--backfill", action="store_true")
+    args = parser.parse_args()
+    if args.backfill:
+        Audit.backfill(args.key_words)
+    Audit.report(args.key_words, args.output)
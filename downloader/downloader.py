@@ -10,11 +10,10 @@ from itertools import chain
 from loguru import logger
 
 # ==== Customized Modules ====
-from utils import ConfigLoader, TimeTools
-from .enums import BINANCE_DATA_URLS
+from utils import ConfigLoader, TimeTools, WebSession, Manifest, Metrics, Tracer
 from utils import PathBinance as binance_pathtool
-from utils import PathLocal as local_pathtool
 from .my_gospeed_api import AsyncGospeedInterface, SyncGospeedClientInterface
+from .native_downloader import AsyncNativeInterface
 
 config = ConfigLoader.load_config()
 
@@ -22,7 +21,14 @@ config = ConfigLoader.load_config()
 class Downloader:
 
     def __init__(self) -> None:
-        self.async_gs_interface = AsyncGospeedInterface()
+        # 下载后端: gospeed(外部下载器) 或 native(进程内下载)
+        if config["download_backend"] == "native":
+            self.async_download_interface = AsyncNativeInterface()
+            return
+        if config["download_backend"] != "gospeed":
+            raise ValueError(f"Unknown download backend: {config['download_backend']}")
+
+        self.async_download_interface = AsyncGospeedInterface()
         self.sync_gs_interface = SyncGospeedClientInterface()
         # 检查连接
         try:
@@ -33,7 +39,7 @@ class Downloader:
 
     @staticmethod
     def ignore_existed_file(download_paths: list[str]) -> list[str]:
-        """忽略存在的文件
+        """忽略已下载的文件(查询清单)
 
         Args:
             download_paths (list[str]):
@@ -41,23 +47,10 @@ class Downloader:
         Returns:
             list[str]:
         """
-        local_path: list[str] = local_pathtool.get_file_path_from_dir(
-            os.path.join(config["save_downloaded_data_dir"], "data")
-        )
-        save_paths: list[str] = [
-            os.path.join(config["save_downloaded_data_dir"], d) for d in download_paths
-        ]
-        result = list(set(save_paths) - set(local_path))
-
-        return sorted(
-            [
-                local_pathtool.remove_subpath(p, config["save_downloaded_data_dir"])[
-                    1:
-                ]  # 删掉第一个/
-                for p in result
-            ]
-        )
+        downloaded: set[str] = Manifest.downloaded_keys(download_paths)
+        return sorted([p for p in download_paths if p not in downloaded])
 
+    @Tracer.traced()
     async def _download_sybol_data(
         self,
         path: str,
@@ -66,6 +59,7 @@ class Downloader:
         end_date: Union[str, None] = None,
         skip_existed: bool = True,
         skip_checksum: bool = False,
+        force_refresh: bool = False,
     ):
         """下载标的数据
 
@@ -76,14 +70,18 @@ class Downloader:
             end_date (Union[str, None], optional))
             skip_existed (bool, optional): 跳过已有数据. Defaults to True.
             skip checksum (bool, optional): 不下载校验和 Defaults to True.
+            force_refresh (bool, optional): 忽略列表缓存. Defaults to False.
         """
         whole_data_type: str = path.split("/")[-3]
         download_paths: list = sorted(
             await binance_pathtool.async_get_path_from_website(
                 # 具有"Klines"的标的有frequancy选项
-                path + f"{frequency}/"
-                if "Klines" in whole_data_type or "klines" in whole_data_type
-                else path
+                (
+                    path + f"{frequency}/"
+                    if "Klines" in whole_data_type or "klines" in whole_data_type
+                    else path
+                ),
+                force_refresh,
             )
         )
 
@@ -119,9 +117,9 @@ class Downloader:
             ]
 
         for dp in download_paths:
-            self.async_gs_interface.tasks.append(
+            self.async_download_interface.tasks.append(
                 {
-                    "url": BINANCE_DATA_URLS.download_url.value + dp,
+                    "url": config["binance_download_url"] + dp,
                     "save_dir": os.path.dirname(dp),
                 }
             )
@@ -139,6 +137,7 @@ class Downloader:
         spot_filter: bool = True,
         skip_existed: bool = True,
         skip_checksum: bool = False,
+        force_refresh: bool = False,
     ):
         """制作币安数据网的本地副本
 
@@ -154,104 +153,103 @@ class Downloader:
             spot_filter (bool, optional): 现货数据过滤稳定币等. Defaults to True.
             skip_existed (bool, optional): 跳过本地已有文件. Defaults to True.
             skip_checksum (bool, optional): 不下载校验和. Defaults to True.
+            force_refresh (bool, optional): 忽略列表缓存, 重新列举所有前缀. Defaults to False.
         """
-        # delete all tasks
-        await self.async_gs_interface.async_delete_all_tasks()
-
-        whole_data_type = await binance_pathtool.async_get_data_frequency(
-            symbol_type, agg_period, data_type
-        )
-        tasks = [
-            binance_pathtool.async_get_path_from_website(d) for d in whole_data_type
-        ]
-        # 获取数据路径 eg.data/xxx/xxx
-        paths: list[list[str]] = []
-        for t in tqdm(
-            asyncio.as_completed(tasks),
-            total=len(tasks),
-            desc="Get data paths",
-        ):
-            paths.append(await t)
-        paths: list[str] = list(chain.from_iterable(paths))
-
-        # 只下载指定交易对
-        # data/spot/monthly/aggTrades/SHIBUAH/ 取交易对
-        if trading_pair is not None:
-            if isinstance(trading_pair, str):
-                trading_pair = [trading_pair]
-            paths = [
-                p for p in paths if any(tp == p.split("/")[-2] for tp in trading_pair)
-            ]
-
-        # 关键字过滤(eg: USDT 只下载USDT交易对)
-        if key_words is not None:
-            if isinstance(key_words, str):
-                key_words = [key_words]
-            paths = [
-                p
-                for p in paths
-                if any(p.split("/")[-2].endswith(kw) for kw in key_words)
-            ]
-
-        # 对现货进行过滤
-        if symbol_type == "spot" and spot_filter:
-            symbols = [p.split("/")[-2] for p in paths]
-            symbols = self.spot_symbols_filter(symbols)
-            paths = [p for p in paths if p.split("/")[-2] in symbols]
-
-        tasks = [
-            self._download_sybol_data(
-                p,
-                frequency,
-                skip_existed=skip_existed,
-                skip_checksum=skip_checksum,
-                start_date=start_date,
-                end_date=end_date,
-            )
-            for p in paths
-        ]
-
-        for f in tqdm(
-            asyncio.as_completed(tasks),
-            total=len(tasks),
-            desc="Find need download files",
-        ):
-            await f
-
-        if len(self.async_gs_interface.tasks) == 0:
-            print("No data need to download.")
-            logger.info("No data need to download.")
-            return
-
-        with tqdm(
-            total=len(self.async_gs_interface.tasks), desc="Downloading", unit="task"
-        ) as pbar:
-            while not self.async_gs_interface.task_done:
-                pos_old = self.async_gs_interface.pos
-                await self.async_gs_interface.gather()
-                await self.async_gs_interface.get_task_info()
-                if pos_old == 0:
-                    continue
-                pbar.update(self.async_gs_interface.pos - pos_old)
-
-        if len(self.async_gs_interface.failed_tasks) == 0:
-            print("All tasks finished.")
-            logger.info("All tasks finished.")
-            return
+        Metrics.start_run()
+        Tracer.start_run()
+        # 列举和校验和请求共用一个连接池, 结束时关闭
+        async with WebSession():
+            # delete all tasks
+            await self.async_download_interface.async_delete_all_tasks()
+            if skip_existed:
+                Manifest.ensure_bootstrapped()
+
+            with Metrics.stage("listing") as st:
+                whole_data_type = await binance_pathtool.async_get_data_frequency(
+                    symbol_type, agg_period, data_type, force_refresh
+                )
+                tasks = [
+                    binance_pathtool.async_get_path_from_website(d, force_refresh)
+                    for d in whole_data_type
+                ]
+                # 获取数据路径 eg.data/xxx/xxx
+                paths: list[list[str]] = []
+                for t in tqdm(
+                    asyncio.as_completed(tasks),
+                    total=len(tasks),
+                    desc="Get data paths",
+                ):
+                    paths.append(await t)
+                paths: list[str] = list(chain.from_iterable(paths))
+
+                # 只下载指定交易对
+                # data/spot/monthly/aggTrades/SHIBUAH/ 取交易对
+                if trading_pair is not None:
+                    if isinstance(trading_pair, str):
+                        trading_pair = [trading_pair]
+                    paths = [
+                        p
+                        for p in paths
+                        if any(tp == p.split("/")[-2] for tp in trading_pair)
+                    ]
+
+                # 关键字过滤(eg: USDT 只下载USDT交易对)
+                if key_words is not None:
+                    if isinstance(key_words, str):
+                        key_words = [key_words]
+                    paths = [
+                        p
+                        for p in paths
+                        if any(p.split("/")[-2].endswith(kw) for kw in key_words)
+                    ]
+
+                # 对现货进行过滤
+                if symbol_type == "spot" and spot_filter:
+                    symbols = [p.split("/")[-2] for p in paths]
+                    symbols = self.spot_symbols_filter(symbols)
+                    paths = [p for p in paths if p.split("/")[-2] in symbols]
+
+                tasks = [
+                    self._download_sybol_data(
+                        p,
+                        frequency,
+                        skip_existed=skip_existed,
+                        skip_checksum=skip_checksum,
+                        start_date=start_date,
+                        end_date=end_date,
+                        force_refresh=force_refresh,
+                    )
+                    for p in paths
+                ]
+
+                for f in tqdm(
+                    asyncio.as_completed(tasks),
+                    total=len(tasks),
+                    desc="Find need download files",
+                ):
+                    await f
+                st.add("symbols", len(paths))
+                st.add("files", len(self.async_download_interface.tasks))
+
+            if len(self.async_download_interface.tasks) == 0:
+                print("No data need to download.")
+                logger.info("No data need to download.")
+                Metrics.export("create_copy")
+                Tracer.export("create_copy")
+                return
 
-        with tqdm(
-            total=len(self.async_gs_interface.failed_tasks),
-            desc="Retrying",
-            unit="task",
-        ) as pbar:
-            while not self.async_gs_interface.failed_task_done:
-                pos_old = self.async_gs_interface.retry_pos
-                await self.async_gs_interface.retry_gather()
-                await self.async_gs_interface.get_task_info()
-                pbar.total = len(self.async_gs_interface.failed_tasks)
-                if pos_old == 0:
-                    continue
-                pbar.update(self.async_gs_interface.retry_pos - pos_old)
+            files = Metrics.value("binance_download_files_total", status="done")
+            n_bytes = Metrics.value("binance_download_bytes_total")
+            with Metrics.stage("download") as st:
+                await self.async_download_interface.download_all()
+                st.add(
+                    "files",
+                    Metrics.value("binance_download_files_total", status="done")
+                    - files,
+                )
+                st.add("bytes", Metrics.value("binance_download_bytes_total") - n_bytes)
+        Metrics.export("create_copy")
+        Tracer.export("create_copy")
 
     def spot_symbols_filter(self, symbols):
         others = []
@@ -1,4 +1,5 @@
 from enum import Enum
+import polars as pl
 
 
 class BINANCE_DATA_URLS(Enum):
@@ -58,5 +59,40 @@ class BINANCE_SPOT_HEADERS(Enum):
     }
 
 
+class BINANCE_SPOT_ID_COLUMNS(Enum):
+    """连续递增的编号列, 用于检查数据缺失"""
+
+    aggTrades: str = "aggregate_trade_id"
+    trades: str = "trade Id"
+
+
+class BINANCE_SPOT_SCHEMAS(Enum):
+    """csv各列的类型, 列名与 BINANCE_SPOT_HEADERS 一致
+
+    价格和数量列写为 pl.Float64, 发布时按 release_float_dtype 替换
+    时间列先按整数读入, 再按 BINANCE_SPOT_TIME_COLUMNS 转换
+    """
+
+    aggTrades: dict = {
+        "aggregate_trade_id": pl.UInt64,
+        "price": pl.Float64,
+        "quantity": pl.Float64,
+        "first_trade_id": pl.UInt64,
+        "last_trade_id": pl.UInt64,
+        "timestamp": pl.Int64,
+        "was_the_buyer_the_maker": pl.Boolean,
+        "was_the_trade_the_best_price_match": pl.Boolean,
+    }
+    trades: dict = {
+        "trade Id": pl.UInt64,
+        "price": pl.Float64,
+        "qty": pl.Float64,
+        "quoteQty": pl.Float64,
+        "timestamp": pl.Int64,
+        "isBuyerMaker": pl.Boolean,
+        "isBestMatch": pl.Boolean,
+    }
+
+
 if __name__ == "__main__":
     pass
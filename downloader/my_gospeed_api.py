@@ -2,10 +2,13 @@ from gospeed_api.index import GospeedClient, AsyncGospeedClient
 import os
 from gospeed_api.models import TASK_STATUS
 import asyncio
+from collections import deque
+from typing import Union
+from tqdm import tqdm
 from loguru import logger
 
 # ==== Customized Modules ====
-from utils import ConfigLoader
+from utils import ConfigLoader, Manifest, Metrics, Tracer
 
 config = ConfigLoader.load_config()
 
@@ -13,7 +16,7 @@ config = ConfigLoader.load_config()
 class SyncGospeedClientInterface:
     """Initialize object with api address."""
 
-    client = GospeedClient("http://127.0.0.1:9999/")
+    client = GospeedClient(config["gospeed_api_url"])
 
     def get_server_info(self):
         """test get server info function"""
@@ -25,70 +28,26 @@ class SyncGospeedClientInterface:
 
 
 class AsyncGospeedInterface:
-    """Initialize object with api address."""
+    """Initialize object with api address.
+
+    调度方式: 始终保持 max_download_tasks 个任务在下载器中,
+    每轮用一次批量查询(DONE/ERROR)获取完成的任务, 删除下载器中的记录后立即补充新任务
+    """
 
     def __init__(self) -> None:
-        self.tasks: list[dict] = []
-        self.pos = 0
-        self.retry_pos = 0
+        self.tasks: list[dict] = []  # {url, save_dir}
         self.failed_tasks: list[dict] = []
-        self.task_done = False
-        self.failed_task_done = False
-        self.ridsmap: list[dict] = []  # {rid, url, save_dir}
-        self.save_dir = ""
+        self.in_flight: dict[str, dict] = {}  # rid -> {url, save_dir}
         self.max_download_tasks = config["max_download_tasks"]
+        self.poll_interval = config["gospeed_poll_interval"]
 
-    async_client = AsyncGospeedClient("http://127.0.0.1:9999/")
-
-    async def retry_gather(self):
-        """重试调度下载任务"""
-        try:
-            running_tasks = await self.async_get_task_list(TASK_STATUS.RUNNING)
-            if len(running_tasks) < self.max_download_tasks:
-                tasks = [
-                    self.async_create_a_task(task["url"], task["save_dir"])
-                    for task in self.failed_tasks[
-                        self.retry_pos : self.retry_pos
-                        + self.max_download_tasks
-                        - len(running_tasks)
-                    ]
-                ]
-                if self.retry_pos < len(self.failed_tasks):
-                    for coro in asyncio.as_completed(tasks):
-                        await coro
-                else:
-                    self.failed_task_done = True
-                self.retry_pos += self.max_download_tasks - len(running_tasks)
-        except Exception as e:
-            logger.error(e)
-
-    async def gather(self):
-        """调度下载任务"""
-        try:
-            running_tasks = await self.async_get_task_list(TASK_STATUS.RUNNING)
-            if len(running_tasks) < self.max_download_tasks:
-                tasks = [
-                    self.async_create_a_task(task["url"], task["save_dir"])
-                    for task in self.tasks[
-                        self.pos : self.pos
-                        + self.max_download_tasks
-                        - len(running_tasks)
-                    ]
-                ]
-                if self.pos < len(self.tasks):
-                    for coro in asyncio.as_completed(tasks):
-                        await coro
-                else:
-                    self.task_done = True
-                self.pos += self.max_download_tasks - len(running_tasks)
-        except Exception as e:
-            logger.error(e)
+    async_client = AsyncGospeedClient(config["gospeed_api_url"])
 
-    async def async_get_task_list(self, status):
+    async def async_get_task_list(self, status: set):
         """获取任务列表
 
         Args:
-            status (_type_): 任务状态
+            status (set): 任务状态, eg: {TASK_STATUS.DONE, TASK_STATUS.ERROR}
 
         Returns:
             list:
@@ -96,7 +55,7 @@ class AsyncGospeedInterface:
         from gospeed_api.models.get_task_list import GetTaskList_Response
 
         data: GetTaskList_Response = await self.async_client.async_get_task_list(
-            status={status}
+            status=status
         )
         assert data.code == 0, "Cannot get task list."
         return data.data
@@ -113,19 +72,21 @@ class AsyncGospeedInterface:
         res = await self.async_client.async_get_task_list()
         assert len(res.data) == 0, "There are still tasks in downloader."
 
-    async def async_create_a_task(self, url: str, save_dir: str):
+    async def async_create_a_task(self, url: str, save_dir: str) -> Union[str, None]:
         """创建gospeed任务
 
         Args:
             url (str): 下载链接
             save_dir (str): 保存至(根目录为docker启动时的挂载点)
+
+        Returns:
+            Union[str, None]: 任务id, 创建失败时返回None
         """
         from gospeed_api.models.resolve_a_request import ResolveRequest
         from gospeed_api.models.create_a_task import (
             CreateTask_DownloadOpt,
             CreateATask_fromResolvedId,
         )
-        from gospeed_api.models import TASK_STATUS
 
         try:
             id_resolve_response = await self.async_client.async_resolve_a_request(
@@ -133,8 +94,7 @@ class AsyncGospeedInterface:
             )
             if id_resolve_response.code != 0:
                 logger.error(f"Cannot resolve resource {url}")
-                self.failed_tasks.append({"url": url, "save_dir": save_dir})
-                return
+                return None
 
             # Create download task from resolved id
             rid = id_resolve_response.data.id
@@ -142,32 +102,125 @@ class AsyncGospeedInterface:
             opt = CreateTask_DownloadOpt(
                 # path前加docker指定位置
                 name=filename,
-                path=os.path.join("/app/Downloads/", save_dir),
+                path=os.path.join(config["gospeed_download_dir"], save_dir),
             )
             task = await self.async_client.async_create_a_task_from_resolved_id(
                 CreateATask_fromResolvedId(rid=rid, opt=opt)
             )
             if task.code != 0:
                 logger.error(f"Cannot create task {url}")
-                self.failed_tasks.append({"url": url, "save_dir": save_dir})
-                return
+                return None
 
-            self.ridsmap.append({"rid": task.data, "url": url, "save_dir": save_dir})
+            return task.data
 
         except Exception as e:
             logger.error(f"Download {url} failed. exception: {e}")
-            self.failed_tasks.append({"url": url, "save_dir": save_dir})
+            return None
+
+    async def _fill_slots(self, queue: deque, failed: list[dict]) -> int:
+        """把空闲的下载位补满
+
+        Returns:
+            int: 创建失败(已经结束)的任务数
+        """
+        n_free = self.max_download_tasks - len(self.in_flight)
+        batch = [queue.popleft() for _ in range(min(n_free, len(queue)))]
+        if not batch:
+            return 0
+        with Tracer.span("gather", what="create tasks", tasks=len(batch)):
+            rids = await asyncio.gather(
+                *[self.async_create_a_task(t["url"], t["save_dir"]) for t in batch]
+            )
+        n_failed = 0
+        for task, rid in zip(batch, rids):
+            if rid is None:
+                failed.append(task)
+                n_failed += 1
+            else:
+                self.in_flight[rid] = task
+        Metrics.set("binance_download_queue_depth", len(queue))
+        Metrics.set("binance_download_in_flight", len(self.in_flight))
+        return n_failed
+
+    @Tracer.traced()
+    async def _collect_finished(self, failed: list[dict]) -> int:
+        """批量查询已结束的任务, 并从下载器中删除它们(保留文件)
+
+        Returns:
+            int: 本轮结束的任务数
+        """
+        finished = await self.async_get_task_list({TASK_STATUS.DONE, TASK_STATUS.ERROR})
+        finished_rids: list[str] = []
+        done_keys: list[str] = []
+        error_keys: list[str] = []
+        for task_info in finished:
+            task = self.in_flight.pop(task_info.id, None)
+            if task is None:
+                continue
+            finished_rids.append(task_info.id)
+            key = task["save_dir"] + "/" + os.path.basename(task["url"])
+            if task_info.status == TASK_STATUS.ERROR:
+                logger.error(f"Download {task['url']} failed.")
+                failed.append(task)
+                error_keys.append(key)
+                Metrics.inc("binance_download_files_total", status="error")
+            else:
+                logger.info(f"Download {task['url']} done.")
+                done_keys.append(key)
+                Metrics.inc("binance_download_files_total", status="done")
+                Metrics.inc(
+                    "binance_download_bytes_total", task_info.progress.downloaded
+                )
+                # used 为纳秒
+                Metrics.observe(
+                    "binance_download_seconds", task_info.progress.used / 1e9
+                )
+        # 重新下载时gospeed不会覆盖已有文件, 整理为原文件名后再记录大小
+        Manifest.resolve_duplicates(done_keys)
+        Manifest.mark_downloaded(done_keys)
+        Manifest.mark_downloaded(error_keys, state="failed")
+        Metrics.set("binance_download_in_flight", len(self.in_flight))
+
+        # 删除后下载器中的任务数不再随已完成任务增长
+        with Tracer.span("gather", what="delete tasks", tasks=len(finished_rids)):
+            await asyncio.gather(
+                *[
+                    self.async_client.async_delete_a_task(rid, force=False)
+                    for rid in finished_rids
+                ],
+                return_exceptions=True,
+            )
+        return len(finished_rids)
+
+    async def _schedule(self, tasks: list[dict], desc: str) -> list[dict]:
+        """调度任务直到全部结束, 返回失败的任务"""
+        queue = deque(tasks)
+        failed: list[dict] = []
+        self.in_flight = {}
+        with tqdm(total=len(tasks), desc=desc, unit="task") as pbar:
+            while queue or self.in_flight:
+                try:
+                    pbar.update(await self._fill_slots(queue, failed))
+                    if not self.in_flight:
+                        continue
+                    n_finished = await self._collect_finished(failed)
+                except Exception as e:
+                    logger.error(e)
+                    n_finished = 0
+                pbar.update(n_finished)
+                # 没有任务结束时才等待, 有空位时立即补充
+                if n_finished == 0:
+                    await asyncio.sleep(self.poll_interval)
+        return failed
+
+    async def download_all(self):
+        """调度所有任务直到完成, 失败的任务重试一轮"""
+        self.failed_tasks = await self._schedule(self.tasks, "Downloading")
+        if len(self.failed_tasks) == 0:
+            print("All tasks finished.")
+            logger.info("All tasks finished.")
             return
 
-    async def get_task_info(self):
-        for data in self.ridsmap:
-            rid = data["rid"]
-            url = data["url"]
-            save_dir = data["save_dir"]
-            task_info = await self.async_client.async_get_task_info(rid=rid)
-            if task_info.data.status == TASK_STATUS.DONE:
-                logger.info(f"Download {url} done.")
-            if task_info.data.status == TASK_STATUS.ERROR:
-                logger.error(f"Download {url} failed.")
-                self.failed_tasks.append({"url": url, "save_dir": save_dir})
-        self.ridsmap = []
+        self.failed_tasks = await self._schedule(self.failed_tasks, "Retrying")
+        if self.failed_tasks:
+            logger.error(f"{len(self.failed_tasks)} tasks failed after retry.")
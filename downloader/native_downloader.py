@@ -0,0 +1,185 @@
+import time
+import httpx
+import os
+import asyncio
+from typing import Union
+from tqdm import tqdm
+from loguru import logger
+
+# ==== Customized Modules ====
+from utils import ConfigLoader, WebSession, HostLimiter, Manifest, Metrics, Tracer
+
+config = ConfigLoader.load_config()
+
+
+class AsyncNativeInterface:
+    """进程内下载引擎, 基于httpx流式下载直接写入 save_downloaded_data_dir
+
+    1. 分块写入, 内存占用只与 native_chunk_size * max_download_tasks 有关
+    2. 先写入 .part 文件, 下载完成后原子重命名
+    3. 已存在的 .part 文件通过 HTTP Range 断点续传
+    """
+
+    def __init__(self) -> None:
+        self.tasks: list[dict] = []  # {url, save_dir}
+        self.failed_tasks: list[dict] = []
+        self.in_flight = 0  # 正在下载的任务数
+        self.max_download_tasks = config["max_download_tasks"]
+        self.chunk_size = config["native_chunk_size"]
+        self.retries = config["native_download_retries"]
+        self.timeout = httpx.Timeout(config["native_download_timeout"], pool=None)
+
+    async def async_delete_all_tasks(self):
+        """与gospeed接口保持一致, 进程内引擎没有残留任务"""
+        return
+
+    @staticmethod
+    def get_save_path(url: str, save_dir: str) -> str:
+        return os.path.join(
+            config["save_downloaded_data_dir"], save_dir, os.path.basename(url)
+        )
+
+    async def _stream_to_part(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        part_path: str,
+        slot: Union[dict, None] = None,
+    ) -> bool:
+        """把url写入part_path, 已有部分通过Range续传
+
+        Args:
+            slot (Union[dict, None], optional): HostLimiter.slot, 记录收到响应头的延迟. Defaults to None.
+
+        Returns:
+            bool: part_path 是否已经完整
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        start = time.perf_counter()
+        async with client.stream(
+            "GET", url, headers=headers, timeout=self.timeout
+        ) as response:
+            if slot is not None:
+                # 下载时间与文件大小有关, 只用响应头的延迟调整并发
+                slot["latency"] = time.perf_counter() - start
+            if response.status_code == 416:
+                # bytes */total, 已下载完整时直接使用, 否则删除后重新下载
+                total = response.headers.get("Content-Range", "").split("/")[-1]
+                if total.isdigit() and int(total) == offset:
+                    return True
+                os.remove(part_path)
+                return False
+            response.raise_for_status()
+            # 服务器不支持Range时返回200, 需要从头写入
+            mode = "ab" if response.status_code == 206 else "wb"
+            with open(part_path, mode) as fout:
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    await asyncio.to_thread(fout.write, chunk)
+                    Metrics.inc("binance_download_bytes_total", len(chunk))
+        return True
+
+    @Tracer.traced()
+    async def async_download_a_file(
+        self, client: httpx.AsyncClient, url: str, save_dir: str, backoff_factor=1
+    ) -> bool:
+        """下载单个文件
+
+        Args:
+            client (httpx.AsyncClient):
+            url (str): 下载链接
+            save_dir (str): 保存至(相对于save_downloaded_data_dir)
+            backoff_factor (int, optional): 第一次重试的最长等待时间(秒), 之后每次翻倍. Defaults to 1.
+
+        Returns:
+            bool: 是否下载成功
+        """
+        save_path = self.get_save_path(url, save_dir)
+        part_path = save_path + ".part"
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        start = time.perf_counter()
+        for attempt in range(self.retries):
+            if attempt:
+                Metrics.inc("binance_http_retries_total")
+            try:
+                async with HostLimiter.for_url(url).slot() as slot:
+                    done = await self._stream_to_part(client, url, part_path, slot)
+                if done:
+                    os.replace(part_path, save_path)
+                    logger.info(f"Download {url} done.")
+                    Metrics.observe(
+                        "binance_download_seconds", time.perf_counter() - start
+                    )
+                    return True
+            except Exception as e:
+                logger.warning(
+                    f"Attempt {attempt + 1} failed, url: {url}, exception: {e!r}"
+                )
+                if attempt < self.retries - 1:
+                    await asyncio.sleep(HostLimiter.backoff(attempt, backoff_factor, e))
+        logger.error(f"Download {url} failed.")
+        return False
+
+    async def _worker(
+        self,
+        client: httpx.AsyncClient,
+        queue: asyncio.Queue,
+        failed: list[dict],
+        pbar: tqdm,
+    ):
+        while True:
+            try:
+                task = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            key = task["save_dir"] + "/" + os.path.basename(task["url"])
+            Metrics.set("binance_download_queue_depth", queue.qsize())
+            self.in_flight += 1
+            Metrics.set("binance_download_in_flight", self.in_flight)
+            ok = await self.async_download_a_file(client, task["url"], task["save_dir"])
+            self.in_flight -= 1
+            Metrics.set("binance_download_in_flight", self.in_flight)
+            if ok:
+                Manifest.mark_downloaded([key])
+                Metrics.inc("binance_download_files_total", status="done")
+            else:
+                Manifest.mark_downloaded([key], state="failed")
+                Metrics.inc("binance_download_files_total", status="error")
+                failed.append(task)
+            pbar.update(1)
+
+    async def _download_tasks(self, tasks: list[dict], desc: str) -> list[dict]:
+        """并发下载, 返回失败的任务"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for task in tasks:
+            queue.put_nowait(task)
+        failed: list[dict] = []
+
+        session: Union[WebSession, None] = WebSession.current()
+        client = session.client if session else httpx.AsyncClient()
+        try:
+            with tqdm(total=len(tasks), desc=desc, unit="task") as pbar, Tracer.span(
+                "gather", what="download workers", tasks=len(tasks)
+            ):
+                await asyncio.gather(
+                    *[
+                        self._worker(client, queue, failed, pbar)
+                        for _ in range(min(self.max_download_tasks, len(tasks)))
+                    ]
+                )
+        finally:
+            if session is None:
+                await client.aclose()
+        return failed
+
+    async def download_all(self):
+        """下载所有任务, 失败的任务重试一轮"""
+        self.failed_tasks = await self._download_tasks(self.tasks, "Downloading")
+        if len(self.failed_tasks) == 0:
+            print("All tasks finished.")
+            logger.info("All tasks finished.")
+            return
+
+        self.failed_tasks = await self._download_tasks(self.failed_tasks, "Retrying")
+        if self.failed_tasks:
+            logger.error(f"{len(self.failed_tasks)} tasks failed after retry.")
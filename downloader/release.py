@@ -3,14 +3,31 @@ from joblib import Parallel, delayed
 from tqdm import tqdm
 import zipfile
 import os
-from typing import Union
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from typing import IO, Iterator, Union
 import polars as pl
+import pyarrow.parquet as pq
 
 
 # ==== Customized Modules ====
-from utils import ConfigLoader, TimeTools, CheckSum
-from .enums import BINANCE_SPOT_HEADERS, BINANCE_SPOT_TIME_COLUMNS  # noqa
-from utils import PathLocal
+from utils import (
+    ConfigLoader,
+    TimeTools,
+    CheckSum,
+    Manifest,
+    MemoryBudgetPool,
+    ParquetProfile,
+    Metrics,
+    Tracer,
+)
+from data_reader.catalog import Catalog
+from .enums import (  # noqa
+    BINANCE_SPOT_SCHEMAS,
+    BINANCE_SPOT_TIME_COLUMNS,
+    BINANCE_SPOT_ID_COLUMNS,
+)
 
 
 config = ConfigLoader().load_config()
@@ -18,63 +35,51 @@ config = ConfigLoader().load_config()
 
 class Release:
     @staticmethod
-    def unzip(zip_file: str, skip_existed=True) -> Union[None, str]:
-        """解压zip文件"""
-        try:
-            with zipfile.ZipFile(zip_file, "r") as zip_ref:
-                output_dir = os.path.dirname(zip_file)
-                output_dir = os.path.join(
-                    config["save_released_data_dir"],
-                    # 删掉前面的/
-                    output_dir.replace(config["save_downloaded_data_dir"] + "/", ""),
-                )
-                if (
-                    os.path.exists(
-                        os.path.join(
-                            output_dir,
-                            os.path.basename(zip_file).replace(".zip", ".csv"),
-                        )
-                    )
-                    and skip_existed
-                ):
-                    return None
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                zip_ref.extractall(output_dir)
-            return os.path.join(
-                output_dir, os.path.basename(zip_file).replace(".zip", ".csv")
-            )
-        except Exception as e:
-            print(zip_file)
-            print(e)
+    def get_release_path(zip_file: str) -> str:
+        """压缩包对应的parquet文件路径"""
+        return os.path.join(
+            config["save_released_data_dir"],
+            os.path.relpath(zip_file, config["save_downloaded_data_dir"]),
+        ).replace(".zip", ".parquet")
 
     @staticmethod
-    def save_parquet(csv_path: str, save_path: str):
-        """csv转为parquet
+    def get_file_type(path: str) -> tuple[str, str]:
+        """根据路径判断标的类型和数据类型
 
-        Args:
-            csv_path (str):
-            save_path (str):
+        Returns:
+            tuple[str, str]: eg: ("SPOT", "aggTrades"), k线返回 ("SPOT", "klines")
         """
-        headers: dict[str] = {}
         symbol_type: str = ""
         data_frequency: str = ""
-        if "spot" in csv_path:
+        if "spot" in path:
             symbol_type = "SPOT"
-            if "aggTrades" in csv_path:
+            if "aggTrades" in path:
                 data_frequency = "aggTrades"
-            if "trades" in csv_path:
+            if "trades" in path:
                 data_frequency = "trades"
-            if "klines" in csv_path:
-                # data_frequency = "klines"
-                return
+            if "klines" in path:
+                data_frequency = "klines"
         if not symbol_type or not data_frequency:
             raise ValueError(
                 f"Unknown symbol type: {symbol_type} or data frequency: {data_frequency}"
             )
+        return symbol_type, data_frequency
 
-        # 根据文件类型生成文件头和时间列
-        headers = eval(f"BINANCE_{symbol_type}_HEADERS.{data_frequency}.value")
+    @staticmethod
+    def get_schema(symbol_type: str, data_frequency: str) -> dict:
+        """csv的列名和类型, 价格和数量列的精度由 release_float_dtype 决定"""
+        schema: dict = eval(f"BINANCE_{symbol_type}_SCHEMAS.{data_frequency}.value")
+        float_dtype = getattr(pl, config["release_float_dtype"])
+        return {
+            col: float_dtype if dtype == pl.Float64 else dtype
+            for col, dtype in schema.items()
+        }
+
+    @staticmethod
+    def transform(
+        df: pl.DataFrame, symbol_type: str, data_frequency: str, symbol: str
+    ) -> pl.DataFrame:
+        """按schema读入的csv数据转换时间列, 加一列symbol"""
         to_dt = [
             pl.from_epoch(pl.col({dt_col}), time_unit=tu)
             for dt_col, tu in eval(
@@ -82,24 +87,203 @@ class Release:
             ).items()
         ]
 
-        df = pl.read_csv(csv_path, has_header=False)
-        df = df.rename(headers).with_columns(to_dt)
-        # 加一列symbol
-        df = df.with_columns(pl.lit(csv_path.split("/")[-2]).alias("symbol"))
+        df = df.with_columns(to_dt)
+        # 加一列symbol, 用Categorical只存一份字符串
+        df = df.with_columns(pl.lit(symbol, dtype=pl.Categorical).alias("symbol"))
         # 重新排列列的顺序
         column_order = ["symbol"] + [col for col in df.columns if col != "symbol"]
-        df = df.select(column_order)
+        return df.select(column_order)
 
-        df.write_parquet(save_path)
+    @staticmethod
+    def csv_batches(stream: IO[bytes], batch_bytes: int) -> Iterator[bytes]:
+        """从流中按行边界切分csv, 每块约batch_bytes字节"""
+        remainder = b""
+        while True:
+            data = stream.read(batch_bytes)
+            if not data:
+                break
+            data = remainder + data
+            cut = data.rfind(b"\n") + 1
+            remainder = data[cut:]
+            if cut:
+                yield data[:cut]
+        if remainder.strip():
+            yield remainder
 
     @staticmethod
-    def zip2parquet(zip_file: str, skip_existed=True):
-        csv_path: Union[str, None] = Release.unzip(zip_file, skip_existed)
-        if csv_path is None:
-            return
-        Release.save_parquet(csv_path, save_path=csv_path.replace(".csv", ".parquet"))
-        # 删除原始csv文件
-        os.remove(csv_path)
+    def save_parquet(zip_file: str, save_path: str) -> Union[dict, None]:
+        """zip中的csv直接转为parquet, 不解压到磁盘
+
+        小文件整体读入内存转换; 大文件按 release_batch_bytes 分块解析,
+        每块写成一个临时parquet, 再流式合并为一个文件, 各块首尾相接时内存占用与文件大小无关,
+        否则整体读入内存排序
+        csv按 BINANCE_SPOT_SCHEMAS 解析, 不做类型推断; 输出按时间排序, 使用 ParquetProfile 的存储参数
+        转换的同时按csv的顺序计算摘要(file_stats), 不需要再次读取
+
+        Args:
+            zip_file (str):
+            save_path (str):
+
+        Returns:
+            Union[dict, None]: {"rows": 行数, "bytes": csv字节数, "stats": 摘要}, 不需要转换时返回None
+        """
+        symbol_type, data_frequency = Release.get_file_type(zip_file)
+        if data_frequency == "klines":
+            return None
+        symbol: str = zip_file.split("/")[-2]
+        part_path = save_path + ".part"
+        schema = Release.get_schema(symbol_type, data_frequency)
+        id_col: str = eval(f"BINANCE_{symbol_type}_ID_COLUMNS.{data_frequency}.value")
+
+        with zipfile.ZipFile(zip_file, "r") as zip_ref:
+            member = zip_ref.infolist()[0]
+            if member.file_size <= config["release_inmemory_max_bytes"]:
+                df = pl.read_csv(zip_ref.read(member), has_header=False, schema=schema)
+                df = Release.transform(df, symbol_type, data_frequency, symbol)
+                stats = Release.file_stats(df, id_col)
+                if not df["timestamp"].is_sorted():
+                    df = df.sort("timestamp", maintain_order=True)
+                df.write_parquet(part_path, **ParquetProfile.options())
+                rows = df.height
+            else:
+                parts_dir = save_path + ".parts"
+                os.makedirs(parts_dir, exist_ok=True)
+                try:
+                    rows, stats = 0, None
+                    # 各块都有序且首尾相接时合并不需要排序
+                    ordered, last_ts = True, None
+                    # 各块的symbol共用一个字符串缓存, 合并时不需要重新编码
+                    with pl.StringCache(), zip_ref.open(member) as stream:
+                        for n, batch in enumerate(
+                            Release.csv_batches(stream, config["release_batch_bytes"])
+                        ):
+                            df = pl.read_csv(batch, has_header=False, schema=schema)
+                            rows += df.height
+                            df = Release.transform(
+                                df, symbol_type, data_frequency, symbol
+                            )
+                            stats = Release.merge_stats(
+                                stats, Release.file_stats(df, id_col)
+                            )
+                            if not df["timestamp"].is_sorted():
+                                df = df.sort("timestamp", maintain_order=True)
+                            if last_ts is not None and df["timestamp"][0] < last_ts:
+                                ordered = False
+                            last_ts = df["timestamp"][-1]
+                            df.write_parquet(
+                                os.path.join(parts_dir, f"{n:06d}.parquet")
+                            )
+                        lf = pl.scan_parquet(os.path.join(parts_dir, "*.parquet"))
+                        if ordered:
+                            lf.sink_parquet(part_path, **ParquetProfile.options())
+                        else:
+                            # 流式引擎不支持排序后写出, 整体读入内存排序
+                            df = lf.sort("timestamp", maintain_order=True).collect()
+                            df.write_parquet(part_path, **ParquetProfile.options())
+                finally:
+                    shutil.rmtree(parts_dir, ignore_errors=True)
+        os.replace(part_path, save_path)
+        return {"rows": rows, "bytes": member.file_size, "stats": stats}
+
+    @staticmethod
+    def file_stats(df: pl.DataFrame, id_col: str) -> dict:
+        """数据摘要, 编号按df的行顺序检查
+
+        Args:
+            df (pl.DataFrame): 按csv顺序的数据
+            id_col (str): 连续递增的编号列
+
+        Returns:
+            dict: {"min_ts", "max_ts"(毫秒), "rows", "first_id", "last_id", "gap_count", "gaps"}
+        """
+        if df.is_empty():
+            return {
+                "min_ts": None,
+                "max_ts": None,
+                "rows": 0,
+                "first_id": None,
+                "last_id": None,
+                "gap_count": 0,
+                "gaps": [],
+            }
+        ts = df["timestamp"].dt.epoch("ms")
+        gaps = df.select(
+            pl.col(id_col).shift(1).alias("prev"), pl.col(id_col).alias("next")
+        ).filter(pl.col("next") != pl.col("prev") + 1)
+        return {
+            "min_ts": ts.min(),
+            "max_ts": ts.max(),
+            "rows": df.height,
+            "first_id": df[id_col][0],
+            "last_id": df[id_col][-1],
+            "gap_count": gaps.height,
+            "gaps": [
+                list(g) for g in gaps.head(config["audit_max_gaps_per_file"]).rows()
+            ],
+        }
+
+    @staticmethod
+    def merge_stats(a: Union[dict, None], b: dict) -> dict:
+        """合并相邻两块的摘要, a在b之前"""
+        if a is None or a["rows"] == 0:
+            return b
+        if b["rows"] == 0:
+            return a
+        # 两块之间的不连续位置在两块各自的位置之间
+        boundary = []
+        if b["first_id"] != a["last_id"] + 1:
+            boundary = [[a["last_id"], b["first_id"]]]
+        gaps = a["gaps"] + boundary + b["gaps"]
+        gap_count = a["gap_count"] + len(boundary) + b["gap_count"]
+        return {
+            "min_ts": min(a["min_ts"], b["min_ts"]),
+            "max_ts": max(a["max_ts"], b["max_ts"]),
+            "rows": a["rows"] + b["rows"],
+            "first_id": a["first_id"],
+            "last_id": b["last_id"],
+            "gap_count": gap_count,
+            "gaps": gaps[: config["audit_max_gaps_per_file"]],
+        }
+
+    @staticmethod
+    def estimate_memory(zip_file: str) -> int:
+        """估计转换一个压缩包的内存占用(字节), 用于进程池准入"""
+        try:
+            with zipfile.ZipFile(zip_file, "r") as zip_ref:
+                size = zip_ref.infolist()[0].file_size
+        except Exception:
+            return 0
+        # 大文件分块转换, 内存只与块大小有关
+        if size > config["release_inmemory_max_bytes"]:
+            size = config["release_batch_bytes"]
+        return int(size * config["release_memory_factor"])
+
+    @staticmethod
+    @Tracer.traced()
+    def zip2parquet(zip_file: str, skip_existed=True) -> dict:
+        """压缩包转为parquet
+
+        Returns:
+            dict: {"status": "done" | "existed" | "skipped" | "failed", "rows", "bytes", "stats", "seconds", "cpu_seconds"}
+        """
+        save_path: str = Release.get_release_path(zip_file)
+        if os.path.exists(save_path) and skip_existed:
+            return {"status": "existed"}
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            stats = Release.save_parquet(zip_file, save_path)
+        except Exception as e:
+            logger.error(f"Release {zip_file} failed: {e}")
+            return {"status": "failed"}
+        if stats is None:
+            return {"status": "skipped"}
+        return {
+            "status": "done",
+            "seconds": time.perf_counter() - start,
+            "cpu_seconds": time.process_time() - cpu_start,
+            **stats,
+        }
 
     @staticmethod
     def release_binance_data(
@@ -120,25 +304,16 @@ class Release:
         """
         if isinstance(key_words, str):
             key_words = [key_words]
+        Metrics.start_run()
+        Tracer.start_run()
 
-        save_download_data_dir: str = config["save_downloaded_data_dir"]
-        # 遍历文件夹 找到所有压缩包
-        zip_file_paths: list = []
-        for root, _, files in os.walk(save_download_data_dir):
-            for file in files:
-                if file.endswith(".zip"):
-                    zip_file_paths.append(os.path.join(root, file))
-
-        # 删除下载重复的文件
-        # 假设不会有重复超过100次的文件
-        unnecessary_file_symbol: list = [f"({n})" for n in range(1, 100)]
-        need_delete_files = [
-            p for p in zip_file_paths if any(x in p for x in unnecessary_file_symbol)
-        ]
-        if need_delete_files:
-            for file in tqdm(need_delete_files, desc="Deleting duplicated files"):
-                os.remove(file)
-                logger.info(f"Delete duplicated file: {file}")
+        # 从清单中取已下载的压缩包, 跳过已发布的文件
+        Manifest.ensure_bootstrapped()
+        zip_keys: list[str] = Manifest.zip_keys(only_unreleased=skip_existed)
+        if skip_existed:
+            print(f"Found {len(zip_keys)} unreleased files.")
+            logger.info(f"Found {len(zip_keys)} unreleased files.")
+        zip_file_paths: list = [Manifest.local_path_from_key(k) for k in zip_keys]
 
         # 跳过不含key_words的文件
         if key_words:
@@ -146,73 +321,273 @@ class Release:
                 p for p in zip_file_paths if any(kw in p for kw in key_words)
             ]
 
-        # 跳过本地文件
-        if skip_existed:
-            local_file_paths: list = PathLocal.get_file_path_from_dir(
-                config["save_released_data_dir"]
-            )
-            # 只保留自动生成的文件夹
-            local_file_paths = [p for p in local_file_paths if "customized" not in p]
-            # 去除文件拓展名和统一路径
-            local_file_paths = [
-                PathLocal.remove_subpath(
-                    os.path.splitext(file)[0], config["save_released_data_dir"]
-                )
-                for file in local_file_paths
-            ]
-            zip_file_paths = [
-                PathLocal.remove_subpath(
-                    os.path.splitext(file)[0], config["save_downloaded_data_dir"]
-                )
-                for file in zip_file_paths
-            ]
-            _ = zip_file_paths
-            zip_file_paths = list(set(zip_file_paths) - set(local_file_paths))
-            print(f"Skip {len(_) - len(zip_file_paths)} existed files.")
-            logger.info(f"Skip {len(_) - len(zip_file_paths)} existed files.")
-            zip_file_paths = [
-                os.path.join(config["save_downloaded_data_dir"], p[1:]) + ".zip"
-                for p in zip_file_paths
-            ]
-
         # 日期区间过滤
         if start_date is not None or end_date is not None:
             zip_file_paths = TimeTools.time_filter(start_date, end_date, zip_file_paths)
 
+        # 清单中有记录但已被删除或移动的文件, 从清单中删除, 下次运行时重新下载
+        missing_paths: list[str] = [p for p in zip_file_paths if not os.path.exists(p)]
+        if missing_paths:
+            print(f"Skip {len(missing_paths)} missing files. Download them next time.")
+            logger.warning(
+                f"Skip {len(missing_paths)} missing files. Download them next time."
+            )
+            missing_keys = [Manifest.key_from_local_path(p) for p in missing_paths]
+            Manifest.remove(missing_keys + [k + ".CHECKSUM" for k in missing_keys])
+            zip_file_paths = list(set(zip_file_paths) - set(missing_paths))
+
         # 检查所有文件的校验和
         if not skip_checksum:
-            bool_list: list[bool] = Parallel(
-                n_jobs=config["parallel_n_jobs"], prefer="threads"
-            )(
-                delayed(CheckSum.verify_checksum)(p)
-                for p in tqdm(zip_file_paths, desc="Checking checksum")
+            with Metrics.stage("verify") as st:
+                bool_list: list[bool] = Parallel(
+                    n_jobs=config["parallel_n_jobs"], prefer="threads"
+                )(
+                    delayed(CheckSum.verify_checksum)(p)
+                    for p in tqdm(zip_file_paths, desc="Checking checksum")
+                )
+                skip_paths: list[str] = [
+                    p for p, b in zip(zip_file_paths, bool_list) if not b
+                ]
+                if len(skip_paths) != 0:
+                    print(f"Skip {len(skip_paths)} invalid files. Delete them.")
+                    logger.info(f"Skip {len(skip_paths)} invalid files. Delete them.")
+                    for file in skip_paths:
+                        os.remove(file)
+                        if os.path.exists(file + ".CHECKSUM"):
+                            os.remove(file + ".CHECKSUM")
+                    # 从清单中删除, 下次运行时重新下载
+                    skip_keys = [Manifest.key_from_local_path(p) for p in skip_paths]
+                    Manifest.remove(skip_keys + [k + ".CHECKSUM" for k in skip_keys])
+                    zip_file_paths = list(set(zip_file_paths) - set(skip_paths))
+                Manifest.set_checksums(
+                    {
+                        Manifest.key_from_local_path(p): CheckSum.read_checksum(p)
+                        for p in zip_file_paths
+                    }
+                )
+                st.add("files", len(zip_file_paths))
+
+        with Metrics.stage("release") as st:
+            # 进程池并行转换, 按估计内存准入, 大文件先开始
+            pool = MemoryBudgetPool(
+                config["release_n_workers"],
+                config["release_memory_budget_mb"] * 1024 * 1024,
             )
-            skip_paths: list[str] = [
-                p for p, b in zip(zip_file_paths, bool_list) if not b
+            jobs = [
+                (p, Release.estimate_memory(p))
+                for p in tqdm(zip_file_paths, desc="Estimating memory")
             ]
-            if len(skip_paths) != 0:
-                print(f"Skip {len(skip_paths)} invalid files. Delete them.")
-                logger.info(f"Skip {len(skip_paths)} invalid files. Delete them.")
-                for file in skip_paths:
-                    os.remove(file)
-                    if os.path.exists(file.replace(".zip", ".CHECKSUM")):
-                        os.remove(file.replace(".zip", ".CHECKSUM"))
-                zip_file_paths = list(set(zip_file_paths) - set(skip_paths))
-
-        # 并行解压
-        Parallel(n_jobs=config["parallel_n_jobs"], backend="threading")(
-            delayed(Release.zip2parquet)(zip_file, skip_existed)
-            for zip_file in tqdm(zip_file_paths, desc="Release and save parquet")
+            released: list[str] = []
+            catalog_records: list[dict] = []
+            stats: dict[str, dict] = {}
+            total_rows, total_bytes, start = 0, 0, time.perf_counter()
+            with tqdm(total=len(jobs), desc="Release and save parquet") as pbar:
+                for zip_file, result in pool.imap_unordered(
+                    Release.zip2parquet, jobs, skip_existed
+                ):
+                    pbar.update(1)
+                    if isinstance(result, Exception):
+                        logger.error(f"Release {zip_file} failed: {result}")
+                        Metrics.inc("binance_release_files_total", status="failed")
+                        continue
+                    Metrics.inc("binance_release_files_total", status=result["status"])
+                    if result["status"] in ["done", "existed"]:
+                        released.append(Manifest.key_from_local_path(zip_file))
+                    if result["status"] != "done":
+                        continue
+                    stats[Manifest.key_from_local_path(zip_file)] = result["stats"]
+                    catalog_records.append(
+                        Catalog.record(
+                            Release.get_release_path(zip_file), rows=result["rows"]
+                        )
+                    )
+                    logger.info(
+                        f"Released {zip_file}: {result['rows']} rows, "
+                        f"{result['bytes'] / 1024 / 1024 / result['seconds']:.1f} MB/s, "
+                        f"{result['rows'] / result['seconds']:.0f} rows/s"
+                    )
+                    total_rows += result["rows"]
+                    total_bytes += result["bytes"]
+                    st.add("files")
+                    st.add("rows", result["rows"])
+                    st.add("bytes", result["bytes"])
+                    st.add_cpu(result["cpu_seconds"])
+                    elapsed = time.perf_counter() - start
+                    pbar.set_postfix(
+                        MB_s=f"{total_bytes / 1024 / 1024 / elapsed:.1f}",
+                        rows_s=f"{total_rows / elapsed:.0f}",
+                    )
+            # 记录发布成功的文件
+            Manifest.mark_released(released)
+            Manifest.set_stats(stats)
+            Catalog.update(catalog_records)
+
+        if config["release_compact_daily"]:
+            with Metrics.stage("compact"):
+                Release.compact_daily(key_words)
+        Metrics.export("release")
+        Tracer.export("release")
+
+    @staticmethod
+    def compact_daily(key_words: Union[str, list, None] = None) -> None:
+        """已完整的月份的日度parquet按 (标的, 月) 合并为一个文件, 减少小文件数量
+
+        只合并发布的原始数据(aggTrades, trades等), 跳过转换输出的 customized-* 数据集
+
+        合并后的文件保存在原目录, 文件名中的日期为月份, eg: BTCUSDT-aggTrades-2024-01.parquet.
+        每天一个行组, 按日期过滤时只读取当天的行组.
+        已合并的月份又有新的日度文件(重新发布)时, 替换合并文件中对应的日期, 可以重复运行
+
+        每天都有日度文件, 或者月末已经过去 release_compact_grace_days 天(币安通常在下月1-2日发布月末的数据,
+        标的也可能在月中下架)时才合并该月, 之后该月新的日度文件直接合并. 合并在进程池中进行, 按估计内存准入
+
+        Args:
+            key_words (Union[str, list, None], optional): 只合并路径包含key_words的文件. Defaults to None.
+        """
+        if isinstance(key_words, str):
+            key_words = [key_words]
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        grace = timedelta(days=config["release_compact_grace_days"])
+        groups: dict[tuple, list[dict]] = {}
+        # 已有的合并文件, 用于估计内存
+        compacted: dict[tuple, dict] = {}
+        for (market, period, data_type, frequency), recs in Catalog.load().items():
+            # 只合并下载的原始数据, 转换得到的k线和bar(customized-*)由转换状态文件记录输入, 不合并
+            if period != "daily" or frequency.startswith("customized"):
+                continue
+            for rec in recs:
+                if key_words and not any(kw in rec["path"] for kw in key_words):
+                    continue
+                key = (market, data_type, frequency, rec["symbol"], rec["date"][:7])
+                if len(rec["date"]) == 10:
+                    groups.setdefault(key, []).append(rec)
+                else:
+                    compacted[key] = rec
+        for key in list(groups):
+            # 已有合并文件的月份之前已经满足条件, 新的日度文件直接合并
+            if key in compacted:
+                continue
+            start, end = TimeTools.parse_period(key[-1])
+            complete = len({r["date"] for r in groups[key]}) == (end - start).days
+            if not complete and end + grace > now:
+                del groups[key]
+        if not groups:
+            return
+        print(f"Compact {len(groups)} months of daily files.")
+        logger.info(f"Compact {len(groups)} months of daily files.")
+
+        pool = MemoryBudgetPool(
+            config["release_n_workers"],
+            config["release_memory_budget_mb"] * 1024 * 1024,
         )
-        # for p in zip_file_paths:
-        #     Release.zip2parquet(p, skip_existed)
-
-
-if __name__ == "__main__":
-    # Release.unzip(
-    #     "/home/zhrdai/projects/binance_downloader/BTCUSDT/BTCUSDT-aggTrades-2017-08.zip"
-    # )
-    # Release.unzip(
-    #     "/data/crypto_data/binance_data/data/spot/monthly/aggTrades/ATOMBTC/ATOMBTC-aggTrades-2020-09.zip"
-    # )
-    pass
+        jobs = [
+            (recs, Release.estimate_compact_memory(recs, compacted.get(key)))
+            for key, recs in groups.items()
+        ]
+        catalog_records: list[dict] = []
+        removed: list[str] = []
+        for recs, rec in tqdm(
+            pool.imap_unordered(Release.compact_month, jobs),
+            total=len(jobs),
+            desc="Compacting daily files",
+        ):
+            if isinstance(rec, Exception):
+                logger.error(f"Compact {recs[0]['path']} failed: {rec!r}")
+                continue
+            if rec is None:
+                continue
+            catalog_records.append(rec)
+            removed.extend(Catalog.abs_path(r) for r in recs)
+        # 先更新索引再删除日度文件, 中断后重新运行会再次合并剩下的日度文件
+        Catalog.remove(removed)
+        Catalog.update(catalog_records)
+        for path in removed:
+            os.remove(path)
+        logger.info(
+            f"Compacted {len(removed)} daily files into {len(catalog_records)} files."
+        )
+
+    @staticmethod
+    def estimate_compact_memory(recs: list[dict], compacted: Union[dict, None]) -> int:
+        """估计合并一个月的内存占用(字节), 用于进程池准入
+
+        按天读入写出, 内存约为一天的数据, 已有合并文件中的日期按平均每天行数估计
+
+        Args:
+            recs (list[dict]): 该月的日度文件索引记录
+            compacted (Union[dict, None]): 已有合并文件的索引记录
+
+        Returns:
+            int:
+        """
+        try:
+            n_columns = len(pl.read_parquet_schema(Catalog.abs_path(recs[0])))
+        except Exception:
+            return 0
+        rows = max(r["rows"] for r in recs)
+        if compacted is not None:
+            start, end = TimeTools.parse_period(compacted["date"])
+            rows = max(rows, compacted["rows"] // (end - start).days)
+        # 按每列8字节估计
+        return int(rows * n_columns * 8 * config["release_memory_factor"])
+
+    @staticmethod
+    def compact_month(recs: list[dict]) -> Union[dict, None]:
+        """一个标的一个月的日度文件合并为一个文件, 每天写为一个行组
+
+        按日期顺序逐天读入并追加一个行组, 不需要整月读入内存.
+        已有合并文件时, 其中没有被重新发布的日期从合并文件中读出, 与新的日度文件按日期排列
+
+        Args:
+            recs (list[dict]): 同一数据集同一标的同一月份的日度文件索引记录
+
+        Returns:
+            Union[dict, None]: 合并文件的索引记录, 失败时返回None
+        """
+        recs = sorted(recs, key=lambda r: r["date"])
+        month = recs[0]["date"][:7]
+        daily_path = Catalog.abs_path(recs[0])
+        save_path = (
+            daily_path[: -len(f"{recs[0]['date']}.parquet")] + f"{month}.parquet"
+        )
+        try:
+            # [(当天开始, 当天结束, 日度文件路径 | None(从合并文件读取))]
+            days = [
+                (*TimeTools.parse_period(r["date"]), Catalog.abs_path(r)) for r in recs
+            ]
+            if os.path.exists(save_path):
+                released = {start for start, _, _ in days}
+                kept = (
+                    pl.scan_parquet(save_path)
+                    .select(pl.col("timestamp").dt.truncate("1d").unique())
+                    .collect()["timestamp"]
+                )
+                days += [
+                    (start, start + timedelta(days=1), None)
+                    for start in kept
+                    if start not in released
+                ]
+                days.sort(key=lambda d: d[0])
+            schema = pl.read_parquet(daily_path, n_rows=0).to_arrow().schema
+            with pq.ParquetWriter(
+                save_path + ".part", schema, **ParquetProfile.arrow_options()
+            ) as writer:
+                for start, end, path in days:
+                    if path is None:
+                        df = (
+                            pl.scan_parquet(save_path)
+                            .filter(pl.col("timestamp").is_between(start, end, "left"))
+                            .collect()
+                        )
+                    else:
+                        df = pl.read_parquet(path)
+                    if df.is_empty():
+                        continue
+                    writer.write_table(
+                        df.to_arrow().cast(schema), row_group_size=df.height
+                    )
+            os.replace(save_path + ".part", save_path)
+            return Catalog.record(save_path)
+        except Exception as e:
+            logger.error(f"Compact {daily_path} {month} failed: {e!r}")
+            return None
@@ -0,0 +1,42 @@
+import zipfile
+
+import polars as pl
+import pytest
+
+from downloader.release import Release, config
+
+
+def write_zip(tmp_path, timestamps: list[int]) -> str:
+    """按给定时间戳生成一个aggTrades压缩包, 编号连续"""
+    symbol_dir = tmp_path / "spot" / "daily" / "aggTrades" / "BTCUSDT"
+    symbol_dir.mkdir(parents=True)
+    zip_file = symbol_dir / "BTCUSDT-aggTrades-2024-01-01.zip"
+    lines = [
+        f"{i},42000.5,0.01,{i},{i},{ts},True,True"
+        for i, ts in enumerate(timestamps, start=1)
+    ]
+    with zipfile.ZipFile(zip_file, "w") as zip_ref:
+        zip_ref.writestr("BTCUSDT-aggTrades-2024-01-01.csv", "\n".join(lines) + "\n")
+    return str(zip_file)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_save_parquet_batched(tmp_path, monkeypatch, reverse):
+    """大文件分块转换, 各块不首尾相接时输出仍按时间排序"""
+    monkeypatch.setitem(config, "release_inmemory_max_bytes", 1)
+    monkeypatch.setitem(config, "release_batch_bytes", 128)
+    timestamps = [1704067200000 + i * 1000 for i in range(50)]
+    if reverse:
+        timestamps = timestamps[::-1]
+    zip_file = write_zip(tmp_path, timestamps)
+    save_path = str(tmp_path / "out.parquet")
+
+    result = Release.save_parquet(zip_file, save_path)
+
+    df = pl.read_parquet(save_path)
+    assert result["rows"] == df.height == 50
+    assert df["timestamp"].is_sorted()
+    assert df["aggregate_trade_id"].to_list() == (
+        list(range(50, 0, -1)) if reverse else list(range(1, 51))
+    )
+    assert result["stats"]["gap_count"] == 0
@@ -7,8 +7,13 @@ from .config_loader import ConfigLoader
 from .path_tools import Local as PathLocal
 from .path_tools import Binance as PathBinance
 from .time_tools import TimeTools
-from .web_tools import WebGet
+from .metrics import Metrics
+from .tracing import Tracer
+from .web_tools import WebGet, WebSession, HostLimiter
 from .checksum import CheckSum
+from .manifest import Manifest
+from .parallel_tools import MemoryBudgetPool
+from .parquet_tools import ParquetProfile
 
 # ===========日志初始化=============
 # 移除所有默认的日志记录器
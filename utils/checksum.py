@@ -1,30 +1,159 @@
 import os
+import sqlite3
+import threading
+from typing import Union
 from loguru import logger
 import hashlib
 
+# ==== Customized Modules ====
+from .config_loader import ConfigLoader
+from .metrics import Metrics
+
+config = ConfigLoader.load_config()
+
+
+class ByteBudget:
+    """限制所有线程同时占用的内存字节数"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n: int) -> int:
+        """申请n字节, 超过上限时按上限申请
+
+        Returns:
+            int: 实际申请的字节数
+        """
+        n = min(n, self.limit)
+        with self.cond:
+            self.cond.wait_for(lambda: self.used + n <= self.limit)
+            self.used += n
+        return n
+
+    def release(self, n: int) -> None:
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
 
 class CheckSum:
+    # 所有校验线程共用的读缓冲区预算
+    budget = ByteBudget(config["checksum_memory_budget"])
+    # 每个线程一个sqlite连接
+    _local = threading.local()
+
+    @staticmethod
+    def _cache_conn() -> sqlite3.Connection:
+        conn = getattr(CheckSum._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(config["checksum_cache_path"]), exist_ok=True)
+            conn = sqlite3.connect(config["checksum_cache_path"], timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS verified ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)"
+            )
+            CheckSum._local.conn = conn
+        return conn
+
+    @staticmethod
+    def sha256(data_path: str) -> str:
+        """分块计算sha256, 每个文件只占用一个 checksum_chunk_size 大小的缓冲区
+
+        Args:
+            data_path (str):
+
+        Returns:
+            str: 十六进制摘要
+        """
+        digest = hashlib.sha256()
+        with open(data_path, "rb") as file_to_check:
+            n = CheckSum.budget.acquire(
+                min(config["checksum_chunk_size"], os.path.getsize(data_path)) or 1
+            )
+            try:
+                buffer = bytearray(n)
+                view = memoryview(buffer)
+                while size := file_to_check.readinto(buffer):
+                    digest.update(view[:size])
+            finally:
+                CheckSum.budget.release(n)
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_verified(data_path: str, stat: os.stat_result, checksum: str) -> bool:
+        """文件大小和修改时间都没有变化, 且上次校验的值与CHECKSUM一致"""
+        row = (
+            CheckSum._cache_conn()
+            .execute(
+                "SELECT size, mtime_ns, sha256 FROM verified WHERE path = ?",
+                (data_path,),
+            )
+            .fetchone()
+        )
+        return row is not None and row == (stat.st_size, stat.st_mtime_ns, checksum)
+
     @staticmethod
-    def verify_checksum(data_path: str) -> bool:
+    def set_verified(data_path: str, stat: os.stat_result, checksum: str) -> None:
+        with CheckSum._cache_conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?)",
+                (data_path, stat.st_size, stat.st_mtime_ns, checksum),
+            )
+
+    @staticmethod
+    def read_checksum(data_path: str) -> Union[str, None]:
+        """读取 data_path + ".CHECKSUM" 中的sha256
+
+        Returns:
+            Union[str, None]: 文件不存在或格式错误时返回None
+        """
         checksum_path = data_path + ".CHECKSUM"
         if not os.path.exists(checksum_path):
             logger.error(f"Checksum file not exists {data_path}")
-            return False
+            return None
 
         try:
             with open(checksum_path, "r") as fin:
                 text = fin.read()
             checksum_standard, _ = text.strip().split()
         except Exception:
-            logger.error("Error reading checksum file", checksum_path)
+            logger.error(f"Error reading checksum file {checksum_path}")
+            return None
+        return checksum_standard
+
+    @staticmethod
+    def verify_checksum(data_path: str, use_cache: bool = True) -> bool:
+        """校验文件的sha256
+
+        Args:
+            data_path (str): zip文件路径, 校验和文件为 data_path + ".CHECKSUM"
+            use_cache (bool, optional): 跳过大小和修改时间都没变化的已校验文件. Defaults to True.
+
+        Returns:
+            bool:
+        """
+        checksum_standard = CheckSum.read_checksum(data_path)
+        if checksum_standard is None:
+            Metrics.inc("binance_checksum_files_total", result="missing")
             return False
 
-        with open(data_path, "rb") as file_to_check:
-            data = file_to_check.read()
-            checksum_value = hashlib.sha256(data).hexdigest()
+        stat = os.stat(data_path)
+        if use_cache and CheckSum.is_verified(data_path, stat, checksum_standard):
+            Metrics.inc("binance_checksum_files_total", result="cached")
+            return True
+
+        with Metrics.timer("binance_checksum_seconds"):
+            checksum_value = CheckSum.sha256(data_path)
+        Metrics.inc("binance_checksum_bytes_total", stat.st_size)
 
         if checksum_value != checksum_standard:
             logger.error(f"Checksum error {data_path}")
+            Metrics.inc("binance_checksum_files_total", result="mismatch")
             return False
 
+        CheckSum.set_verified(data_path, stat, checksum_standard)
+        Metrics.inc("binance_checksum_files_total", result="ok")
         return True
@@ -5,6 +5,9 @@ import os
 # ==== Customized Modules ====
 from .paths import PROJECT_PATH
 
+# 设置该环境变量时读取指定的配置文件, 用于基准测试等需要隔离数据目录的场景
+CONFIG_ENV = "BINANCE_DOWNLOADER_CONFIG"
+
 
 class ConfigLoader:
     @staticmethod
@@ -12,5 +15,7 @@ class ConfigLoader:
         config_root_path: str = PROJECT_PATH, config_path: Union[str, None] = None
     ) -> dict:
         if not config_path:
-            config_path = os.path.join(config_root_path, "config.yaml")
+            config_path = os.environ.get(CONFIG_ENV) or os.path.join(
+                config_root_path, "config.yaml"
+            )
         return yaml.load(open(config_path, "r"), Loader=yaml.FullLoader)
@@ -0,0 +1,138 @@
+import os
+import re
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Union
+from loguru import logger
+
+# ==== Customized Modules ====
+from .config_loader import ConfigLoader
+
+config = ConfigLoader.load_config()
+
+# 缓存文件名, 与前缀目录结构一一对应
+CACHE_FILE_NAME = "_listing.json"
+
+
+class ListingCache:
+    """
+    币安S3列表的本地缓存
+
+    每个前缀保存一个json文件:
+        {"prefix": str, "fetched_at": float, "prefixes": list[str], "contents": list[dict]}
+    contents中每个元素为 {"Key", "Size", "ETag", "LastModified"}
+
+    失效策略:
+        1. force_refresh 或缓存不存在 -> 全量列举
+        2. 超过 listing_cache_ttl_days -> 全量列举
+        3. 未超过 listing_cache_refresh_hours -> 直接使用缓存
+        4. 只有子目录的前缀(如 data/spot/daily/aggTrades/) -> 全量列举(可能新增标的)
+        5. 最新文件早于 listing_cache_frozen_days (已下架标的) -> 直接使用缓存
+        6. 其余情况只从最近 listing_cache_mutable_days 天之前的最后一个key开始增量列举,
+           marker之后列举到的子目录合并到缓存中, 其他子目录的变化在全量列举时更新
+    """
+
+    @staticmethod
+    def _cache_file(path: str) -> str:
+        return os.path.join(config["listing_cache_dir"], path, CACHE_FILE_NAME)
+
+    @staticmethod
+    def load(path: str) -> Union[dict, None]:
+        """读取前缀的缓存
+
+        Args:
+            path (str): 前缀, eg: data/spot/daily/aggTrades/BTCUSDT/
+
+        Returns:
+            Union[dict, None]: 缓存不存在或损坏时返回None
+        """
+        cache_file = ListingCache._cache_file(path)
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file, "r") as fin:
+                return json.load(fin)
+        except Exception as e:
+            logger.warning(f"Broken listing cache {cache_file}: {e}")
+            return None
+
+    @staticmethod
+    def save(path: str, prefixes: list[str], contents: list[dict]) -> dict:
+        """保存前缀的缓存(先写临时文件再替换, 避免中断时损坏缓存)
+
+        Args:
+            path (str): 前缀
+            prefixes (list[str]): 子目录
+            contents (list[dict]): 文件信息
+
+        Returns:
+            dict: 写入的缓存
+        """
+        entry = {
+            "prefix": path,
+            "fetched_at": time.time(),
+            "prefixes": prefixes,
+            "contents": sorted(contents, key=lambda x: x["Key"]),
+        }
+        cache_file = ListingCache._cache_file(path)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as fout:
+            json.dump(entry, fout)
+        os.replace(tmp_file, cache_file)
+        return entry
+
+    @staticmethod
+    def key_date(key: str) -> Union[datetime, None]:
+        """从key中解析日期, 月度文件取当月1日"""
+        dates = re.findall(r"\d{4}-\d{2}(?:-\d{2})?", os.path.basename(key))
+        if not dates:
+            return None
+        date = dates[-1]
+        fmt = "%Y-%m-%d" if len(date) == 10 else "%Y-%m"
+        return datetime.strptime(date, fmt).replace(tzinfo=timezone.utc)
+
+    @staticmethod
+    def plan(entry: Union[dict, None], force_refresh: bool = False) -> dict:
+        """根据缓存决定本次的列举方式
+
+        Args:
+            entry (Union[dict, None]): 缓存
+            force_refresh (bool, optional): 强制全量列举. Defaults to False.
+
+        Returns:
+            dict: {"action": "hit" | "full" | "incremental", "marker": str, "keep": list[dict]}
+        """
+        if force_refresh or entry is None:
+            return {"action": "full"}
+
+        now = datetime.now(timezone.utc)
+        fetched_at = datetime.fromtimestamp(entry["fetched_at"], tz=timezone.utc)
+        age = now - fetched_at
+        if age > timedelta(days=config["listing_cache_ttl_days"]):
+            return {"action": "full"}
+        if age < timedelta(hours=config["listing_cache_refresh_hours"]):
+            return {"action": "hit"}
+
+        contents: list[dict] = entry["contents"]
+        if not contents:
+            return {"action": "full"}
+
+        dates = [ListingCache.key_date(c["Key"]) for c in contents]
+        known_dates = [d for d in dates if d is not None]
+        if known_dates and max(known_dates) < now - timedelta(
+            days=config["listing_cache_frozen_days"]
+        ):
+            return {"action": "hit"}
+
+        # 缓存时最近几天的文件可能被重新生成, 从它们之前的最后一个key开始重新列举
+        cutoff = fetched_at - timedelta(days=config["listing_cache_mutable_days"])
+        keep: list[dict] = []
+        for content, date in zip(contents, dates):
+            if date is not None and date >= cutoff:
+                break
+            keep.append(content)
+        if not keep:
+            return {"action": "full"}
+        return {"action": "incremental", "marker": keep[-1]["Key"], "keep": keep}
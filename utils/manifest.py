@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import sqlite3
+import argparse
+import threading
+import time
+from typing import Union
+from loguru import logger
+from tqdm import tqdm
+
+# ==== Customized Modules ====
+from .config_loader import ConfigLoader
+
+config = ConfigLoader.load_config()
+
+# sqlite单条语句的参数个数有上限, 分批查询
+QUERY_BATCH_SIZE = 900
+
+
+class Manifest:
+    """
+    本地副本状态清单(sqlite), 替代遍历文件夹的跳过逻辑
+
+    files 表:
+        key: 远程路径, eg: data/spot/monthly/aggTrades/BTCUSDT/BTCUSDT-aggTrades-2024-01.zip
+        size: 本地文件大小
+        checksum: 校验通过的sha256
+        download_state: "done" | "failed"
+        release_state: None | "done"
+        updated_at: 更新时间
+
+    stats 表(发布时计算, 用于 downloader.audit):
+        key: 同 files 表
+        min_ts, max_ts: 时间戳范围(毫秒)
+        rows: 行数
+        first_id, last_id: csv中第一行和最后一行的编号
+        gap_count: 编号不连续的次数
+        gaps: 前 audit_max_gaps_per_file 个不连续位置, json [[前一编号, 后一编号], ...]
+    """
+
+    _local = threading.local()
+
+    @staticmethod
+    def _conn() -> sqlite3.Connection:
+        conn = getattr(Manifest._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(config["manifest_path"]), exist_ok=True)
+            conn = sqlite3.connect(config["manifest_path"], timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "key TEXT PRIMARY KEY, size INTEGER, checksum TEXT, "
+                "download_state TEXT, release_state TEXT, updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_files_state "
+                "ON files(download_state, release_state)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats ("
+                "key TEXT PRIMARY KEY, min_ts INTEGER, max_ts INTEGER, rows INTEGER, "
+                "first_id INTEGER, last_id INTEGER, gap_count INTEGER, gaps TEXT)"
+            )
+            Manifest._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key_from_local_path(path: str) -> str:
+        """本地下载路径转为远程key"""
+        return os.path.relpath(path, config["save_downloaded_data_dir"]).replace(
+            os.sep, "/"
+        )
+
+    @staticmethod
+    def local_path_from_key(key: str) -> str:
+        return os.path.join(config["save_downloaded_data_dir"], key)
+
+    @staticmethod
+    def is_empty() -> bool:
+        return (
+            Manifest._conn().execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+        )
+
+    @staticmethod
+    def ensure_bootstrapped() -> None:
+        """清单为空时从磁盘重建, 兼容已有的本地副本"""
+        if Manifest.is_empty():
+            logger.info("Manifest is empty, rebuild it from disk.")
+            Manifest.rebuild_from_disk()
+
+    @staticmethod
+    def downloaded_keys(keys: list[str]) -> set[str]:
+        """返回keys中已经下载完成的部分"""
+        conn = Manifest._conn()
+        result: set[str] = set()
+        for i in range(0, len(keys), QUERY_BATCH_SIZE):
+            batch = keys[i : i + QUERY_BATCH_SIZE]
+            rows = conn.execute(
+                f"SELECT key FROM files WHERE download_state = 'done' "
+                f"AND key IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            result.update(r[0] for r in rows)
+        return result
+
+    @staticmethod
+    def mark_downloaded(keys: list[str], state: str = "done") -> None:
+        """记录下载结果, 同时清除发布状态(文件可能被重新下载)
+
+        Args:
+            keys (list[str]):
+            state (str, optional): "done" | "failed". Defaults to "done".
+        """
+        with Manifest._conn() as conn:
+            Manifest._upsert_downloaded(conn, keys, state)
+
+    @staticmethod
+    def _upsert_downloaded(
+        conn: sqlite3.Connection, keys: list[str], state: str
+    ) -> None:
+        now = time.time()
+        records = []
+        for key in keys:
+            path = Manifest.local_path_from_key(key)
+            size = os.path.getsize(path) if os.path.exists(path) else None
+            records.append((key, size, state, now))
+        conn.executemany(
+            "INSERT INTO files (key, size, download_state, updated_at) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+            "size = excluded.size, download_state = excluded.download_state, "
+            "checksum = NULL, release_state = NULL, updated_at = excluded.updated_at",
+            records,
+        )
+
+    @staticmethod
+    def resolve_duplicates(keys: list[str]) -> None:
+        """gospeed下载时目标文件已存在(上次失败或中断的残留), 会另存为 X(1).zip, X(2).zip, ...
+
+        用最新的一个替换 X.zip 并删除其余的, 在标记下载完成之前调用
+
+        Args:
+            keys (list[str]): 下载完成的key
+        """
+        for key in keys:
+            path = Manifest.local_path_from_key(key)
+            stem, ext = os.path.splitext(path)
+            duplicates: list[str] = []
+            # 假设不会有重复超过100次的文件
+            for n in range(1, 100):
+                found = [
+                    p
+                    for p in (f"{stem}({n}){ext}", f"{stem} ({n}){ext}")
+                    if os.path.exists(p)
+                ]
+                if not found:
+                    break
+                duplicates.extend(found)
+            if not duplicates:
+                continue
+            newest = max(duplicates, key=os.path.getmtime)
+            os.replace(newest, path)
+            for p in duplicates:
+                if p != newest:
+                    os.remove(p)
+            logger.info(f"Replace {path} with duplicated file {newest}")
+
+    @staticmethod
+    def remove(keys: list[str]) -> None:
+        with Manifest._conn() as conn:
+            conn.executemany("DELETE FROM files WHERE key = ?", [(k,) for k in keys])
+            conn.executemany("DELETE FROM stats WHERE key = ?", [(k,) for k in keys])
+
+    @staticmethod
+    def set_stats(stats: dict[str, dict]) -> None:
+        """记录发布文件的摘要
+
+        Args:
+            stats (dict[str, dict]): {key: Release.file_stats 的返回值}
+        """
+        with Manifest._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        k,
+                        v["min_ts"],
+                        v["max_ts"],
+                        v["rows"],
+                        v["first_id"],
+                        v["last_id"],
+                        v["gap_count"],
+                        json.dumps(v["gaps"]),
+                    )
+                    for k, v in stats.items()
+                ],
+            )
+
+    @staticmethod
+    def stats_rows() -> list[tuple]:
+        """stats 表的全部记录, 列顺序与建表语句一致"""
+        return Manifest._conn().execute("SELECT * FROM stats").fetchall()
+
+    @staticmethod
+    def set_checksums(checksums: dict[str, str]) -> None:
+        with Manifest._conn() as conn:
+            conn.executemany(
+                "UPDATE files SET checksum = ?, updated_at = ? WHERE key = ?",
+                [(v, time.time(), k) for k, v in checksums.items()],
+            )
+
+    @staticmethod
+    def mark_released(keys: list[str], state: Union[str, None] = "done") -> None:
+        with Manifest._conn() as conn:
+            conn.executemany(
+                "UPDATE files SET release_state = ?, updated_at = ? WHERE key = ?",
+                [(state, time.time(), k) for k in keys],
+            )
+
+    @staticmethod
+    def zip_keys(only_unreleased: bool = True) -> list[str]:
+        """已下载的zip文件
+
+        Args:
+            only_unreleased (bool, optional): 只返回未发布的文件. Defaults to True.
+
+        Returns:
+            list[str]:
+        """
+        sql = "SELECT key FROM files WHERE download_state = 'done' AND key LIKE '%.zip'"
+        if only_unreleased:
+            sql += " AND release_state IS NULL"
+        return [r[0] for r in Manifest._conn().execute(sql).fetchall()]
+
+    @staticmethod
+    def rebuild_from_disk() -> None:
+        """遍历下载和发布文件夹重建清单, 同时删除gospeed下载重复的文件"""
+        download_dir = config["save_downloaded_data_dir"]
+        released_dir = config["save_released_data_dir"]
+        # 假设不会有重复超过100次的文件
+        unnecessary_file_symbol: list = [f"({n})" for n in range(1, 100)]
+
+        keys: list[str] = []
+        for root, _, files in tqdm(
+            os.walk(os.path.join(download_dir, "data")), desc="Scanning downloaded"
+        ):
+            for file in files:
+                path = os.path.join(root, file)
+                if file.endswith(".part"):
+                    continue
+                if any(x in file for x in unnecessary_file_symbol):
+                    os.remove(path)
+                    logger.info(f"Delete duplicated file: {path}")
+                    continue
+                keys.append(Manifest.key_from_local_path(path))
+
+        released: list[str] = []
+        # 日度文件按月合并后(Release.compact_daily), 该月所有日度压缩包都已发布
+        compacted: list[str] = []
+        for root, _, files in tqdm(
+            os.walk(os.path.join(released_dir, "data")), desc="Scanning released"
+        ):
+            if "customized" in root:
+                continue
+            for file in files:
+                if not file.endswith(".parquet"):
+                    continue
+                path = os.path.join(root, file)
+                key = os.path.splitext(
+                    os.path.relpath(path, released_dir).replace(os.sep, "/")
+                )[0]
+                if "/daily/" in key and re.search(r"-\d{4}-\d{2}$", key):
+                    compacted.append(key + "-%.zip")
+                else:
+                    released.append(key + ".zip")
+
+        # 在一个事务中替换整个清单
+        with Manifest._conn() as conn:
+            conn.execute("DELETE FROM files")
+            Manifest._upsert_downloaded(conn, keys, "done")
+            conn.executemany(
+                "UPDATE files SET release_state = 'done' WHERE key = ?",
+                [(k,) for k in released],
+            )
+            conn.executemany(
+                "UPDATE files SET release_state = 'done' WHERE key LIKE ?",
+                [(k,) for k in compacted],
+            )
+        logger.info(
+            f"Manifest rebuilt: {len(keys)} downloaded, {len(released)} released files, "
+            f"{len(compacted)} compacted months."
+        )
+
+
+if __name__ == "__main__":
+    # python -m utils.manifest rebuild-from-disk
+    parser = argparse.ArgumentParser(description="Local mirror manifest")
+    parser.add_argument("command", choices=["rebuild-from-disk"])
+    args = parser.parse_args()
+    if args.command == "rebuild-from-disk":
+        Manifest.rebuild_from_disk()
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Union
+from loguru import logger
+
+# ==== Customized Modules ====
+from .config_loader import ConfigLoader
+
+config = ConfigLoader.load_config()
+
+# 耗时直方图的上界(秒)
+SECONDS_BUCKETS: tuple = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+METRIC_HELP: dict[str, str] = {
+    "binance_http_requests_total": "HTTP requests by outcome",
+    "binance_http_retries_total": "HTTP request retries",
+    "binance_http_request_seconds": "HTTP request latency",
+    "binance_http_response_bytes_total": "HTTP response body bytes",
+    "binance_download_files_total": "Downloaded files by status",
+    "binance_download_bytes_total": "Downloaded bytes",
+    "binance_download_seconds": "Time to download one file",
+    "binance_download_queue_depth": "Download tasks waiting for a slot",
+    "binance_download_in_flight": "Download tasks running",
+    "binance_checksum_files_total": "Checksum verifications by result",
+    "binance_checksum_bytes_total": "Bytes hashed by checksum verification",
+    "binance_checksum_seconds": "Time to hash one file",
+    "binance_release_files_total": "Released zip files by status",
+    "binance_kline_symbols_total": "Symbols converted to kline by status",
+    "binance_bar_symbols_total": "Symbols converted to bars by status",
+    "binance_stage_seconds_total": "Wall time spent in each stage",
+    "binance_stage_cpu_seconds_total": "CPU time spent in each stage, worker processes included",
+    "binance_stage_items_total": "Items processed by each stage",
+}
+
+
+class Stage:
+    """一个阶段的计时和处理量, 由 Metrics.stage 创建"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items: dict[str, float] = {}
+        # 进程池中的CPU时间由子进程返回, 不包含在本进程的 process_time 中
+        self.worker_cpu = 0.0
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def add(self, item: str, n: float = 1) -> None:
+        """累加处理量, eg: add("rows", 1000)"""
+        self.items[item] = self.items.get(item, 0) + n
+
+    def add_cpu(self, seconds: float) -> None:
+        self.worker_cpu += seconds
+
+
+class Metrics:
+    """
+    进程内的计数器, 仪表和直方图, 按 (名称, 标签) 区分
+
+    1. 导出为 Prometheus 文本格式: 写入 metrics_dir/binance.prom (node_exporter textfile),
+       metrics_port 不为0时同时在该端口提供 /metrics
+    2. 每次运行结束时把各阶段的耗时, CPU时间, 处理量和速率写入 metrics_dir 下的json,
+       同一进程中的多次运行由 Metrics.start_run 分开, Prometheus 中的计数器仍然累计
+
+    进程池子进程中的计数不会回到主进程, 需要统计的量由任务的返回值带回, 在主进程中累加
+    """
+
+    _lock = threading.Lock()
+    # {(name, labels): value}, labels为排序后的 ((k, v), ...)
+    _counters: dict[tuple, float] = {}
+    _gauges: dict[tuple, float] = {}
+    # {(name, labels): [各桶计数..., +Inf桶计数, sum]}
+    _histograms: dict[tuple, list] = {}
+    # {stage: {"seconds", "cpu_seconds", "items"}}
+    _stages: dict[str, dict] = {}
+    # 本次运行开始时的计数器和直方图, 运行摘要只包含之后的增量
+    _baseline: dict[str, dict] = {"counters": {}, "histograms": {}}
+    _server: Union[ThreadingHTTPServer, None] = None
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    @staticmethod
+    def inc(name: str, value: float = 1, **labels) -> None:
+        key = Metrics._key(name, labels)
+        with Metrics._lock:
+            Metrics._counters[key] = Metrics._counters.get(key, 0) + value
+
+    @staticmethod
+    def set(name: str, value: float, **labels) -> None:
+        with Metrics._lock:
+            Metrics._gauges[Metrics._key(name, labels)] = value
+
+    @staticmethod
+    def observe(name: str, value: float, **labels) -> None:
+        key = Metrics._key(name, labels)
+        with Metrics._lock:
+            hist = Metrics._histograms.get(key)
+            if hist is None:
+                hist = Metrics._histograms[key] = [0] * (len(SECONDS_BUCKETS) + 2)
+            hist[bisect_left(SECONDS_BUCKETS, value)] += 1
+            hist[-1] += value
+
+    @staticmethod
+    def value(name: str, **labels) -> float:
+        """计数器或仪表的当前值"""
+        key = Metrics._key(name, labels)
+        with Metrics._lock:
+            return Metrics._counters.get(key, Metrics._gauges.get(key, 0))
+
+    @staticmethod
+    @contextmanager
+    def timer(name: str, **labels) -> Iterator[None]:
+        """把代码块的耗时记录到直方图name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            Metrics.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str) -> Iterator[Stage]:
+        """记录一个阶段的耗时, CPU时间和处理量
+
+        CPU时间为本进程(所有线程)的 process_time 加上 Stage.add_cpu 累加的子进程CPU时间
+
+        eg:
+            with Metrics.stage("release") as st:
+                st.add("rows", n)
+        """
+        Metrics.serve()
+        st = Stage(name)
+        try:
+            yield st
+        finally:
+            seconds = time.perf_counter() - st.start
+            cpu = time.process_time() - st.cpu_start + st.worker_cpu
+            Metrics.inc("binance_stage_seconds_total", seconds, stage=name)
+            Metrics.inc("binance_stage_cpu_seconds_total", cpu, stage=name)
+            for item, n in st.items.items():
+                Metrics.inc("binance_stage_items_total", n, stage=name, item=item)
+            with Metrics._lock:
+                total = Metrics._stages.setdefault(
+                    name, {"seconds": 0.0, "cpu_seconds": 0.0, "items": {}}
+                )
+                total["seconds"] += seconds
+                total["cpu_seconds"] += cpu
+                for item, n in st.items.items():
+                    total["items"][item] = total["items"].get(item, 0) + n
+
+    @staticmethod
+    def start_run() -> None:
+        """开始一次运行: 清空阶段统计, 记录计数器和直方图的当前值, 之后的 summary 只包含本次运行的增量"""
+        with Metrics._lock:
+            Metrics._stages.clear()
+            Metrics._baseline = {
+                "counters": dict(Metrics._counters),
+                "histograms": {k: list(v) for k, v in Metrics._histograms.items()},
+            }
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+    @staticmethod
+    def prometheus_text() -> str:
+        """Prometheus 文本格式"""
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        def header(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with Metrics._lock:
+            for kind, metrics in [
+                ("counter", Metrics._counters),
+                ("gauge", Metrics._gauges),
+            ]:
+                for (name, labels), value in sorted(metrics.items()):
+                    header(name, kind)
+                    lines.append(f"{name}{Metrics._format_labels(labels)} {value!r}")
+            for (name, labels), hist in sorted(Metrics._histograms.items()):
+                header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(SECONDS_BUCKETS + ("+Inf",), hist[:-1]):
+                    cumulative += count
+                    le = Metrics._format_labels(labels, (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{Metrics._format_labels(labels)} {hist[-1]!r}")
+                lines.append(
+                    f"{name}_count{Metrics._format_labels(labels)} {cumulative}"
+                )
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def summary() -> dict:
+        """本次运行各阶段的耗时, CPU时间, 处理量和速率(每秒), 以及计数器和直方图的增量"""
+        with Metrics._lock:
+            base_counters = Metrics._baseline["counters"]
+            base_histograms = Metrics._baseline["histograms"]
+            stages = {
+                name: {
+                    **total,
+                    "rates": {
+                        f"{item}_per_s": n / total["seconds"]
+                        for item, n in total["items"].items()
+                        if total["seconds"]
+                    },
+                }
+                for name, total in Metrics._stages.items()
+            }
+            counters: dict[str, float] = {}
+            for (name, labels), value in sorted(Metrics._counters.items()):
+                delta = value - base_counters.get((name, labels), 0)
+                if delta:
+                    counters[name + Metrics._format_labels(labels)] = delta
+            histograms: dict[str, dict] = {}
+            for (name, labels), hist in sorted(Metrics._histograms.items()):
+                base = base_histograms.get((name, labels), [0] * len(hist))
+                count = sum(hist[:-1]) - sum(base[:-1])
+                if count:
+                    histograms[name + Metrics._format_labels(labels)] = {
+                        "count": count,
+                        "sum": hist[-1] - base[-1],
+                        "mean": (hist[-1] - base[-1]) / count,
+                    }
+        return {"stages": stages, "counters": counters, "histograms": histograms}
+
+    @staticmethod
+    def export(run: str) -> str:
+        """写入Prometheus文本文件和本次运行的json摘要
+
+        Args:
+            run (str): 运行名称, eg: "create_copy"
+
+        Returns:
+            str: json摘要的路径
+        """
+        metrics_dir = config["metrics_dir"]
+        os.makedirs(metrics_dir, exist_ok=True)
+        prom_path = os.path.join(metrics_dir, "binance.prom")
+        # 先写临时文件再替换, 采集时不会读到一半的文件
+        with open(prom_path + ".tmp", "w") as fout:
+            fout.write(Metrics.prometheus_text())
+        os.replace(prom_path + ".tmp", prom_path)
+
+        summary_path = os.path.join(
+            metrics_dir, f"{run}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        )
+        summary = {"run": run, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        summary.update(Metrics.summary())
+        with open(summary_path, "w") as fout:
+            json.dump(summary, fout, indent=2)
+        for name, stage in summary["stages"].items():
+            logger.info(
+                f"Stage {name}: {stage['seconds']:.1f}s, cpu {stage['cpu_seconds']:.1f}s, "
+                + ", ".join(f"{k} {v:.1f}" for k, v in stage["rates"].items())
+            )
+        return summary_path
+
+    @staticmethod
+    def serve() -> None:
+        """metrics_port 不为0时在后台线程提供 /metrics, 只启动一次, 监听地址为 metrics_host"""
+        if not config["metrics_port"] or Metrics._server is not None:
+            return
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = Metrics.prometheus_text().encode()
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            Metrics._server = ThreadingHTTPServer(
+                (config["metrics_host"], config["metrics_port"]), Handler
+            )
+        except OSError as e:
+            logger.warning(
+                f"Cannot serve metrics on port {config['metrics_port']}: {e}"
+            )
+            return
+        Metrics._server.daemon_threads = True
+        threading.Thread(target=Metrics._server.serve_forever, daemon=True).start()
+        logger.info(
+            f"Serving metrics on {config['metrics_host']}:{config['metrics_port']}."
+        )
+
+    @staticmethod
+    def reset() -> None:
+        with Metrics._lock:
+            Metrics._counters.clear()
+            Metrics._gauges.clear()
+            Metrics._histograms.clear()
+            Metrics._stages.clear()
+            Metrics._baseline = {"counters": {}, "histograms": {}}
@@ -0,0 +1,75 @@
+import os
+import multiprocessing
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Iterator
+
+
+def _init_worker(polars_threads: int) -> None:
+    # 在子进程导入polars之前限制线程数, 避免 进程数 x polars线程数 超过核数
+    os.environ["POLARS_MAX_THREADS"] = str(polars_threads)
+
+
+class MemoryBudgetPool:
+    """
+    按内存预算准入的进程池
+
+    1. 任务按估计内存从大到小调度, 大任务先开始可以缩短总耗时
+    2. 正在运行的任务估计内存之和不超过 memory_budget, 剩余预算用能放下的小任务填满
+    3. 单个任务超过预算时, 等其他任务结束后单独运行
+    """
+
+    def __init__(self, max_workers: int, memory_budget: int) -> None:
+        """
+        Args:
+            max_workers (int): 进程数, 0 表示使用全部核
+            memory_budget (int): 内存预算(字节)
+        """
+        self.max_workers = max_workers or os.cpu_count()
+        self.memory_budget = memory_budget
+        self.polars_threads = max(1, os.cpu_count() // self.max_workers)
+
+    def imap_unordered(
+        self, fn: Callable, items: list[tuple[Any, int]], *args
+    ) -> Iterator[tuple[Any, Any]]:
+        """并行执行 fn(item, *args)
+
+        Args:
+            fn (Callable): 可被pickle的函数
+            items (list[tuple[Any, int]]): [(item, 估计内存字节数), ...]
+
+        Yields:
+            Iterator[tuple[Any, Any]]: (item, 返回值), 任务抛出异常时返回值为该异常
+        """
+        pending = sorted(items, key=lambda x: x[1], reverse=True)
+        # 估计内存的相反数, 升序, 用于二分查找能放下的最大任务
+        neg_weights = [-weight for _, weight in pending]
+        running: dict[Future, tuple[Any, int]] = {}
+        used = 0
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.polars_threads,),
+        ) as executor:
+            while pending or running:
+                # 准入: 从大到小找能放进剩余预算的任务
+                while pending and len(running) < self.max_workers:
+                    index = bisect_left(neg_weights, used - self.memory_budget)
+                    if index == len(pending):
+                        if running:
+                            break
+                        index = 0
+                    item, weight = pending.pop(index)
+                    neg_weights.pop(index)
+                    running[executor.submit(fn, item, *args)] = (item, weight)
+                    used += weight
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, weight = running.pop(future)
+                    used -= weight
+                    try:
+                        yield item, future.result()
+                    except Exception as e:
+                        yield item, e
@@ -0,0 +1,33 @@
+# ==== Customized Modules ====
+from .config_loader import ConfigLoader
+
+config = ConfigLoader.load_config()
+
+
+class ParquetProfile:
+    """
+    parquet存储参数, 发布数据和转换后的k线数据共用
+
+    1. 压缩算法和级别: parquet_compression, parquet_compression_level
+    2. 行组大小: parquet_row_group_size, 行组越小按时间过滤时跳过的数据越多
+    3. 统计信息: parquet_statistics, 每个行组记录最大最小值, 用于谓词下推
+    """
+
+    @staticmethod
+    def options() -> dict:
+        """write_parquet 和 sink_parquet 的参数"""
+        return {
+            "compression": config["parquet_compression"],
+            "compression_level": config["parquet_compression_level"],
+            "row_group_size": config["parquet_row_group_size"],
+            "statistics": config["parquet_statistics"],
+        }
+
+    @staticmethod
+    def arrow_options() -> dict:
+        """pyarrow.parquet.ParquetWriter 的参数, 行组大小由写入方决定"""
+        return {
+            "compression": config["parquet_compression"],
+            "compression_level": config["parquet_compression_level"],
+            "write_statistics": config["parquet_statistics"],
+        }
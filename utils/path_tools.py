@@ -1,13 +1,26 @@
 import httpx
 import asyncio
 import os
+import re
 import xmltodict
+from datetime import datetime, timezone
 from typing import Union
+from urllib.parse import quote
 from loguru import logger
 
 # ==== Customized Modules ====
-from downloader.enums import BINANCE_DATA_URLS, BINANCE_DATA_PATH
+from downloader.enums import BINANCE_DATA_PATH
+from .config_loader import ConfigLoader
 from .web_tools import WebGet
+from .listing_cache import ListingCache
+from .tracing import Tracer
+
+config = ConfigLoader.load_config()
+
+# 子目录列表按标的首字符分片, 之后的字符(小写等)落在最后一片
+SHARD_LEADING_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# 文件名中的日期, eg: BTCUSDT-aggTrades-2024-01-01.zip, BTCUSDT-1m-2024-01.zip.CHECKSUM
+DATE_KEY_PATTERN = re.compile(r"(\d{4})-\d{2}(?:-\d{2})?\.zip")
 
 
 class Binance:
@@ -16,33 +29,208 @@ class Binance:
     """
 
     @staticmethod
-    async def async_get_path_from_website(path: str) -> list[str]:
+    def _listing_url(path: str, marker: Union[str, None] = None) -> str:
+        base_url = config["binance_listing_url"] + path
+        return base_url if marker is None else base_url + "&marker=" + quote(marker)
+
+    @staticmethod
+    async def _async_list_objects(
+        path: str, marker: Union[str, None] = None, upper: Union[str, None] = None
+    ) -> tuple[list[str], list[dict]]:
+        """按marker分页列举前缀下的子目录和文件
+
+        Args:
+            path (str): 基础路径
+            marker (Union[str, None], optional): 从该key之后开始列举. Defaults to None.
+            upper (Union[str, None], optional): 只列举不大于该key的部分, 超过后停止翻页. Defaults to None.
+
+        Returns:
+            tuple[list[str], list[dict]]: 子目录列表, 文件信息列表
+        """
+        prefixes: list[str] = []
+        contents: list[dict] = []
+        while True:
+            page_prefixes, page_contents, next_marker = Binance.parse_listing(
+                await WebGet.async_fetch_with_retry(
+                    url=Binance._listing_url(path, marker)
+                )
+            )
+            if upper is not None:
+                page_prefixes = [x for x in page_prefixes if x <= upper]
+                page_contents = [x for x in page_contents if x["Key"] <= upper]
+            prefixes.extend(page_prefixes)
+            contents.extend(page_contents)
+            if next_marker is None or (upper is not None and next_marker >= upper):
+                break
+            marker = next_marker
+        return prefixes, contents
+
+    @staticmethod
+    def shard_markers(
+        path: str, prefixes: list[str], contents: list[dict]
+    ) -> list[str]:
+        """根据第一页的内容, 把剩余的key划分为若干区间, 返回各区间的起始marker
+
+        1. 子目录列表(eg: data/spot/daily/trades/) 按标的首字符划分: path + "0", ..., path + "Z"
+        2. 带日期的文件列表(eg: 一个标的多年的日度文件) 按年份划分: "BTCUSDT-trades-2021", ...
+        3. 其他情况或 listing_sharding 为false时不划分
+
+        Args:
+            path (str): 基础路径
+            prefixes (list[str]): 第一页的子目录
+            contents (list[dict]): 第一页的文件信息
+
+        Returns:
+            list[str]: 升序的marker, 可能包含第一页已经列举过的部分, 由调用方过滤
+        """
+        if not config["listing_sharding"]:
+            return []
+        if prefixes:
+            return [path + c for c in SHARD_LEADING_CHARS]
+        if not contents:
+            return []
+        key = contents[-1]["Key"]
+        match = DATE_KEY_PATTERN.search(key)
+        if match is None:
+            return []
+        stem = key[: match.start(1)]
+        return [
+            stem + str(year)
+            for year in range(
+                int(match.group(1)) + 1, datetime.now(timezone.utc).year + 1
+            )
+        ]
+
+    @staticmethod
+    async def _async_list_sharded(
+        path: str, marker: Union[str, None] = None
+    ) -> tuple[list[str], list[dict]]:
+        """分片并发列举前缀
+
+        先顺序请求第一页, 没有下一页时直接返回; 否则按 Binance.shard_markers 把剩余部分划分为
+        (marker_i, marker_i+1] 的区间并发列举, 结果按区间顺序拼接, 与顺序列举完全一致.
+        翻页次数从 O(页数) 变为 O(页数 / 分片数), 并发数由 HostLimiter 控制
+
+        Args:
+            path (str): 基础路径
+            marker (Union[str, None], optional): 从该key之后开始列举. Defaults to None.
+
+        Returns:
+            tuple[list[str], list[dict]]: 子目录列表, 文件信息列表
+        """
+        prefixes, contents, next_marker = Binance.parse_listing(
+            await WebGet.async_fetch_with_retry(url=Binance._listing_url(path, marker))
+        )
+        if next_marker is None:
+            return prefixes, contents
+        seeds = [next_marker] + [
+            x
+            for x in Binance.shard_markers(path, prefixes, contents)
+            if x > next_marker
+        ]
+        if len(seeds) > 1:
+            logger.debug(f"Listing {path} in {len(seeds)} shards")
+        with Tracer.span("gather", shards=len(seeds)):
+            shards = await asyncio.gather(
+                *[
+                    Binance._async_list_objects(path, lower, upper)
+                    for lower, upper in zip(seeds, seeds[1:] + [None])
+                ]
+            )
+        for shard_prefixes, shard_contents in shards:
+            prefixes.extend(shard_prefixes)
+            contents.extend(shard_contents)
+        return prefixes, contents
+
+    @staticmethod
+    def parse_listing(text: str) -> tuple[list[str], list[dict], Union[str, None]]:
+        """解析一页S3 ListBucketResult
+
+        Args:
+            text (str): xml文本
+
+        Returns:
+            tuple[list[str], list[dict], Union[str, None]]: 子目录列表, 文件信息列表, 下一页的marker(最后一页为None)
+        """
+        xml_data = xmltodict.parse(
+            text,
+            # 只有一个元素时xmltodict不会返回list
+            force_list=("CommonPrefixes", "Contents"),
+        )["ListBucketResult"]
+        prefixes = [x["Prefix"] for x in xml_data.get("CommonPrefixes", [])]
+        contents = [
+            {
+                "Key": x["Key"],
+                "Size": int(x["Size"]),
+                "ETag": x["ETag"].strip('"'),
+                "LastModified": x["LastModified"],
+            }
+            for x in xml_data.get("Contents", [])
+        ]
+        if xml_data["IsTruncated"] == "false":
+            return prefixes, contents, None
+        return prefixes, contents, xml_data["NextMarker"]
+
+    @staticmethod
+    async def async_get_listing_from_website(
+        path: str, force_refresh: bool = False
+    ) -> dict:
+        """从币安数据网站获取前缀的列表, 优先使用本地缓存
+
+        Args:
+            path (str): 基础路径, eg: data/spot/daily/aggTrades/BTCUSDT/
+            force_refresh (bool, optional): 忽略缓存重新列举. Defaults to False.
+
+        Returns:
+            dict: {"prefixes": list[str], "contents": list[dict]}
+        """
+        entry = ListingCache.load(path)
+        plan = ListingCache.plan(entry, force_refresh)
+        if plan["action"] == "hit":
+            logger.debug(f"Listing cache hit: {path}")
+            return entry
+        if plan["action"] == "incremental":
+            prefixes, contents = await Binance._async_list_sharded(
+                path, marker=plan["marker"]
+            )
+            logger.debug(
+                f"Listing cache refresh: {path} keep {len(plan['keep'])}, new {len(contents)}"
+            )
+            # marker之后列举到的子目录与缓存合并, marker之前新增或删除的子目录在全量列举时更新
+            return ListingCache.save(
+                path,
+                sorted(set(entry["prefixes"]) | set(prefixes)),
+                plan["keep"] + contents,
+            )
+
+        prefixes, contents = await Binance._async_list_sharded(path)
+        return ListingCache.save(path, prefixes, contents)
+
+    @staticmethod
+    @Tracer.traced()
+    async def async_get_path_from_website(
+        path: str, force_refresh: bool = False
+    ) -> list[str]:
         """从币安数据网站获取文件路径
 
         Args:
             path (str): 基础路径, eg: data/option/daily/BVOLIndex/BTCBVOLUSDT/
+            force_refresh (bool, optional): 忽略缓存重新列举. Defaults to False.
 
         Returns:
             list[str]: 路径列表
         """
-        url = BINANCE_DATA_URLS.path_api_url.value + path
-        base_url = url
-        results = []
-        while True:
-            data = xmltodict.parse(await WebGet.async_fetch_with_retry(url=url))
-            xml_data = data["ListBucketResult"]
-            if "CommonPrefixes" in xml_data:
-                results.extend([x["Prefix"] for x in xml_data["CommonPrefixes"]])
-            elif "Contents" in xml_data:
-                results.extend([x["Key"] for x in xml_data["Contents"]])
-            if xml_data["IsTruncated"] == "false":
-                break
-            url = base_url + "&marker=" + xml_data["NextMarker"]
-        return results
+        listing = await Binance.async_get_listing_from_website(path, force_refresh)
+        if listing["prefixes"]:
+            return list(listing["prefixes"])
+        return [x["Key"] for x in listing["contents"]]
 
     @staticmethod
     async def async_get_data_frequency(
-        symbol_type: str, agg_period: str, data_type: Union[str, list, None]
+        symbol_type: str,
+        agg_period: str,
+        data_type: Union[str, list, None],
+        force_refresh: bool = False,
     ) -> list:
         path_map = {
             "spot_daily": BINANCE_DATA_PATH.spot.value + "daily/",
@@ -74,7 +262,7 @@ class Binance:
                 url = [u + dt + "/" for u in url for dt in data_type]
             return url
 
-        return await Binance.async_get_path_from_website(url)
+        return await Binance.async_get_path_from_website(url, force_refresh)
 
     @staticmethod
     def get_data_frequency(
@@ -1,5 +1,5 @@
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Union
 
 class TimeTools:
@@ -74,3 +74,33 @@ class TimeTools:
             ]
         else:
             return path_list
+
+    @staticmethod
+    def parse_period(date_string: str) -> tuple[datetime, datetime]:
+        """日期字符串对应的左闭右开时间段, "2024-01" 为整月, "2024-01-01" 为整天"""
+        if TimeTools.find_date_format(date_string) == "ymd":
+            start = datetime.strptime(
+                re.findall(r"\d{4}-\d{2}-\d{2}", date_string)[0], "%Y-%m-%d"
+            )
+            return start, start + timedelta(days=1)
+        start = datetime.strptime(re.findall(r"\d{4}-\d{2}", date_string)[0], "%Y-%m")
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+
+    @staticmethod
+    def date_range(
+        start_date: Union[str, None], end_date: Union[str, None]
+    ) -> tuple[datetime, datetime]:
+        """日期区间转为左闭右开的时间区间, end_date包含其精度内的整段时间
+
+        Args:
+            start_date (Union[str, None]): "2024-01" 或 "2024-01-01", None表示不限
+            end_date (Union[str, None]): 同上
+
+        Returns:
+            tuple[datetime, datetime]:
+        """
+        start = TimeTools.parse_period(start_date)[0] if start_date else datetime.min
+        end = TimeTools.parse_period(end_date)[1] if end_date else datetime.max
+        return start, end
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import asyncio
+import cProfile
+import functools
+import inspect
+import itertools
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterator, Union
+from loguru import logger
+
+# ==== Customized Modules ====
+from .config_loader import ConfigLoader
+
+config = ConfigLoader.load_config()
+
+# 设置为1时打开追踪, 与配置 trace_enabled 任一为真即可
+TRACE_ENV = "BINANCE_DOWNLOADER_TRACE"
+# 同一次运行的所有进程写入同一目录, 由主进程设置(导入时和 Tracer.start_run), spawn的子进程继承
+TRACE_RUN_ENV = "BINANCE_DOWNLOADER_TRACE_RUN"
+# 缓存的事件数超过该值时写入文件
+FLUSH_EVENTS = 10000
+
+_DISABLED = nullcontext()
+
+
+class Tracer:
+    """
+    函数级的span, 导出为 Chrome / Perfetto 可以打开的 trace json
+
+    1. 关闭时(默认) Tracer.traced 直接返回原函数, Tracer.span 返回空的上下文, 几乎没有开销
+    2. 线程中的span为完整事件(ph=X), 按线程显示; 协程中的span为异步事件(ph=b/e),
+       每个协程一条轨道, 可以看到列举协程, Gospeed轮询和发布线程是否重叠
+    3. 每个进程把事件追加到 trace_dir/{run}/{pid}.jsonl, 进程池子进程的span也会保留,
+       Tracer.export 合并为 trace_dir/{name}-{run}.json. 同一进程中的多次运行由 Tracer.start_run 分开
+    4. trace_profile_spans 中的span保存cProfile结果(.prof), trace_tracemalloc_spans 中的span
+       保存tracemalloc快照(.snapshot), 并在span参数中记录内存峰值.
+       span名称默认为函数的 __qualname__, eg: "Release.zip2parquet"
+    """
+
+    enabled: bool = bool(config["trace_enabled"]) or os.environ.get(TRACE_ENV) == "1"
+    _lock = threading.Lock()
+    _events: list[dict] = []
+    _ids = itertools.count(1)
+    _runs = itertools.count(1)
+    _pid = os.getpid()
+    # perf_counter 的精度加上 time_ns 的起点, 不同进程的时间戳可以比较
+    _offset_ns = time.time_ns() - time.perf_counter_ns()
+    # 同步span的嵌套深度, 进程池子进程在最外层span结束时写入文件
+    _local = threading.local()
+
+    @staticmethod
+    def _new_run() -> None:
+        """新的运行编号 "{时间}-{序号}-{pid}", 同一秒内的多次运行也不会重名"""
+        os.environ[TRACE_RUN_ENV] = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{next(Tracer._runs)}-{os.getpid()}"
+        )
+
+    @staticmethod
+    def run_dir() -> str:
+        if not os.environ.get(TRACE_RUN_ENV):
+            Tracer._new_run()
+        return os.path.join(config["trace_dir"], os.environ[TRACE_RUN_ENV])
+
+    @staticmethod
+    def start_run() -> None:
+        """开始一次运行, 之后的事件写入新的运行目录, Tracer.export 只合并本次运行的事件
+
+        进程池在运行中创建, 子进程通过环境变量继承新的运行目录
+        """
+        if not Tracer.enabled:
+            return
+        # 之前的事件留在上一次运行的目录
+        Tracer.flush()
+        Tracer._new_run()
+
+    @staticmethod
+    def main_pid() -> int:
+        """创建运行目录的进程"""
+        return int(os.environ[TRACE_RUN_ENV].rsplit("-", 1)[1])
+
+    @staticmethod
+    def _now_us() -> float:
+        """与其他进程可比的时间戳(微秒)"""
+        return (time.perf_counter_ns() + Tracer._offset_ns) / 1000
+
+    @staticmethod
+    def _emit(event: dict) -> None:
+        with Tracer._lock:
+            Tracer._events.append(event)
+            if len(Tracer._events) < FLUSH_EVENTS:
+                return
+        Tracer.flush()
+
+    @staticmethod
+    def flush() -> None:
+        """缓存的事件追加到本进程的jsonl文件"""
+        with Tracer._lock:
+            events, Tracer._events = Tracer._events, []
+        if not events:
+            return
+        run_dir = Tracer.run_dir()
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, f"{os.getpid()}.jsonl"), "a") as fout:
+            fout.write("".join(json.dumps(e, default=str) + "\n" for e in events))
+
+    @staticmethod
+    def _current_task() -> Union[asyncio.Task, None]:
+        try:
+            return asyncio.current_task()
+        except RuntimeError:
+            return None
+
+    @staticmethod
+    def _profile(name: str) -> tuple:
+        """按配置开始cProfile和tracemalloc, 返回 (profiler, 是否启动了tracemalloc)"""
+        profiler = None
+        if name in config["trace_profile_spans"]:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # 同一线程已有其他profiler
+                profiler = None
+        started_malloc = False
+        if name in config["trace_tracemalloc_spans"]:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_malloc = True
+            tracemalloc.reset_peak()
+        return profiler, started_malloc
+
+    @staticmethod
+    def _save_profile(name: str, span_id: int, profiler, started_malloc: bool) -> dict:
+        args: dict = {}
+        run_dir = Tracer.run_dir()
+        prefix = os.path.join(run_dir, f"{name}-{os.getpid()}-{span_id}")
+        if profiler is not None or name in config["trace_tracemalloc_spans"]:
+            os.makedirs(run_dir, exist_ok=True)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(prefix + ".prof")
+            args["profile"] = prefix + ".prof"
+        if name in config["trace_tracemalloc_spans"] and tracemalloc.is_tracing():
+            args["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.take_snapshot().dump(prefix + ".snapshot")
+            args["snapshot"] = prefix + ".snapshot"
+            if started_malloc:
+                tracemalloc.stop()
+        return args
+
+    @staticmethod
+    @contextmanager
+    def _span(name: str, args: dict) -> Iterator[None]:
+        span_id = next(Tracer._ids)
+        task = Tracer._current_task()
+        profiler, started_malloc = Tracer._profile(name)
+        start = Tracer._now_us()
+        base = {"name": name, "pid": Tracer._pid, "tid": threading.get_ident()}
+        if task is not None:
+            # 协程: 异步事件, 同一协程的span在同一条轨道上
+            track = {"cat": "async", "id": id(task)}
+            Tracer._emit({**base, **track, "ph": "b", "ts": start, "args": dict(args)})
+        else:
+            depth = getattr(Tracer._local, "depth", 0)
+            Tracer._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            end = Tracer._now_us()
+            args.update(Tracer._save_profile(name, span_id, profiler, started_malloc))
+            if task is not None:
+                Tracer._emit({**base, **track, "ph": "e", "ts": end, "args": args})
+            else:
+                Tracer._local.depth = depth
+                Tracer._emit(
+                    {
+                        **base,
+                        "cat": "sync",
+                        "ph": "X",
+                        "ts": start,
+                        "dur": end - start,
+                        "args": args,
+                    }
+                )
+                # 子进程退出时不会运行atexit, 每个最外层span结束后写入
+                if depth == 0 and Tracer._pid != Tracer.main_pid():
+                    Tracer.flush()
+
+    @staticmethod
+    def span(name: str, **args):
+        """
+        eg:
+            with Tracer.span("gather", tasks=len(tasks)):
+                await asyncio.gather(*tasks)
+        """
+        if not Tracer.enabled:
+            return _DISABLED
+        return Tracer._span(name, args)
+
+    @staticmethod
+    def traced(name: Union[str, None] = None) -> Callable:
+        """函数装饰器, 支持同步函数和协程函数, 关闭时返回原函数
+
+        放在 @staticmethod 下面:
+            @staticmethod
+            @Tracer.traced()
+            def zip2parquet(...)
+        """
+
+        def decorator(fn: Callable) -> Callable:
+            if not Tracer.enabled:
+                return fn
+            span_name = name or fn.__qualname__
+
+            if inspect.iscoroutinefunction(fn):
+
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with Tracer._span(span_name, {}):
+                        return await fn(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with Tracer._span(span_name, {}):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    def export(name: str) -> Union[str, None]:
+        """合并本次运行所有进程的事件, 写入Chrome trace json
+
+        Args:
+            name (str): 文件名前缀, eg: "create_copy"
+
+        Returns:
+            Union[str, None]: trace文件路径, 未打开追踪时返回None
+        """
+        if not Tracer.enabled:
+            return None
+        Tracer.flush()
+        run_dir = Tracer.run_dir()
+        events: list[dict] = []
+        if os.path.isdir(run_dir):
+            for file in sorted(os.listdir(run_dir)):
+                if not file.endswith(".jsonl"):
+                    continue
+                pid = int(file.split(".")[0])
+                events.append(
+                    {
+                        "name": "process_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "args": {
+                            "name": "main" if pid == Tracer.main_pid() else "worker"
+                        },
+                    }
+                )
+                with open(os.path.join(run_dir, file), "r") as fin:
+                    events.extend(json.loads(line) for line in fin if line.strip())
+        path = os.path.join(
+            config["trace_dir"], f"{name}-{os.environ[TRACE_RUN_ENV]}.json"
+        )
+        with open(path, "w") as fout:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fout)
+        logger.info(f"Trace of {len(events)} events saved to {path}")
+        return path
+
+
+if Tracer.enabled:
+    # 在创建进程池之前确定运行目录, 子进程通过环境变量继承
+    Tracer.run_dir()
@@ -1,14 +1,238 @@
+import time
+import random
 import httpx
 import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from loguru import logger
-from typing import Union
+from typing import AsyncIterator, Union
 
 # ==== Customized Modules ====
 from .config_loader import ConfigLoader
+from .metrics import Metrics
 
 config = ConfigLoader.load_config()
 
-semaphore = asyncio.Semaphore(int(config["max_semaphore"]))
+# 表示服务端限流或过载的状态码, 收到时减小并发
+THROTTLE_STATUS = {429, 503}
+
+
+class HostLimiter:
+    """
+    单个主机的AIMD并发控制, 替代固定大小的信号量
+
+    1. 成功且延迟不超过 http_latency_target 时加性增加: 每个请求 limit += 1 / limit,
+       即每一轮(limit个请求)并发加1, 最多 http_concurrency_max
+    2. 限流(429/503)或超时时乘性减小: limit *= http_concurrency_decrease, 最少 http_concurrency_min.
+       同一时刻在途的请求会一起失败, 距上次减小不到一个平均延迟时不再减小
+    3. Retry-After: 该主机在给定时间内不发出新请求
+    4. 其他错误(404, 连接重置等)不改变并发
+
+    不使用asyncio.Semaphore, 等待的future在获取时创建, 不绑定到某个事件循环
+    """
+
+    _hosts: dict[str, "HostLimiter"] = {}
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.limit = float(config["http_concurrency_initial"])
+        self.in_flight = 0
+        self.waiters: deque = deque()
+        # 延迟的指数移动平均(秒)
+        self.latency = config["http_latency_target"]
+        self.last_decrease = 0.0
+        self.blocked_until = 0.0
+
+    @staticmethod
+    def for_url(url: str) -> "HostLimiter":
+        host = urlsplit(url).netloc
+        limiter = HostLimiter._hosts.get(host)
+        if limiter is None:
+            limiter = HostLimiter._hosts[host] = HostLimiter(host)
+        return limiter
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                # 被唤醒时 _wake 已经占用了位置
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                raise
+        # Retry-After 期间占着位置等待
+        wait = self.blocked_until - time.monotonic()
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self.in_flight -= 1
+                self._wake()
+                raise
+
+    def _wake(self) -> None:
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(
+        self,
+        outcome: str,
+        latency: Union[float, None] = None,
+        retry_after: Union[float, None] = None,
+    ) -> None:
+        """归还位置并调整并发
+
+        Args:
+            outcome (str): "ok" | "throttle" | "error"
+            latency (Union[float, None], optional): 请求延迟(秒). Defaults to None.
+            retry_after (Union[float, None], optional): 服务端要求的等待时间(秒). Defaults to None.
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+        if latency is not None:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        if outcome == "ok":
+            if latency is None or latency <= config["http_latency_target"]:
+                self.limit = min(
+                    config["http_concurrency_max"], self.limit + 1 / self.limit
+                )
+        elif outcome == "throttle":
+            if now - self.last_decrease > self.latency:
+                self.limit = max(
+                    config["http_concurrency_min"],
+                    self.limit * config["http_concurrency_decrease"],
+                )
+                self.last_decrease = now
+                logger.info(f"Throttled by {self.host}, concurrency {self.limit:.1f}")
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+        Metrics.set("binance_http_concurrency_limit", self.limit, host=self.host)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[dict]:
+        """占用一个位置, 退出时按结果调整并发
+
+        eg:
+            async with limiter.slot() as slot:
+                response = await client.get(url)
+                slot["latency"] = ...
+        """
+        await self.acquire()
+        slot: dict = {"latency": None}
+        try:
+            yield slot
+        except BaseException as exc:
+            outcome, retry_after = HostLimiter.classify(exc)
+            self.release(outcome, slot["latency"], retry_after)
+            raise
+        self.release("ok", slot["latency"])
+
+    @staticmethod
+    def classify(exc: BaseException) -> tuple[str, Union[float, None]]:
+        """异常对应的结果和Retry-After秒数"""
+        if isinstance(exc, httpx.TimeoutException):
+            return "throttle", None
+        if (
+            isinstance(exc, httpx.HTTPStatusError)
+            and exc.response.status_code in THROTTLE_STATUS
+        ):
+            return "throttle", HostLimiter.retry_after(exc.response)
+        return "error", None
+
+    @staticmethod
+    def retry_after(response: httpx.Response) -> Union[float, None]:
+        """解析Retry-After, 可以是秒数或HTTP日期"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def backoff(
+        attempt: int, backoff_factor: float, exc: Union[BaseException, None] = None
+    ) -> float:
+        """指数退避加全抖动, 不少于Retry-After
+
+        Args:
+            attempt (int): 已失败的次数-1
+            backoff_factor (float): 第一次重试的最长等待(秒)
+            exc (Union[BaseException, None], optional): 本次的异常. Defaults to None.
+        """
+        cap = min(config["http_backoff_max"], backoff_factor * 2**attempt)
+        sleep_time = random.uniform(0, cap)
+        if exc is not None:
+            retry_after = HostLimiter.classify(exc)[1]
+            if retry_after:
+                sleep_time = max(sleep_time, retry_after)
+        return sleep_time
+
+
+class WebSession:
+    """
+    共享连接池的httpx客户端, 同一会话内的所有请求复用连接(keep-alive, 可选HTTP/2)
+
+    eg:
+        async with WebSession():
+            await WebGet.async_fetch_with_retry(url)
+    """
+
+    _active: Union["WebSession", None] = None
+
+    def __init__(self) -> None:
+        limits = httpx.Limits(
+            max_connections=config["http_max_connections"],
+            max_keepalive_connections=config["http_max_keepalive_connections"],
+            keepalive_expiry=config["http_keepalive_expiry"],
+        )
+        self.client = httpx.AsyncClient(limits=limits, http2=WebSession._use_http2())
+
+    @staticmethod
+    def _use_http2() -> bool:
+        if not config["http2"]:
+            return False
+        try:
+            import h2  # noqa
+        except ImportError:
+            logger.warning("http2 is enabled but h2 is not installed, use HTTP/1.1")
+            return False
+        return True
+
+    @staticmethod
+    def current() -> Union["WebSession", None]:
+        """当前打开的会话"""
+        return WebSession._active
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+        if WebSession._active is self:
+            WebSession._active = None
+
+    async def __aenter__(self) -> "WebSession":
+        WebSession._active = self
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
 
 
 class WebGet:
@@ -17,27 +241,44 @@ class WebGet:
         url, retries=20, timeout=5, backoff_factor=1
     ) -> str:
         """
-        使用 httpx 进行带重试和超时的异步请求
+        使用 httpx 进行带重试和超时的异步请求, 有打开的WebSession时复用其连接池,
+        并发由每个主机的 HostLimiter 控制
         :param url: 请求的URL
         :param retries: 最大重试次数
         :param timeout: 超时时间（秒）
-        :param backoff_factor: 每次重试增加的等待时间（秒）
+        :param backoff_factor: 第一次重试的最长等待时间（秒）, 之后每次翻倍, 加随机抖动
         :return: 请求的响应内容
         """
         for attempt in range(retries):
+            if attempt:
+                Metrics.inc("binance_http_retries_total")
             try:
-                async with semaphore:
-                    async with httpx.AsyncClient(timeout=timeout) as client:
-                        response = await client.get(url)
-                        response.raise_for_status()  # 如果响应状态码不是 2xx，抛出异常
-                        logger.info(f"Successfully fetched data from {url}")
-                        return response.text
+                async with HostLimiter.for_url(url).slot() as slot:
+                    start = time.perf_counter()
+                    session = WebSession.current()
+                    if session is not None:
+                        response = await session.client.get(url, timeout=timeout)
+                    else:
+                        async with httpx.AsyncClient(timeout=timeout) as client:
+                            response = await client.get(url)
+                    slot["latency"] = time.perf_counter() - start
+                    Metrics.observe("binance_http_request_seconds", slot["latency"])
+                    response.raise_for_status()  # 如果响应状态码不是 2xx，抛出异常
+                    logger.info(f"Successfully fetched data from {url}")
+                    Metrics.inc("binance_http_requests_total", outcome="ok")
+                    Metrics.inc(
+                        "binance_http_response_bytes_total", len(response.content)
+                    )
+                    return response.text
 
             except Exception as exc:
-                logger.warning(f"Attempt {attempt + 1} failed, url: {url}")
+                Metrics.inc("binance_http_requests_total", outcome="error")
+                logger.warning(
+                    f"Attempt {attempt + 1} failed, url: {url}, exception: {exc!r}"
+                )
                 if attempt < retries - 1:
-                    sleep_time = backoff_factor * (attempt + 1)
-                    logger.info(f"Retrying in {sleep_time} seconds...")
+                    sleep_time = HostLimiter.backoff(attempt, backoff_factor, exc)
+                    logger.info(f"Retrying in {sleep_time:.2f} seconds...")
                     await asyncio.sleep(sleep_time)
                 else:
                     logger.error(